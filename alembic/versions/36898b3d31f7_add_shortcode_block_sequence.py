@@ -0,0 +1,34 @@
+"""Add shortcode block sequence
+
+Revision ID: 36898b3d31f7
+Revises: a737043ea658
+Create Date: 2026-10-17 09:12:41.503118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.schema import CreateSequence, DropSequence
+
+
+# revision identifiers, used by Alembic.
+revision: str = '36898b3d31f7'
+down_revision: Union[str, Sequence[str], None] = 'a737043ea658'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute(CreateSequence(sa.Sequence('shortcode_block_seq')))
+    op.create_table('shortcode_blocks',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('shortcode_blocks')
+    op.execute(DropSequence(sa.Sequence('shortcode_block_seq')))
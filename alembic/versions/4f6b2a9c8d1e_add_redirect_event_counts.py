@@ -0,0 +1,37 @@
+"""Add redirect event counts
+
+Event log counts per shortcode, status and hour, filled only by
+python -m app.events aggregate.
+
+Revision ID: 4f6b2a9c8d1e
+Revises: e1348015d7d3
+Create Date: 2026-10-17 20:11:52.604183
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4f6b2a9c8d1e'
+down_revision: Union[str, Sequence[str], None] = 'e1348015d7d3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('redirect_event_counts',
+    sa.Column('shortcode', sa.String(length=255), nullable=False),
+    sa.Column('status', sa.Integer(), nullable=False),
+    sa.Column('hour', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('shortcode', 'status', 'hour')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('redirect_event_counts')
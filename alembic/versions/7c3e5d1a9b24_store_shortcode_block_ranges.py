@@ -0,0 +1,66 @@
+"""Store shortcode block ranges instead of block numbers
+
+Blocks used to start at block number * 1000, the default SHORTCODE_BLOCK_SIZE,
+which overlaps earlier blocks once the size changes. The sequence now counts
+IDs, with the block size as its increment, and shortcode_blocks records each
+range. Only plain SQL is emitted, so it also runs with --sql; a different
+block size is set afterwards with ALTER SEQUENCE ... INCREMENT BY.
+
+Revision ID: 7c3e5d1a9b24
+Revises: 4f6b2a9c8d1e
+Create Date: 2026-10-17 21:14:08.627310
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c3e5d1a9b24'
+down_revision: Union[str, Sequence[str], None] = '4f6b2a9c8d1e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# The default SHORTCODE_BLOCK_SIZE when this revision was written
+BLOCK_SIZE = 1000
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if op.get_context().dialect.name == 'postgresql':
+        # Block number n covered [n * size, (n + 1) * size), so the next free
+        # ID is where the next block number would have started
+        op.execute(
+            "SELECT setval('shortcode_block_seq', "
+            f'(CASE WHEN is_called THEN last_value + 2 ELSE last_value + 1 END) * {BLOCK_SIZE}, '
+            'false) FROM shortcode_block_seq')
+        op.execute(f'ALTER SEQUENCE shortcode_block_seq INCREMENT BY {BLOCK_SIZE}')
+
+    op.add_column('shortcode_blocks', sa.Column('start_id', sa.BigInteger(), nullable=True))
+    op.add_column('shortcode_blocks', sa.Column('end_id', sa.BigInteger(), nullable=True))
+    op.execute(f'UPDATE shortcode_blocks SET start_id = id * {BLOCK_SIZE}, '
+               f'end_id = (id + 1) * {BLOCK_SIZE}')
+    with op.batch_alter_table('shortcode_blocks') as batch_op:
+        batch_op.alter_column('start_id', existing_type=sa.BigInteger(), nullable=False)
+        batch_op.alter_column('end_id', existing_type=sa.BigInteger(), nullable=False)
+        batch_op.create_unique_constraint('shortcode_blocks_start_id_key', ['start_id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('shortcode_blocks') as batch_op:
+        batch_op.drop_constraint('shortcode_blocks_start_id_key', type_='unique')
+        batch_op.drop_column('end_id')
+        batch_op.drop_column('start_id')
+
+    if op.get_context().dialect.name == 'postgresql':
+        # Back to block numbers, starting after the last reserved range
+        op.execute(
+            "SELECT setval('shortcode_block_seq', GREATEST("
+            f'(CASE WHEN is_called THEN last_value ELSE last_value - seqincrement END '
+            f'+ {BLOCK_SIZE - 1}) / {BLOCK_SIZE}, 1), false) '
+            'FROM shortcode_block_seq, pg_sequence '
+            "WHERE seqrelid = 'shortcode_block_seq'::regclass")
+        op.execute('ALTER SEQUENCE shortcode_block_seq INCREMENT BY 1')
@@ -0,0 +1,35 @@
+"""Add processed event segments
+
+Names of event log segments folded into redirect_event_counts, written in the
+same transaction as their counts so no segment is applied twice.
+
+Revision ID: a5c81f3e2b67
+Revises: 7c3e5d1a9b24
+Create Date: 2026-10-18 09:42:17.215093
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a5c81f3e2b67'
+down_revision: Union[str, Sequence[str], None] = '7c3e5d1a9b24'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('processed_event_segments',
+    sa.Column('name', sa.String(length=255), nullable=False),
+    sa.Column('processed_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('processed_event_segments')
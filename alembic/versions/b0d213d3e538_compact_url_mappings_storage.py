@@ -0,0 +1,73 @@
+"""Compact url_mappings storage
+
+Drops the index duplicating the shortcode primary key, stores update_id as a
+native UUID and leaves free space on heap pages so redirect counter updates
+can be HOT updates.
+
+Revision ID: b0d213d3e538
+Revises: c22888a54792
+Create Date: 2026-10-17 14:21:09.512377
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b0d213d3e538'
+down_revision: Union[str, Sequence[str], None] = 'c22888a54792'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+FILLFACTOR = 90
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.drop_index(op.f('ix_url_mappings_shortcode'), table_name='url_mappings')
+
+    if op.get_bind().dialect.name == 'postgresql':
+        # Set before the type change, whose table rewrite then applies it
+        op.execute(f'ALTER TABLE url_mappings SET (fillfactor = {FILLFACTOR})')
+        op.execute(f'ALTER TABLE redirect_counts SET (fillfactor = {FILLFACTOR})')
+        op.alter_column('url_mappings', 'update_id',
+                        existing_type=sa.String(length=36),
+                        type_=sa.Uuid(),
+                        existing_nullable=False,
+                        postgresql_using='update_id::uuid')
+    else:
+        # Without a native type, UUIDs are stored as 32 hex digits
+        op.execute("UPDATE url_mappings SET update_id = lower(replace(update_id, '-', ''))")
+        with op.batch_alter_table('url_mappings') as batch_op:
+            batch_op.alter_column('update_id',
+                                  existing_type=sa.String(length=36),
+                                  type_=sa.Uuid(),
+                                  existing_nullable=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name == 'postgresql':
+        op.alter_column('url_mappings', 'update_id',
+                        existing_type=sa.Uuid(),
+                        type_=sa.String(length=36),
+                        existing_nullable=False,
+                        postgresql_using='update_id::text')
+        op.execute('ALTER TABLE redirect_counts RESET (fillfactor)')
+        op.execute('ALTER TABLE url_mappings RESET (fillfactor)')
+    else:
+        with op.batch_alter_table('url_mappings') as batch_op:
+            batch_op.alter_column('update_id',
+                                  existing_type=sa.Uuid(),
+                                  type_=sa.String(length=36),
+                                  existing_nullable=False)
+        op.execute(
+            "UPDATE url_mappings SET update_id = "
+            "substr(update_id, 1, 8) || '-' || substr(update_id, 9, 4) || '-' || "
+            "substr(update_id, 13, 4) || '-' || substr(update_id, 17, 4) || '-' || "
+            "substr(update_id, 21)"
+        )
+
+    op.create_index(op.f('ix_url_mappings_shortcode'), 'url_mappings', ['shortcode'], unique=False)
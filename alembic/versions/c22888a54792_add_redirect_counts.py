@@ -0,0 +1,34 @@
+"""Add redirect counts
+
+Revision ID: c22888a54792
+Revises: 36898b3d31f7
+Create Date: 2026-10-17 11:02:17.318546
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c22888a54792'
+down_revision: Union[str, Sequence[str], None] = '36898b3d31f7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('redirect_counts',
+    sa.Column('shortcode', sa.String(length=255), nullable=False),
+    sa.Column('granularity', sa.String(length=5), nullable=False),
+    sa.Column('bucket', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('shortcode', 'granularity', 'bucket')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('redirect_counts')
@@ -0,0 +1,36 @@
+"""Add url_hash for deduplicated shortens
+
+A digest of the normalized URL on mappings created with SHORTEN_DEDUP, under
+a partial unique index so each URL has at most one such mapping. Existing
+mappings are left without a hash and are never handed out again.
+
+Revision ID: e1348015d7d3
+Revises: b0d213d3e538
+Create Date: 2026-10-17 18:02:41.336104
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e1348015d7d3'
+down_revision: Union[str, Sequence[str], None] = 'b0d213d3e538'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('url_mappings', sa.Column('url_hash', sa.LargeBinary(length=16), nullable=True))
+    op.create_index('ix_url_mappings_url_hash', 'url_mappings', ['url_hash'], unique=True,
+                    postgresql_where=sa.text('url_hash IS NOT NULL'),
+                    sqlite_where=sa.text('url_hash IS NOT NULL'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_url_mappings_url_hash', table_name='url_mappings')
+    op.drop_column('url_mappings', 'url_hash')
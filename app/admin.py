@@ -0,0 +1,131 @@
+import os
+import secrets
+from typing import Literal, Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, status
+from fastapi.responses import HTMLResponse, PlainTextResponse
+
+from app.admission import admission_controller
+from app.bloom import shortcode_filter
+from app.cache import url_cache
+from app import database
+from app.database import get_pool_stats
+from app.events import event_log
+from app.profiling import profile_store, profiling_available, render_profile
+from app.sharding import COORDINATOR_SHARD
+from app.singleflight import redirect_lookups
+
+# Token for the /admin endpoints; they are disabled while it is unset
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+
+def is_admin_token(token: Optional[str]) -> bool:
+    """Check a token against ADMIN_TOKEN in constant time"""
+    return bool(ADMIN_TOKEN and token) and secrets.compare_digest(
+        token.encode(), ADMIN_TOKEN.encode()
+    )
+
+
+async def require_admin(x_admin_token: Optional[str] = Header(default=None)):
+    """Only allow requests that carry the admin token"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if not is_admin_token(x_admin_token):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid admin token"
+        )
+
+
+router = APIRouter(
+    prefix="/admin", tags=["Admin"], dependencies=[Depends(require_admin)]
+)
+
+
+@router.get("/pool")
+async def pool_stats():
+    """
+    Get live connection pool usage: checked-out connections, overflow,
+    checkout wait times and timeouts. The main database is reported at the
+    top level, other shards and read replicas each under their own key.
+    """
+    engines = database.shard_engines
+    return {
+        **get_pool_stats(engines[COORDINATOR_SHARD]),
+        "shards": {
+            shard_id: get_pool_stats(engine)
+            for shard_id, engine in engines.items()
+            if shard_id != COORDINATOR_SHARD
+        },
+        "replicas": [
+            get_pool_stats(engine) for engine in database.replica_router.engines
+        ],
+    }
+
+
+@router.get("/cache")
+async def cache_stats():
+    """
+    Get redirect cache usage: backend, size, and this process's hits, misses
+    and evictions, and how many cache misses shared a lookup.
+    """
+    return {**url_cache.stats(), "lookups": redirect_lookups.stats()}
+
+
+@router.get("/filter")
+async def filter_stats():
+    """
+    Get shortcode filter state: fill level, estimated false-positive rate, and
+    this process's lookups and definite negatives.
+    """
+    return shortcode_filter.stats()
+
+
+@router.get("/admission")
+async def admission_stats():
+    """
+    Get admission control state: requests in flight per route class, queries
+    waiting for a connection, and this process's admitted and rejected requests.
+    """
+    return admission_controller.stats()
+
+
+@router.get("/events")
+async def event_log_stats():
+    """
+    Get redirect event log usage: events queued in memory, written and dropped.
+    """
+    return event_log.stats()
+
+
+def require_profiling():
+    """Hide the profile endpoints while profiling is off"""
+    if not profiling_available():
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Profiling is disabled"
+        )
+
+
+@router.get("/profiles", dependencies=[Depends(require_profiling)])
+async def list_profiles():
+    """
+    List the stored request profiles, newest first, with the method, path,
+    route, status and duration of each request.
+    """
+    return {"profiles": profile_store.list()}
+
+
+@router.get("/profiles/{name}", dependencies=[Depends(require_profiling)])
+async def get_profile(name: str, format: Literal["html", "text"] = "html"):
+    """
+    Get a stored request profile as pyinstrument's interactive HTML page or as
+    a text call tree.
+    """
+    profile = profile_store.load(name)
+    if profile is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found"
+        )
+    _, session = profile
+    if format == "text":
+        return PlainTextResponse(render_profile(session, "text"))
+    return HTMLResponse(render_profile(session, "html"))
@@ -0,0 +1,265 @@
+"""
+Admission control and load shedding ahead of the database.
+
+With ADMISSION_ENABLED, each request is classed as a redirect, a read (the
+stats endpoints, including POST /stats/batch) or a write (shorten and
+update) and is only let through if
+
+- its client still has a token in its bucket (ADMISSION_CLIENT_RATE per
+  second, bursts of ADMISSION_CLIENT_BURST), otherwise it gets 429;
+- fewer requests of its class are in flight than ADMISSION_CONCURRENCY
+  allows, otherwise 503;
+- at most ADMISSION_MAX_POOL_WAITERS queries are waiting for a database
+  connection, otherwise 503.
+
+Rejected requests are answered at once with Retry-After instead of queueing
+for a connection, so a spike is shed at the door rather than slowing every
+request down until timeouts cascade. Limits apply per worker process. The
+service endpoints (/, /ready, /metrics, /docs and /admin) are never limited.
+"""
+
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+from fastapi import status
+from fastapi.responses import JSONResponse
+
+from app.database import connection_waiters
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "false").lower() == "true"
+# Requests per second each client may make on average; 0 disables rate limiting
+ADMISSION_CLIENT_RATE = float(os.getenv("ADMISSION_CLIENT_RATE", "50"))
+# Requests a client may make at once after being idle
+ADMISSION_CLIENT_BURST = float(os.getenv("ADMISSION_CLIENT_BURST", "100"))
+# Clients whose buckets are kept; the least recently seen are forgotten
+ADMISSION_MAX_CLIENTS = int(os.getenv("ADMISSION_MAX_CLIENTS", "100000"))
+# Header naming the client, such as X-Forwarded-For behind a proxy; when unset
+# the peer address is used
+ADMISSION_CLIENT_HEADER = os.getenv("ADMISSION_CLIENT_HEADER")
+# Requests in flight per route class; 0 means unlimited
+ADMISSION_CONCURRENCY = os.getenv(
+    "ADMISSION_CONCURRENCY", "redirect=256,read=64,write=32"
+)
+# Queries waiting for a pooled connection beyond which requests are shed
+ADMISSION_MAX_POOL_WAITERS = int(os.getenv("ADMISSION_MAX_POOL_WAITERS", "32"))
+# Retry-After sent with 503 responses
+ADMISSION_RETRY_AFTER_SECONDS = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "1"))
+
+ROUTE_CLASSES = ("redirect", "read", "write")
+EXEMPT_PATHS = frozenset(
+    [
+        "/",
+        "/ready",
+        "/metrics",
+        "/docs",
+        "/docs/oauth2-redirect",
+        "/redoc",
+        "/openapi.json",
+    ]
+)
+
+
+def parse_limits(spec: str) -> Dict[str, int]:
+    """Parse "redirect=256,read=64" into concurrency limits per route class"""
+    limits = {}
+    for part in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, limit = part.partition("=")
+        name = name.strip()
+        if name not in ROUTE_CLASSES:
+            raise ValueError(
+                f"Unknown route class {name!r}, expected one of {list(ROUTE_CLASSES)}"
+            )
+        limits[name] = int(limit)
+    return limits
+
+
+def route_class(method: str, path: str) -> Optional[str]:
+    """Class of a request for admission, or None if it is never limited"""
+    if path in EXEMPT_PATHS or path.startswith("/admin/"):
+        return None
+    if path == "/stats/batch":
+        return "read"
+    if method == "POST":
+        return "write"
+    segments = path.strip("/").split("/")
+    if segments[1:] in (["stats"], ["stats", "timeseries"]):
+        return "read"
+    return "redirect"
+
+
+class TokenBuckets:
+    """Token bucket rate limit per key, for the most recently seen keys"""
+
+    def __init__(
+        self,
+        rate: float,
+        burst: float,
+        max_keys: int = ADMISSION_MAX_CLIENTS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.max_keys = max_keys
+        self._clock = clock
+        # key -> [tokens, time of the last refill]
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+
+    def take(self, key: str) -> float:
+        """Take a token; 0 if there was one, else seconds until there is"""
+        now = self._clock()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.burst, now]
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        return (1 - bucket[0]) / self.rate
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class AdmissionController:
+    """Decides which requests are let through and counts the outcomes"""
+
+    def __init__(
+        self,
+        client_rate: float = ADMISSION_CLIENT_RATE,
+        client_burst: float = ADMISSION_CLIENT_BURST,
+        concurrency: Optional[Dict[str, int]] = None,
+        max_pool_waiters: int = ADMISSION_MAX_POOL_WAITERS,
+        pool_waiters: Callable[[], int] = connection_waiters,
+        retry_after: int = ADMISSION_RETRY_AFTER_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.buckets = (
+            TokenBuckets(client_rate, client_burst, clock=clock)
+            if client_rate > 0
+            else None
+        )
+        self.concurrency = (
+            parse_limits(ADMISSION_CONCURRENCY) if concurrency is None else concurrency
+        )
+        self.max_pool_waiters = max_pool_waiters
+        self.pool_waiters = pool_waiters
+        self.retry_after = retry_after
+        self.in_flight = {name: 0 for name in ROUTE_CLASSES}
+        self.admitted = 0
+        self.rejected = {"rate_limited": 0, "concurrency": 0, "pool": 0}
+
+    def admit(self, route: str, client: str) -> Optional[JSONResponse]:
+        """
+        Count a request of a route class as in flight and return None, or
+        return the response rejecting it.
+        """
+        if self.buckets is not None:
+            wait = self.buckets.take(client)
+            if wait:
+                self.rejected["rate_limited"] += 1
+                return self._reject(
+                    status.HTTP_429_TOO_MANY_REQUESTS,
+                    "Too many requests",
+                    math.ceil(wait),
+                )
+
+        limit = self.concurrency.get(route, 0)
+        if limit and self.in_flight[route] >= limit:
+            self.rejected["concurrency"] += 1
+            return self._reject(
+                status.HTTP_503_SERVICE_UNAVAILABLE,
+                "Server is busy",
+                self.retry_after,
+            )
+
+        if self.max_pool_waiters and self.pool_waiters() >= self.max_pool_waiters:
+            self.rejected["pool"] += 1
+            return self._reject(
+                status.HTTP_503_SERVICE_UNAVAILABLE,
+                "Server is busy",
+                self.retry_after,
+            )
+
+        self.in_flight[route] += 1
+        self.admitted += 1
+        return None
+
+    def release(self, route: str) -> None:
+        """Mark an admitted request as finished"""
+        self.in_flight[route] -= 1
+
+    def _reject(self, status_code: int, detail: str, retry_after: int) -> JSONResponse:
+        return JSONResponse(
+            {"detail": detail},
+            status_code=status_code,
+            headers={"Retry-After": str(max(retry_after, 1))},
+        )
+
+    def stats(self) -> dict:
+        return {
+            "enabled": ADMISSION_ENABLED,
+            "in_flight": dict(self.in_flight),
+            "concurrency_limits": dict(self.concurrency),
+            "pool_waiters": self.pool_waiters(),
+            "max_pool_waiters": self.max_pool_waiters,
+            "clients_tracked": len(self.buckets) if self.buckets is not None else 0,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+        }
+
+
+class AdmissionMiddleware:
+    """ASGI middleware letting requests through an AdmissionController"""
+
+    def __init__(
+        self,
+        app,
+        controller: AdmissionController,
+        client_header: Optional[str] = ADMISSION_CLIENT_HEADER,
+    ):
+        self.app = app
+        self.controller = controller
+        self.client_header = (
+            client_header.lower().encode("latin-1") if client_header else None
+        )
+
+    def _client(self, scope) -> str:
+        if self.client_header is not None:
+            for name, value in scope["headers"]:
+                if name == self.client_header:
+                    # The first address of X-Forwarded-For is the original client
+                    return value.decode("latin-1").split(",")[0].strip()
+        client = scope.get("client")
+        return client[0] if client else ""
+
+    async def __call__(self, scope, receive, send):
+        route = (
+            route_class(scope["method"], scope["path"])
+            if scope["type"] == "http"
+            else None
+        )
+        if route is None:
+            await self.app(scope, receive, send)
+            return
+
+        rejection = self.controller.admit(route, self._client(scope))
+        if rejection is not None:
+            await rejection(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(route)
+
+
+# Admission state of this process, shown by /admin/admission
+admission_controller = AdmissionController()
@@ -0,0 +1,471 @@
+"""
+Bloom filter of existing shortcodes.
+
+The filter answers "definitely absent" for shortcodes that were never created,
+so scanners and typos get their 404 without a database query. It is built at
+startup from a keyset scan over every shard, learns shortcodes created through
+the API as they are created, and is rebuilt every
+SHORTCODE_FILTER_REBUILD_SECONDS to pick up rows written elsewhere, such as
+imports. Until the first build finishes every shortcode may exist.
+
+Keep it on only while every process that creates shortcodes shares the filter:
+a single worker, or the workers of one host with URL_CACHE_BACKEND=shared,
+which puts the filter in shared memory. Shortcodes created by processes that
+do not share it are reported absent until the next rebuild, so app.serve
+refuses to start several workers without the shared backend.
+"""
+
+import asyncio
+import hashlib
+import logging
+import math
+import os
+import struct
+import tempfile
+import time
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from app import crud
+from app.cache import URL_CACHE_BACKEND, fcntl
+from app.database import AsyncSessionLocal
+from app.sharding import shard_ids_of
+
+logger = logging.getLogger(__name__)
+
+SHORTCODE_FILTER_ENABLED = (
+    os.getenv("SHORTCODE_FILTER_ENABLED", "false").lower() == "true"
+)
+# Shortcodes the filter is sized for at SHORTCODE_FILTER_ERROR_RATE
+SHORTCODE_FILTER_CAPACITY = int(os.getenv("SHORTCODE_FILTER_CAPACITY", "1000000"))
+SHORTCODE_FILTER_ERROR_RATE = float(os.getenv("SHORTCODE_FILTER_ERROR_RATE", "0.01"))
+# Seconds between rebuilds from the database; 0 only builds at startup
+SHORTCODE_FILTER_REBUILD_SECONDS = float(
+    os.getenv("SHORTCODE_FILTER_REBUILD_SECONDS", "3600")
+)
+SHORTCODE_FILTER_SHM_NAME = os.getenv(
+    "SHORTCODE_FILTER_SHM_NAME", "url_shortener_filter"
+)
+
+# Shortcodes read per query while rebuilding
+SCAN_BATCH_SIZE = 10000
+# Shortcodes hashed between yields to the event loop while rebuilding
+_REBUILD_CHUNK = 1000
+
+
+def filter_size(capacity: int, error_rate: float) -> Tuple[int, int]:
+    """Bits and hash functions for a Bloom filter of capacity keys at error_rate"""
+    capacity = max(capacity, 1)
+    bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+    hashes = max(1, round(bits / capacity * math.log(2)))
+    return bits, hashes
+
+
+class BloomFilter:
+    """
+    Bloom filter over two bit arrays, so it can be rebuilt while in use.
+
+    Lookups read the active array. A rebuild clears the other array, fills it
+    from the database and then makes it the active one; keys added meanwhile
+    go into both arrays, so the swap loses none of them. The header keeps the
+    state in the buffer itself, so SharedBloomFilter can put it in shared
+    memory unchanged.
+    """
+
+    MAGIC = b"SCFILTER"
+    HEADER_SIZE = 128
+    # Header fields: offset and format
+    _BITS = (8, struct.Struct("<Q"))
+    _HASHES = (16, struct.Struct("<I"))
+    _ACTIVE = 20
+    _BUILDING = 21
+    _READY = 22
+    _BUILDER = (24, struct.Struct("<I"))
+    _BUILT_AT = (32, struct.Struct("<d"))
+    _GENERATION = (40, struct.Struct("<Q"))
+    # Per array: bits set and keys added
+    _SET_BITS = ((48, struct.Struct("<Q")), (56, struct.Struct("<Q")))
+    _ITEMS = ((64, struct.Struct("<Q")), (72, struct.Struct("<Q")))
+
+    backend = "memory"
+
+    def __init__(
+        self,
+        capacity: int = SHORTCODE_FILTER_CAPACITY,
+        error_rate: float = SHORTCODE_FILTER_ERROR_RATE,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bits, self.hashes = filter_size(capacity, error_rate)
+        self.array_bytes = (self.bits + 7) // 8
+        self._clock = clock
+        self._buf = self._allocate(self.HEADER_SIZE + 2 * self.array_bytes)
+
+    def _header(self) -> bytes:
+        header = bytearray(self.HEADER_SIZE)
+        header[:8] = self.MAGIC
+        self._set_field(self._BITS, self.bits, header)
+        self._set_field(self._HASHES, self.hashes, header)
+        return bytes(header[:20])
+
+    def _allocate(self, size: int):
+        buf = bytearray(size)
+        buf[:20] = self._header()
+        return buf
+
+    @contextmanager
+    def _locked(self):
+        """Serialize writers; a single event loop needs no lock"""
+        yield
+
+    def _field(self, field) -> int:
+        offset, fmt = field
+        return fmt.unpack_from(self._buf, offset)[0]
+
+    def _set_field(self, field, value, buf=None) -> None:
+        offset, fmt = field
+        fmt.pack_into(self._buf if buf is None else buf, offset, value)
+
+    def _positions(self, key: str) -> List[int]:
+        # Double hashing: k positions from two 64-bit halves of one digest
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def _array_offset(self, array: int) -> int:
+        return self.HEADER_SIZE + array * self.array_bytes
+
+    def _set_bits(self, array: int, positions: List[int]) -> None:
+        buf = self._buf
+        base = self._array_offset(array)
+        newly_set = 0
+        for position in positions:
+            index = base + (position >> 3)
+            mask = 1 << (position & 7)
+            if not buf[index] & mask:
+                buf[index] |= mask
+                newly_set += 1
+        if newly_set:
+            field = self._SET_BITS[array]
+            self._set_field(field, self._field(field) + newly_set)
+
+    def _insert(self, arrays: List[int], keys: Iterable[str]) -> None:
+        count = 0
+        for key in keys:
+            positions = self._positions(key)
+            for array in arrays:
+                self._set_bits(array, positions)
+            count += 1
+        for array in arrays:
+            field = self._ITEMS[array]
+            self._set_field(field, self._field(field) + count)
+
+    @property
+    def ready(self) -> bool:
+        return bool(self._buf[self._READY])
+
+    def might_contain(self, key: str) -> bool:
+        """False only if the key was never added; True until the first build"""
+        buf = self._buf
+        if not buf[self._READY]:
+            return True
+        base = self._array_offset(buf[self._ACTIVE])
+        for position in self._positions(key):
+            if not buf[base + (position >> 3)] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add_many(self, keys: Iterable[str]) -> None:
+        """Add keys to the active array, and to the one being rebuilt"""
+        with self._locked():
+            active = self._buf[self._ACTIVE]
+            arrays = [active, 1 - active] if self._buf[self._BUILDING] else [active]
+            self._insert(arrays, keys)
+
+    def add(self, key: str) -> None:
+        self.add_many([key])
+
+    def begin_rebuild(self, min_age: float = 0.0) -> bool:
+        """
+        Clear the inactive array for a rebuild. Returns False when another
+        rebuild is running, or the filter was built less than min_age ago.
+        """
+        with self._locked():
+            if self._buf[self._BUILDING] and self._builder_running():
+                return False
+            if self.ready and self._clock() - self._field(self._BUILT_AT) < min_age:
+                return False
+            inactive = 1 - self._buf[self._ACTIVE]
+            start = self._array_offset(inactive)
+            self._buf[start : start + self.array_bytes] = bytes(self.array_bytes)
+            self._set_field(self._SET_BITS[inactive], 0)
+            self._set_field(self._ITEMS[inactive], 0)
+            self._set_field(self._BUILDER, os.getpid())
+            self._buf[self._BUILDING] = 1
+            return True
+
+    def fill(self, keys: Iterable[str]) -> None:
+        """Add keys read from the database to the array being rebuilt"""
+        with self._locked():
+            self._insert([1 - self._buf[self._ACTIVE]], keys)
+
+    def finish_rebuild(self) -> None:
+        """Make the rebuilt array the active one"""
+        with self._locked():
+            self._buf[self._ACTIVE] = 1 - self._buf[self._ACTIVE]
+            self._buf[self._BUILDING] = 0
+            self._buf[self._READY] = 1
+            self._set_field(self._BUILT_AT, self._clock())
+            self._set_field(self._GENERATION, self._field(self._GENERATION) + 1)
+
+    def abort_rebuild(self) -> None:
+        with self._locked():
+            self._buf[self._BUILDING] = 0
+
+    def _builder_running(self) -> bool:
+        return self._field(self._BUILDER) == os.getpid()
+
+    def clear(self) -> None:
+        """Forget all keys; every key may exist until the next build"""
+        with self._locked():
+            size = 2 * self.array_bytes + self.HEADER_SIZE - 20
+            self._buf[20:] = bytes(size)
+
+    def stats(self) -> dict:
+        """Fill level and estimated false-positive rate of the active array"""
+        active = self._buf[self._ACTIVE]
+        fill_ratio = self._field(self._SET_BITS[active]) / self.bits
+        built_at = self._field(self._BUILT_AT)
+        return {
+            "backend": self.backend,
+            "ready": self.ready,
+            "building": bool(self._buf[self._BUILDING]),
+            "generation": self._field(self._GENERATION),
+            "built_at": built_at or None,
+            "capacity": self.capacity,
+            "target_error_rate": self.error_rate,
+            "bits": self.bits,
+            "hashes": self.hashes,
+            "items": self._field(self._ITEMS[active]),
+            "fill_ratio": round(fill_ratio, 6),
+            "false_positive_rate": round(fill_ratio**self.hashes, 6),
+        }
+
+
+class SharedBloomFilter(BloomFilter):
+    """
+    BloomFilter in a shared memory segment, used by every worker on a host.
+
+    Lookups read without a lock; writers serialize on a file lock, since
+    setting a bit rewrites its whole byte. One worker rebuilds at a time.
+    """
+
+    backend = "shared"
+
+    def __init__(
+        self,
+        capacity: int = SHORTCODE_FILTER_CAPACITY,
+        error_rate: float = SHORTCODE_FILTER_ERROR_RATE,
+        name: str = SHORTCODE_FILTER_SHM_NAME,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.name = name
+        self._lock_path = os.path.join(tempfile.gettempdir(), f"{name}.lock")
+        self._lock_file = open(self._lock_path, "a+b")
+        super().__init__(capacity, error_rate, clock)
+
+    def _allocate(self, size: int):
+        header = self._header()
+        try:
+            shm = shared_memory.SharedMemory(self.name, create=True, size=size)
+        except FileExistsError:
+            shm = shared_memory.SharedMemory(self.name)
+            # The creating process may still be writing the header
+            deadline = time.monotonic() + 1.0
+            while bytes(shm.buf[:8]) != self.MAGIC and time.monotonic() < deadline:
+                time.sleep(0.001)
+            if bytes(shm.buf[: len(header)]) != header or shm.size < size:
+                # Left behind by a run with other settings; replace it
+                logger.warning("Recreating shared shortcode filter %r", self.name)
+                shm.close()
+                shm.unlink()
+                return self._allocate(size)
+        else:
+            shm.buf[8 : len(header)] = header[8:]
+            shm.buf[:8] = self.MAGIC
+        # The segment outlives any single worker; unlink() removes it explicitly
+        resource_tracker.unregister(shm._name, "shared_memory")
+        self._shm = shm
+        return shm.buf
+
+    @contextmanager
+    def _locked(self):
+        if fcntl is None:
+            yield
+            return
+        fcntl.lockf(self._lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.lockf(self._lock_file, fcntl.LOCK_UN)
+
+    def _builder_running(self) -> bool:
+        builder = self._field(self._BUILDER)
+        try:
+            os.kill(builder, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def close(self) -> None:
+        """Detach from the segment without removing it"""
+        self._buf = None
+        self._shm.close()
+        self._lock_file.close()
+
+    def unlink(self) -> None:
+        """Remove the segment once no process needs it any more"""
+        # unlink() unregisters from the resource tracker, which __init__ already did
+        resource_tracker.register(self._shm._name, "shared_memory")
+        self._shm.unlink()
+        try:
+            os.remove(self._lock_path)
+        except FileNotFoundError:
+            pass
+
+
+class ShortcodeFilter:
+    """
+    Keeps a BloomFilter of existing shortcodes built from the database.
+
+    Without a filter every shortcode may exist, so callers can use it
+    unconditionally.
+    """
+
+    def __init__(
+        self,
+        bloom: Optional[BloomFilter],
+        session_factory=AsyncSessionLocal,
+        rebuild_interval: float = SHORTCODE_FILTER_REBUILD_SECONDS,
+        batch_size: int = SCAN_BATCH_SIZE,
+    ):
+        self.bloom = bloom
+        self.session_factory = session_factory
+        self.rebuild_interval = rebuild_interval
+        self.batch_size = batch_size
+        self.checks = 0
+        self.negatives = 0
+        self._rebuild_lock: Optional[asyncio.Lock] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.bloom is not None
+
+    def might_contain(self, shortcode: str) -> bool:
+        """False only if the shortcode definitely does not exist"""
+        if self.bloom is None:
+            return True
+        self.checks += 1
+        if self.bloom.might_contain(shortcode):
+            return True
+        self.negatives += 1
+        return False
+
+    def add(self, shortcode: str) -> None:
+        """Record a created shortcode"""
+        if self.bloom is not None:
+            self.bloom.add(shortcode)
+
+    def add_many(self, shortcodes: Iterable[str]) -> None:
+        if self.bloom is not None:
+            self.bloom.add_many(shortcodes)
+
+    async def rebuild(self, min_age: float = 0.0) -> bool:
+        """
+        Rebuild the filter from every shard, returning False if it was skipped
+        because another worker is rebuilding or rebuilt it within min_age.
+        """
+        if self.bloom is None:
+            return False
+        if self._rebuild_lock is None:
+            self._rebuild_lock = asyncio.Lock()
+
+        async with self._rebuild_lock:
+            if not self.bloom.begin_rebuild(min_age):
+                return False
+            try:
+                async with self.session_factory() as db:
+                    for shard_id in shard_ids_of(db):
+                        after = None
+                        while True:
+                            shortcodes = await crud.list_shortcodes(
+                                db, shard_id, after, self.batch_size
+                            )
+                            if not shortcodes:
+                                break
+                            for start in range(0, len(shortcodes), _REBUILD_CHUNK):
+                                self.bloom.fill(
+                                    shortcodes[start : start + _REBUILD_CHUNK]
+                                )
+                                # Hashing is CPU work; let requests run in between
+                                await asyncio.sleep(0)
+                            after = shortcodes[-1]
+            except BaseException:
+                self.bloom.abort_rebuild()
+                raise
+            self.bloom.finish_rebuild()
+            return True
+
+    async def start(self) -> None:
+        """Build the filter in the background and rebuild it periodically"""
+        if self.bloom is not None and self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+
+    async def _run(self) -> None:
+        # Workers sharing the filter skip a rebuild another one just did
+        min_age = self.rebuild_interval / 2
+        delay = 0.5
+        while True:
+            try:
+                await self.rebuild(min_age)
+            except Exception:
+                logger.exception("Failed to build the shortcode filter")
+                if not self.bloom.ready:
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, 60.0)
+                    continue
+            if self.rebuild_interval <= 0 and self.bloom.ready:
+                return
+            await asyncio.sleep(self.rebuild_interval or 1.0)
+
+    def stats(self) -> dict:
+        """Filter state plus this process's lookups and definite negatives"""
+        if self.bloom is None:
+            return {"enabled": False}
+        return {
+            "enabled": True,
+            **self.bloom.stats(),
+            "checks": self.checks,
+            "negatives": self.negatives,
+        }
+
+
+# Shortcode filter used by the redirect and shorten paths
+if not SHORTCODE_FILTER_ENABLED:
+    shortcode_filter = ShortcodeFilter(None)
+elif URL_CACHE_BACKEND == "shared":
+    shortcode_filter = ShortcodeFilter(SharedBloomFilter())
+else:
+    shortcode_filter = ShortcodeFilter(BloomFilter())
@@ -0,0 +1,464 @@
+import logging
+import os
+import struct
+import tempfile
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+from typing import Callable, Iterable, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+URL_CACHE_MAX_SIZE = int(os.getenv("URL_CACHE_MAX_SIZE", "10000"))
+URL_CACHE_TTL_SECONDS = float(os.getenv("URL_CACHE_TTL_SECONDS", "60"))
+# "memory" keeps a cache per process, "shared" one cache per host for all workers
+URL_CACHE_BACKEND = os.getenv("URL_CACHE_BACKEND", "memory")
+URL_CACHE_SHM_NAME = os.getenv("URL_CACHE_SHM_NAME", "url_shortener_cache")
+# Longer URLs are not cached by the shared backend
+URL_CACHE_SHARED_URL_BYTES = int(os.getenv("URL_CACHE_SHARED_URL_BYTES", "448"))
+
+# Invalidation counters, each shared by the shortcodes hashing to it
+GENERATION_COUNT = 4096
+
+
+class URLCache:
+    """
+    Bounded in-process cache of shortcode -> original URL.
+
+    Entries are evicted least-recently-used first once max_size is reached and
+    expire ttl seconds after they were stored. A max_size of 0 disables caching.
+
+    Invalidating a shortcode bumps its generation. A lookup that reads the
+    generation before querying the database and passes it to set() is not
+    cached when the shortcode was invalidated meanwhile, as its URL may be
+    the one just replaced.
+    """
+
+    def __init__(
+        self,
+        max_size: int = URL_CACHE_MAX_SIZE,
+        ttl: float = URL_CACHE_TTL_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._entries: "OrderedDict[str, tuple[str, float]]" = OrderedDict()
+        self._generations = [0] * GENERATION_COUNT
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, shortcode: str) -> Optional[str]:
+        """Return the cached URL for a shortcode, or None on a miss"""
+        entry = self._entries.get(shortcode)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        original_url, expires_at = entry
+        if expires_at <= self._clock():
+            del self._entries[shortcode]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(shortcode)
+        self.hits += 1
+        return original_url
+
+    def generation(self, shortcode: str) -> int:
+        """Invalidation count of a shortcode, to pass to set() after a lookup"""
+        return self._generations[zlib.crc32(shortcode.encode()) % GENERATION_COUNT]
+
+    def set(
+        self,
+        shortcode: str,
+        original_url: str,
+        generation: Optional[int] = None,
+        ttl: Optional[float] = None,
+    ) -> None:
+        """
+        Store a URL for a shortcode, evicting the least recently used entry if
+        full. A ttl shorter than the cache's own applies to this entry only.
+        """
+        if self.max_size <= 0:
+            return
+        if generation is not None and generation != self.generation(shortcode):
+            return
+
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        self._entries[shortcode] = (original_url, self._clock() + ttl)
+        self._entries.move_to_end(shortcode)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, shortcode: str) -> None:
+        """Drop a shortcode from the cache"""
+        self._entries.pop(shortcode, None)
+        self._generations[zlib.crc32(shortcode.encode()) % GENERATION_COUNT] += 1
+
+    def clear(self) -> None:
+        """Drop all entries and reset the counters"""
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self) -> dict:
+        """Return cache size and hit/miss/eviction counters"""
+        return {
+            "backend": "memory",
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class SharedURLCache:
+    """
+    Cache of shortcode -> original URL in a shared memory segment, so every
+    worker process on a host reads and invalidates one copy.
+
+    The segment holds a fixed-size open-addressing hash table with linear
+    probing. Each slot carries a version that writers make odd while they
+    change the slot, so readers never take a lock: they retry when the version
+    is odd or changed while they copied the slot. Writers serialize on striped
+    file locks. When all slots a key may probe are taken, the entry closest to
+    expiry is evicted. Invalidation generations, as in URLCache, follow the
+    slots in the segment.
+
+    The table has room for at least max_size entries. Shortcodes longer than
+    KEY_BYTES or URLs longer than url_bytes (encoded as UTF-8) are not cached.
+    """
+
+    MAGIC = b"URLCACHE"
+    # magic, slot count, slot size, URL bytes, generation count
+    HEADER = struct.Struct("<8sIIII")
+    HEADER_SIZE = 64
+    # version, state, key length, URL length, expiry, key hash
+    SLOT = struct.Struct("<IBBHdI")
+    SLOT_HEADER_SIZE = 24
+    KEY_BYTES = 64
+    GENERATION = struct.Struct("<I")
+
+    EMPTY, USED, DELETED = 0, 1, 2
+    # Slots probed from a key's home slot
+    PROBE_LIMIT = 8
+    # Slots covered by one writer lock
+    STRIPE_SLOTS = 256
+    READ_RETRIES = 16
+
+    def __init__(
+        self,
+        max_size: int = URL_CACHE_MAX_SIZE,
+        ttl: float = URL_CACHE_TTL_SECONDS,
+        name: str = URL_CACHE_SHM_NAME,
+        url_bytes: int = URL_CACHE_SHARED_URL_BYTES,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.name = name
+        self.url_bytes = url_bytes
+        self._clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # Keep the table at most about 80% full
+        slot_count = 1
+        while slot_count < max(max_size, 1) * 5 // 4:
+            slot_count *= 2
+        self.slot_count = slot_count
+        self.slot_size = self.SLOT_HEADER_SIZE + self.KEY_BYTES + url_bytes
+        self._generations_offset = self.HEADER_SIZE + self.slot_count * self.slot_size
+        self._shm = self._open_segment(
+            self._generations_offset + GENERATION_COUNT * self.GENERATION.size
+        )
+        self._buf = self._shm.buf
+        self._lock_path = os.path.join(tempfile.gettempdir(), f"{name}.lock")
+        self._lock_file = open(self._lock_path, "a+b")
+
+    def _open_segment(self, size: int) -> shared_memory.SharedMemory:
+        header = self.HEADER.pack(
+            self.MAGIC,
+            self.slot_count,
+            self.slot_size,
+            self.url_bytes,
+            GENERATION_COUNT,
+        )
+        try:
+            shm = shared_memory.SharedMemory(self.name, create=True, size=size)
+        except FileExistsError:
+            shm = shared_memory.SharedMemory(self.name)
+            # The creating process may still be writing the header
+            deadline = time.monotonic() + 1.0
+            while bytes(shm.buf[:8]) != self.MAGIC and time.monotonic() < deadline:
+                time.sleep(0.001)
+            if bytes(shm.buf[: self.HEADER.size]) != header:
+                # Left behind by a run with other settings; replace it
+                logger.warning("Recreating shared URL cache %r", self.name)
+                shm.close()
+                shm.unlink()
+                return self._open_segment(size)
+        else:
+            shm.buf[8 : self.HEADER.size] = header[8:]
+            shm.buf[:8] = self.MAGIC
+        # The segment outlives any single worker; unlink() removes it explicitly
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+    def _home(self, key: bytes) -> tuple:
+        key_hash = zlib.crc32(key)
+        return key_hash, key_hash & (self.slot_count - 1)
+
+    def _probe(self, home: int) -> Iterable[int]:
+        for step in range(min(self.PROBE_LIMIT, self.slot_count)):
+            yield (home + step) & (self.slot_count - 1)
+
+    def _offset(self, index: int) -> int:
+        return self.HEADER_SIZE + index * self.slot_size
+
+    def _generation_offset(self, key_hash: int) -> int:
+        return (
+            self._generations_offset
+            + (key_hash % GENERATION_COUNT) * self.GENERATION.size
+        )
+
+    def _read_slot(self, index: int) -> Optional[tuple]:
+        """Consistent copy of a slot: (state, key, expiry, hash, URL bytes)"""
+        offset = self._offset(index)
+        for _ in range(self.READ_RETRIES):
+            version = self.SLOT.unpack_from(self._buf, offset)[0]
+            if version & 1:
+                continue
+            raw = bytes(self._buf[offset : offset + self.slot_size])
+            if self.SLOT.unpack_from(self._buf, offset)[0] != version:
+                continue
+            _, state, key_len, url_len, expires_at, key_hash = self.SLOT.unpack_from(
+                raw
+            )
+            key_start = self.SLOT_HEADER_SIZE
+            url_start = key_start + self.KEY_BYTES
+            return (
+                state,
+                raw[key_start : key_start + key_len],
+                expires_at,
+                key_hash,
+                raw[url_start : url_start + url_len],
+            )
+        return None
+
+    def _write_slot(
+        self,
+        index: int,
+        state: int,
+        key: bytes = b"",
+        url: bytes = b"",
+        expires_at: float = 0.0,
+        key_hash: int = 0,
+    ) -> None:
+        offset = self._offset(index)
+        # Odd when a writer died mid-write; the slot is then already marked
+        version = self.SLOT.unpack_from(self._buf, offset)[0] | 1
+        struct.pack_into("<I", self._buf, offset, version & 0xFFFFFFFF)
+        key_start = offset + self.SLOT_HEADER_SIZE
+        url_start = key_start + self.KEY_BYTES
+        self._buf[key_start : key_start + len(key)] = key
+        self._buf[url_start : url_start + len(url)] = url
+        self.SLOT.pack_into(
+            self._buf,
+            offset,
+            version & 0xFFFFFFFF,
+            state,
+            len(key),
+            len(url),
+            expires_at,
+            key_hash,
+        )
+        struct.pack_into("<I", self._buf, offset, (version + 1) & 0xFFFFFFFF)
+
+    def _read_locked_slot(self, index: int) -> tuple:
+        """
+        Read a slot while holding its lock. A slot that never reads
+        consistently was left half-written by a writer that died, and is reset
+        to a deleted one so probing carries on past it.
+        """
+        slot = self._read_slot(index)
+        if slot is None:
+            self._write_slot(index, self.DELETED)
+            slot = (self.DELETED, b"", 0.0, 0, b"")
+        return slot
+
+    @contextmanager
+    def _locked(self, home: Optional[int] = None):
+        """Hold the writer locks for the slots probed from home, or for all slots"""
+        if fcntl is None:
+            yield
+            return
+        if home is None:
+            stripes = [(0, 0)]
+        else:
+            first = home // self.STRIPE_SLOTS
+            last = ((home + self.PROBE_LIMIT - 1) & (self.slot_count - 1)) // (
+                self.STRIPE_SLOTS
+            )
+            stripes = [(1, stripe) for stripe in sorted({first, last})]
+        for length, start in stripes:
+            fcntl.lockf(self._lock_file, fcntl.LOCK_EX, length, start)
+        try:
+            yield
+        finally:
+            for length, start in reversed(stripes):
+                fcntl.lockf(self._lock_file, fcntl.LOCK_UN, length, start)
+
+    def get(self, shortcode: str) -> Optional[str]:
+        """Return the cached URL for a shortcode, or None on a miss"""
+        key = shortcode.encode()
+        key_hash, home = self._home(key)
+        now = self._clock()
+        for index in self._probe(home):
+            slot = self._read_slot(index)
+            if slot is None or slot[0] == self.EMPTY:
+                break
+            state, slot_key, expires_at, slot_hash, url = slot
+            if state == self.USED and slot_hash == key_hash and slot_key == key:
+                if expires_at <= now:
+                    break
+                self.hits += 1
+                return url.decode()
+        self.misses += 1
+        return None
+
+    def generation(self, shortcode: str) -> int:
+        """Invalidation count of a shortcode, to pass to set() after a lookup"""
+        key_hash = zlib.crc32(shortcode.encode())
+        return self.GENERATION.unpack_from(
+            self._buf, self._generation_offset(key_hash)
+        )[0]
+
+    def set(
+        self,
+        shortcode: str,
+        original_url: str,
+        generation: Optional[int] = None,
+        ttl: Optional[float] = None,
+    ) -> None:
+        """
+        Store a URL for a shortcode, evicting the entry closest to expiry if
+        full. A ttl shorter than the cache's own applies to this entry only.
+        """
+        key = shortcode.encode()
+        url = original_url.encode()
+        if self.max_size <= 0 or len(key) > self.KEY_BYTES or len(url) > self.url_bytes:
+            return
+
+        key_hash, home = self._home(key)
+        now = self._clock()
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        # invalidate() holds the same lock while it bumps the generation
+        with self._locked(home):
+            if generation is not None and generation != self.generation(shortcode):
+                return
+            target = None
+            free = None
+            oldest = None
+            for index in self._probe(home):
+                state, slot_key, expires_at, slot_hash, _ = self._read_locked_slot(
+                    index
+                )
+                if state == self.USED and slot_hash == key_hash and slot_key == key:
+                    target = index
+                    break
+                if state == self.EMPTY:
+                    if free is None:
+                        free = index
+                    break
+                if free is None and (state == self.DELETED or expires_at <= now):
+                    free = index
+                if oldest is None or expires_at < oldest[1]:
+                    oldest = (index, expires_at)
+
+            if target is None:
+                target = free
+            if target is None:
+                target = oldest[0]
+                self.evictions += 1
+            self._write_slot(target, self.USED, key, url, now + ttl, key_hash)
+
+    def invalidate(self, shortcode: str) -> None:
+        """Drop a shortcode from the cache in every process"""
+        key = shortcode.encode()
+        key_hash, home = self._home(key)
+        with self._locked(home):
+            offset = self._generation_offset(key_hash)
+            generation = self.GENERATION.unpack_from(self._buf, offset)[0]
+            self.GENERATION.pack_into(self._buf, offset, (generation + 1) & 0xFFFFFFFF)
+            for index in self._probe(home):
+                state, slot_key, _, slot_hash, _ = self._read_locked_slot(index)
+                if state == self.EMPTY:
+                    break
+                if state == self.USED and slot_hash == key_hash and slot_key == key:
+                    self._write_slot(index, self.DELETED)
+                    break
+
+    def clear(self) -> None:
+        """Drop all entries and reset this process's counters"""
+        with self._locked():
+            for index in range(self.slot_count):
+                slot = self._read_slot(index)
+                if slot is None or slot[0] != self.EMPTY:
+                    self._write_slot(index, self.EMPTY)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self) -> dict:
+        """Return shared cache size and this process's hit/miss/eviction counters"""
+        size = sum(
+            1
+            for index in range(self.slot_count)
+            if self._buf[self._offset(index) + 4] == self.USED
+        )
+        return {
+            "backend": "shared",
+            "size": size,
+            "max_size": self.max_size,
+            "slots": self.slot_count,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def close(self) -> None:
+        """Detach this process from the segment"""
+        self._buf = None
+        self._shm.close()
+        self._lock_file.close()
+
+    def unlink(self) -> None:
+        """Remove the segment once no process needs it any more"""
+        # unlink() unregisters from the resource tracker, which __init__ already did
+        resource_tracker.register(self._shm._name, "shared_memory")
+        self._shm.unlink()
+        try:
+            os.remove(self._lock_path)
+        except FileNotFoundError:
+            pass
+
+
+# Shared cache used by the redirect path
+if URL_CACHE_BACKEND == "shared":
+    url_cache = SharedURLCache()
+else:
+    url_cache = URLCache()
@@ -0,0 +1,242 @@
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Callable, Dict, Optional, Tuple
+
+from app import crud
+from app.database import AsyncSessionLocal
+from app.utils import truncate_timestamp
+
+logger = logging.getLogger(__name__)
+
+REDIRECT_FLUSH_INTERVAL_SECONDS = float(
+    os.getenv("REDIRECT_FLUSH_INTERVAL_SECONDS", "1.0")
+)
+REDIRECT_FLUSH_MAX_PENDING = int(os.getenv("REDIRECT_FLUSH_MAX_PENDING", "1000"))
+# Most shortcodes kept for a retry after failed flushes; redirects of further
+# shortcodes are dropped while the database stays unavailable
+REDIRECT_RETRY_MAX_PENDING = int(os.getenv("REDIRECT_RETRY_MAX_PENDING", "100000"))
+# Longest pause after failed flushes before max_pending triggers another one
+REDIRECT_RETRY_MAX_SECONDS = float(os.getenv("REDIRECT_RETRY_MAX_SECONDS", "30"))
+
+
+@dataclass
+class PendingRedirects:
+    """Redirects recorded for a shortcode that are not yet in the database"""
+
+    count: int
+    last_redirect: datetime
+    # Redirects per hour (UTC) not yet in the time series, including counted ones
+    hours: Dict[datetime, int] = field(default_factory=dict)
+
+    def merge(self, other: "PendingRedirects") -> None:
+        self.count += other.count
+        self.last_redirect = max(self.last_redirect, other.last_redirect)
+        for hour, count in other.hours.items():
+            self.hours[hour] = self.hours.get(hour, 0) + count
+
+
+class RedirectCounter:
+    """
+    Write-behind aggregator for redirect counts.
+
+    Redirects are collected per shortcode in memory and written to the
+    database as one batched update, either every flush_interval seconds or
+    as soon as max_pending shortcodes have pending redirects. Each flush also
+    adds the redirects to the hourly, daily and monthly time series.
+
+    A failed flush puts its redirects back for the next one, up to
+    retry_max_pending shortcodes, and holds off early flushes for a doubling
+    pause of up to retry_max_seconds.
+    """
+
+    def __init__(
+        self,
+        session_factory=AsyncSessionLocal,
+        flush_interval: float = REDIRECT_FLUSH_INTERVAL_SECONDS,
+        max_pending: int = REDIRECT_FLUSH_MAX_PENDING,
+        retry_max_pending: int = REDIRECT_RETRY_MAX_PENDING,
+        retry_max_seconds: float = REDIRECT_RETRY_MAX_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.session_factory = session_factory
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.retry_max_pending = retry_max_pending
+        self.retry_max_seconds = retry_max_seconds
+        self.dropped = 0
+        self._clock = clock
+        self._failures = 0
+        self._retry_at = 0.0
+        self._pending: Dict[str, PendingRedirects] = {}
+        self._flushing: Dict[str, PendingRedirects] = {}
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    def record(
+        self, shortcode: str, at: Optional[datetime] = None, counted: bool = False
+    ) -> None:
+        """
+        Record a redirect for a shortcode. Pass counted=True when the redirect
+        count was already incremented in the database, so only the time
+        series still needs it.
+        """
+        at = at or datetime.now(timezone.utc)
+        hour = truncate_timestamp(at, "hour")
+        pending = self._pending.get(shortcode)
+        if pending is None:
+            pending = self._pending[shortcode] = PendingRedirects(
+                count=0, last_redirect=at
+            )
+        else:
+            pending.last_redirect = max(pending.last_redirect, at)
+        if not counted:
+            pending.count += 1
+        pending.hours[hour] = pending.hours.get(hour, 0) + 1
+
+        if (
+            len(self._pending) >= self.max_pending
+            and self._flush_task is None
+            and self._clock() >= self._retry_at
+        ):
+            self._flush_task = asyncio.get_running_loop().create_task(self.flush())
+            self._flush_task.add_done_callback(self._clear_flush_task)
+
+    def pending(self, shortcode: str) -> Optional[PendingRedirects]:
+        """Get the redirects for a shortcode that are not yet in the database"""
+        merged = None
+        for batch in (self._flushing, self._pending):
+            pending = batch.get(shortcode)
+            if pending is None:
+                continue
+            if merged is None:
+                merged = PendingRedirects(0, pending.last_redirect)
+            merged.merge(pending)
+        return merged
+
+    def merge_pending(
+        self,
+        shortcode: str,
+        redirect_count: Optional[int],
+        last_redirect: Optional[datetime],
+    ) -> Tuple[int, Optional[datetime]]:
+        """Combine stored redirect stats with the pending redirects for a shortcode"""
+        redirect_count = redirect_count or 0
+        pending = self.pending(shortcode)
+        if pending is None:
+            return redirect_count, last_redirect
+
+        if last_redirect is None:
+            return redirect_count + pending.count, pending.last_redirect
+        if last_redirect.tzinfo is None:
+            # SQLite hands back naive datetimes; they are stored in UTC
+            last_redirect = last_redirect.replace(tzinfo=timezone.utc)
+        return (
+            redirect_count + pending.count,
+            max(last_redirect, pending.last_redirect),
+        )
+
+    async def flush(self) -> int:
+        """Write all pending redirects to the database, returning the number of shortcodes"""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+
+            batch = self._flushing = self._pending
+            self._pending = {}
+            try:
+                async with self.session_factory() as db:
+                    await crud.apply_redirect_counts(
+                        db,
+                        {
+                            shortcode: (pending.count, pending.last_redirect)
+                            for shortcode, pending in batch.items()
+                            if pending.count
+                        },
+                        {
+                            (shortcode, hour): count
+                            for shortcode, pending in batch.items()
+                            for hour, count in pending.hours.items()
+                        },
+                    )
+                    # Committed: the rows hold these redirects now, so stats
+                    # must stop adding them on top while the session closes
+                    self._flushing = {}
+            except Exception:
+                self._flushing = {}
+                self._requeue(batch)
+                self._failures += 1
+                self._retry_at = self._clock() + min(
+                    self.flush_interval * 2 ** (self._failures - 1),
+                    self.retry_max_seconds,
+                )
+                raise
+            self._failures = 0
+            self._retry_at = 0.0
+            return len(batch)
+
+    def _requeue(self, batch: Dict[str, PendingRedirects]) -> None:
+        """Put a failed batch back so its redirects are retried on the next flush"""
+        dropped = 0
+        for shortcode, pending in batch.items():
+            current = self._pending.get(shortcode)
+            if current is not None:
+                current.merge(pending)
+            elif len(self._pending) < self.retry_max_pending:
+                self._pending[shortcode] = pending
+            else:
+                dropped += sum(pending.hours.values())
+        if dropped:
+            self.dropped += dropped
+            logger.warning(
+                "Dropped %d redirects: more than %d shortcodes await a retry",
+                dropped,
+                self.retry_max_pending,
+            )
+
+    async def start(self) -> None:
+        """Start flushing pending redirects in the background"""
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the background flush and write out everything still pending"""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        if self._flush_task is not None:
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        await self.flush()
+
+    def clear(self) -> None:
+        """Drop all pending redirects without writing them"""
+        self._pending.clear()
+        self._flushing.clear()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush redirect counts")
+
+    def _clear_flush_task(self, task: asyncio.Task) -> None:
+        self._flush_task = None
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Failed to flush redirect counts", exc_info=task.exception())
+
+
+# Shared counter used by the redirect path
+redirect_counter = RedirectCounter()
@@ -1,25 +1,287 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from app.models import URLMapping
-from app.utils import generate_shortcode
+from sqlalchemy import bindparam, case, func, insert, select, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from app.cache import url_cache
+from app.metrics import labelled_queries
+from app.models import (
+    ProcessedEventSegment,
+    RedirectCount,
+    RedirectEventCount,
+    ShortcodeBlock,
+    URLMapping,
+)
+from app.sharding import (
+    COORDINATOR_SHARD,
+    SHARD_LEGACY_UPDATE_IDS,
+    make_update_id,
+    previous_shard_ring_of,
+    shard_ring_of,
+)
+from app.shortcodes import shortcode_allocator
+from app.utils import (
+    TIMESERIES_GRANULARITIES,
+    normalize_update_id,
+    truncate_timestamp,
+    url_hash,
+)
+from collections import defaultdict
 from datetime import datetime, timezone
-import uuid
+from typing import Dict, List, NamedTuple, Optional, Tuple
 
+# Attempts at an auto-generated shortcode before giving up
+MAX_SHORTCODE_ATTEMPTS = 5
 
+# Rows per multi-row INSERT when creating mappings in bulk
+BATCH_INSERT_CHUNK_SIZE = 1000
+
+# Result of create_url_mappings for items whose chunk the database rejected
+INSERT_FAILED = ("", "")
+
+# Shortcodes per IN list when reading stats in bulk
+BATCH_STATS_CHUNK_SIZE = 500
+
+
+class URLStats(NamedTuple):
+    """Columns of a mapping shown by the stats endpoint"""
+
+    created_at: datetime
+    last_redirect: Optional[datetime]
+    redirect_count: int
+
+
+class ShortenedURL(NamedTuple):
+    """Shortcode and update ID handed out for a shortened URL"""
+
+    shortcode: str
+    update_id: str
+
+
+# Hot lookups read only the columns they need as plain rows, without loading
+# ORM instances into the session. The statements are built once, so each call
+# skips statement construction and reuses the compiled form from the cache;
+# on asyncpg the dialect also keeps them prepared per connection.
+_url_mappings = URLMapping.__table__
+_ORIGINAL_URL_BY_SHORTCODE = select(_url_mappings.c.original_url).where(
+    _url_mappings.c.shortcode == bindparam("shortcode")
+)
+_STATS_BY_SHORTCODE = select(
+    _url_mappings.c.created_at,
+    _url_mappings.c.last_redirect,
+    _url_mappings.c.redirect_count,
+).where(_url_mappings.c.shortcode == bindparam("shortcode"))
+_STATS_BY_SHORTCODES = select(
+    _url_mappings.c.shortcode,
+    _url_mappings.c.created_at,
+    _url_mappings.c.last_redirect,
+    _url_mappings.c.redirect_count,
+).where(_url_mappings.c.shortcode.in_(bindparam("shortcodes", expanding=True)))
+_SHORTCODE_BY_SHORTCODE = select(_url_mappings.c.shortcode).where(
+    _url_mappings.c.shortcode == bindparam("shortcode")
+)
+_SHORTCODE_BY_UPDATE_ID = select(_url_mappings.c.shortcode).where(
+    _url_mappings.c.update_id == bindparam("update_id")
+)
+_SHORTENED_BY_URL_HASH = select(
+    _url_mappings.c.shortcode, _url_mappings.c.update_id
+).where(_url_mappings.c.url_hash == bindparam("url_hash"))
+
+
+def _dialect(db: AsyncSession):
+    """Dialect of the database behind a session; all shards share one"""
+    return db.get_bind(URLMapping.__mapper__).dialect
+
+
+def _on_shard(db: AsyncSession, shortcode: str) -> dict:
+    """Bind arguments that run a statement on the shard storing a shortcode"""
+    ring = shard_ring_of(db)
+    if ring is None:
+        return {}
+    return {"shard_id": ring.shard_for_shortcode(shortcode)}
+
+
+def _shard_arguments(db: AsyncSession, shard_id: str) -> dict:
+    """Bind arguments that run a statement on a shard"""
+    return {"shard_id": shard_id} if shard_ring_of(db) else {}
+
+
+def _by_shard(
+    db: AsyncSession,
+    rows: list,
+    key=lambda row: row["shortcode"],
+    placement: Optional[Dict[str, str]] = None,
+):
+    """
+    Group rows by the shard storing their shortcode ("0" when unsharded), or
+    by the shard placement from _locate() gives it
+    """
+    ring = shard_ring_of(db)
+    groups: Dict[str, list] = defaultdict(list)
+    for row in rows:
+        if placement is not None:
+            shard_id = placement[key(row)]
+        else:
+            shard_id = ring.shard_for_shortcode(key(row)) if ring else COORDINATOR_SHARD
+        groups[shard_id].append(row)
+    return groups
+
+
+def _previous_shard(db: AsyncSession, shortcode: str) -> Optional[str]:
+    """
+    Shard a shortcode lived on before the shards being rebalanced were added,
+    or None when it does not move (or no rebalance is going on)
+    """
+    previous = previous_shard_ring_of(db)
+    if previous is None:
+        return None
+    shard_id = previous.shard_for_shortcode(shortcode)
+    return (
+        shard_id
+        if shard_id != shard_ring_of(db).shard_for_shortcode(shortcode)
+        else None
+    )
+
+
+async def _lookup(db: AsyncSession, shortcode: str, run):
+    """
+    Run a lookup on a shortcode's shard, and on its previous shard when it
+    finds nothing there while a rebalance may not have moved the row yet
+    """
+    found = await run(_on_shard(db, shortcode))
+    previous = _previous_shard(db, shortcode)
+    if found is None and previous is not None:
+        found = await run({"shard_id": previous})
+    return found
+
+
+async def _locate(db: AsyncSession, shortcodes) -> Dict[str, str]:
+    """
+    Shard holding the mapping of each shortcode, for writes.
+
+    During a rebalance, mappings still on their previous shard are locked
+    there until the transaction ends, so the rebalance waits for the write
+    instead of copying the row without it. Writes that wait for a row being
+    moved find it gone and go to its new shard.
+    """
+    ring = shard_ring_of(db)
+    placement = {
+        shortcode: ring.shard_for_shortcode(shortcode) if ring else COORDINATOR_SHARD
+        for shortcode in shortcodes
+    }
+    moving: Dict[str, List[str]] = defaultdict(list)
+    for shortcode in placement:
+        previous = _previous_shard(db, shortcode)
+        if previous is not None:
+            moving[previous].append(shortcode)
+    for shard_id, shard_codes in moving.items():
+        for start in range(0, len(shard_codes), BATCH_STATS_CHUNK_SIZE):
+            result = await db.execute(
+                select(_url_mappings.c.shortcode)
+                .where(
+                    _url_mappings.c.shortcode.in_(
+                        shard_codes[start : start + BATCH_STATS_CHUNK_SIZE]
+                    )
+                )
+                .with_for_update(),
+                bind_arguments=_shard_arguments(db, shard_id),
+            )
+            for shortcode in result.scalars():
+                placement[shortcode] = shard_id
+    return placement
+
+
+@labelled_queries
 async def create_url_mapping(
     db: AsyncSession, url: str, shortcode: str = None
 ) -> URLMapping:
     """Create a new URL mapping"""
-    if shortcode is None:
-        # Generate a unique shortcode
-        while True:
-            shortcode = generate_shortcode()
-            existing = await get_url_mapping(db, shortcode)
-            if not existing:
-                break
+    if shortcode is not None:
+        return await _insert_url_mapping(db, url, shortcode)
+
+    # Allocated shortcodes are unique among themselves, but a custom shortcode
+    # may already have taken one; move on to the next code when that happens
+    for attempt in range(MAX_SHORTCODE_ATTEMPTS):
+        shortcode = await shortcode_allocator.next_shortcode(db)
+        try:
+            return await _insert_url_mapping(db, url, shortcode)
+        except IntegrityError:
+            await db.rollback()
+            if attempt == MAX_SHORTCODE_ATTEMPTS - 1:
+                raise
+
+
+@labelled_queries
+async def create_deduplicated_url_mapping(db: AsyncSession, url: str) -> ShortenedURL:
+    """
+    Return the mapping created earlier by this function for the same
+    normalized URL, or create one with an auto-generated shortcode.
+
+    The unique index on url_hash makes concurrent calls for one URL agree on
+    a single row. With shards, the hash picks the shard and the shortcode is
+    drawn until it lives there, so that index covers every copy of the URL.
+    """
+    digest = url_hash(url)
+    ring = shard_ring_of(db)
+    shard_id = ring.shard_for_url_hash(digest) if ring else COORDINATOR_SHARD
+    existing = await _find_by_url_hash(db, digest, shard_id)
+    if existing is not None:
+        return existing
+
+    for _ in range(MAX_SHORTCODE_ATTEMPTS):
+        shortcode = await _shortcode_on_shard(db, shard_id)
+        update_id = make_update_id(shortcode)
+        inserted = await _insert_ignoring_conflicts(
+            db,
+            [
+                {
+                    "shortcode": shortcode,
+                    "original_url": str(url),
+                    "update_id": update_id,
+                    "url_hash": digest,
+                }
+            ],
+        )
+        if update_id in inserted:
+            return ShortenedURL(shortcode, update_id)
+        # Either a concurrent call inserted the URL first or a custom
+        # shortcode took the allocated one
+        existing = await _find_by_url_hash(db, digest, shard_id)
+        if existing is not None:
+            return existing
+    raise RuntimeError(f"No free shortcode after {MAX_SHORTCODE_ATTEMPTS} attempts")
+
 
+async def _find_by_url_hash(
+    db: AsyncSession, digest: bytes, shard_id: str
+) -> Optional[ShortenedURL]:
+    result = await db.execute(
+        _SHORTENED_BY_URL_HASH,
+        {"url_hash": digest},
+        bind_arguments=_shard_arguments(db, shard_id),
+    )
+    row = result.first()
+    return ShortenedURL(*row) if row is not None else None
+
+
+async def _shortcode_on_shard(db: AsyncSession, shard_id: str) -> str:
+    """Next auto-generated shortcode stored on a shard, skipping the others"""
+    ring = shard_ring_of(db)
+    if ring is None:
+        return await shortcode_allocator.next_shortcode(db)
+    while True:
+        # About one in len(shard_ids) shortcodes lives on each shard
+        for shortcode in await shortcode_allocator.next_shortcodes(
+            db, len(ring.shard_ids)
+        ):
+            if ring.shard_for_shortcode(shortcode) == shard_id:
+                return shortcode
+
+
+async def _insert_url_mapping(db: AsyncSession, url: str, shortcode: str) -> URLMapping:
     db_mapping = URLMapping(
-        shortcode=shortcode, original_url=str(url), update_id=str(uuid.uuid4())
+        shortcode=shortcode,
+        original_url=str(url),
+        update_id=make_update_id(shortcode),
     )
     db.add(db_mapping)
     await db.commit()
@@ -27,28 +289,312 @@ async def create_url_mapping(
     return db_mapping
 
 
-async def get_url_mapping(db: AsyncSession, shortcode: str) -> URLMapping:
-    """Get URL mapping by shortcode"""
+@labelled_queries
+async def create_url_mappings(
+    db: AsyncSession, items: List[Tuple[str, Optional[str]]]
+) -> List[Optional[Tuple[str, str]]]:
+    """
+    Create many URL mappings from (url, shortcode) pairs with multi-row inserts.
+
+    Returns a (shortcode, update_id) pair for each created mapping, in input
+    order, None where the custom shortcode is already in use, or
+    INSERT_FAILED for the items of a chunk the database rejected, so one bad
+    row does not lose the other chunks.
+    """
+    results: List[Optional[Tuple[str, str]]] = [None] * len(items)
+    auto_indexes = [i for i, (_, shortcode) in enumerate(items) if shortcode is None]
+    shortcodes = [shortcode for _, shortcode in items]
+    for index, shortcode in zip(
+        auto_indexes, await shortcode_allocator.next_shortcodes(db, len(auto_indexes))
+    ):
+        shortcodes[index] = shortcode
+
+    pending = list(range(len(items)))
+    for attempt in range(MAX_SHORTCODE_ATTEMPTS):
+        retry = []
+        for start in range(0, len(pending), BATCH_INSERT_CHUNK_SIZE):
+            chunk = pending[start : start + BATCH_INSERT_CHUNK_SIZE]
+            # Match inserted rows back to their items by their fresh update ID
+            rows = {make_update_id(shortcodes[index]): index for index in chunk}
+            try:
+                inserted = await _insert_ignoring_conflicts(
+                    db,
+                    [
+                        {
+                            "shortcode": shortcodes[index],
+                            "original_url": str(items[index][0]),
+                            "update_id": update_id,
+                        }
+                        for update_id, index in rows.items()
+                    ],
+                )
+            except DBAPIError:
+                await db.rollback()
+                for index in chunk:
+                    results[index] = INSERT_FAILED
+                continue
+            for update_id, index in rows.items():
+                if update_id in inserted:
+                    results[index] = (shortcodes[index], update_id)
+                elif items[index][1] is None:
+                    # An allocated shortcode was taken by a custom shortcode
+                    retry.append(index)
+
+        if not retry or attempt == MAX_SHORTCODE_ATTEMPTS - 1:
+            break
+        for index, shortcode in zip(
+            retry, await shortcode_allocator.next_shortcodes(db, len(retry))
+        ):
+            shortcodes[index] = shortcode
+        pending = retry
+
+    return results
+
+
+async def _insert_ignoring_conflicts(db: AsyncSession, rows: List[dict]) -> set:
+    """Insert mapping rows, one statement per shard, returning the update IDs that went in"""
+    dialect = _dialect(db).name
+    if dialect == "postgresql":
+        insert_for_dialect = postgresql.insert
+    elif dialect == "sqlite":
+        insert_for_dialect = sqlite.insert
+    else:
+        raise NotImplementedError(f"Bulk inserts are not supported on {dialect}")
+
+    inserted = set()
+    for shard_id, shard_rows in _by_shard(db, rows).items():
+        stmt = (
+            insert_for_dialect(URLMapping.__table__)
+            .values(shard_rows)
+            .on_conflict_do_nothing()
+            .returning(URLMapping.__table__.c.update_id)
+        )
+        result = await db.execute(stmt, bind_arguments=_shard_arguments(db, shard_id))
+        inserted.update(result.scalars().all())
+    await db.commit()
+    return inserted
+
+
+# The block reserved by a nextval() call: it ends at the returned value and is
+# as long as the increment the sequence has at that moment
+_NEXT_SHORTCODE_BLOCK = text(
+    "SELECT nextval('shortcode_block_seq'), seqincrement FROM pg_sequence "
+    "WHERE seqrelid = 'shortcode_block_seq'::regclass"
+)
+
+
+_SHORTCODE_BLOCK_INCREMENT = text(
+    "SELECT seqincrement FROM pg_sequence "
+    "WHERE seqrelid = 'shortcode_block_seq'::regclass"
+)
+
+
+@labelled_queries
+async def get_shortcode_block_increment(db: AsyncSession) -> Optional[int]:
+    """Block size set on the shortcode block sequence, or None without sequences"""
+    if not _dialect(db).supports_sequences:
+        return None
     result = await db.execute(
-        select(URLMapping).filter(URLMapping.shortcode == shortcode)
+        _SHORTCODE_BLOCK_INCREMENT,
+        bind_arguments=_shard_arguments(db, COORDINATOR_SHARD),
     )
-    return result.scalar_one_or_none()
+    return result.scalar_one()
+
+
+@labelled_queries
+async def reserve_shortcode_block(db: AsyncSession, size: int) -> Tuple[int, int]:
+    """
+    Reserve the next block of shortcode IDs, returning its [start, end) range.
+
+    On PostgreSQL the sequence's increment is the block size and size is
+    ignored; elsewhere each block starts at the end of the previous one.
+    Either way blocks never overlap, even when the size changes.
+    """
+    # Blocks always come from the coordinator, so they are unique across shards
+    on_coordinator = _shard_arguments(db, COORDINATOR_SHARD)
+    if _dialect(db).supports_sequences:
+        result = await db.execute(_NEXT_SHORTCODE_BLOCK, bind_arguments=on_coordinator)
+        end, increment = result.one()
+        return end - increment, end
+
+    table = ShortcodeBlock.__table__
+    start = func.coalesce(func.max(table.c.end_id), 0)
+    result = await db.execute(
+        insert(table)
+        .from_select(["start_id", "end_id"], select(start, start + bindparam("size")))
+        .returning(table.c.start_id, table.c.end_id),
+        {"size": size},
+        bind_arguments=on_coordinator,
+    )
+    start_id, end_id = result.one()
+    await db.commit()
+    return start_id, end_id
+
+
+@labelled_queries
+async def get_url_mapping(db: AsyncSession, shortcode: str) -> URLMapping:
+    """Get URL mapping by shortcode"""
+
+    async def run(on_shard):
+        result = await db.execute(
+            select(URLMapping).filter(URLMapping.shortcode == shortcode),
+            bind_arguments=on_shard,
+        )
+        return result.scalar_one_or_none()
+
+    return await _lookup(db, shortcode, run)
+
+
+@labelled_queries
+async def get_original_url(db: AsyncSession, shortcode: str) -> Optional[str]:
+    """Get the original URL of a shortcode without loading the mapping"""
+
+    async def run(on_shard):
+        result = await db.execute(
+            _ORIGINAL_URL_BY_SHORTCODE,
+            {"shortcode": shortcode},
+            bind_arguments=on_shard,
+        )
+        return result.scalar_one_or_none()
+
+    return await _lookup(db, shortcode, run)
+
+
+@labelled_queries
+async def get_url_stats(db: AsyncSession, shortcode: str) -> Optional[URLStats]:
+    """Get the creation time and redirect counts of a shortcode"""
+
+    async def run(on_shard):
+        result = await db.execute(
+            _STATS_BY_SHORTCODE,
+            {"shortcode": shortcode},
+            bind_arguments=on_shard,
+        )
+        row = result.one_or_none()
+        return URLStats(*row) if row is not None else None
+
+    return await _lookup(db, shortcode, run)
+
+
+@labelled_queries
+async def get_url_stats_many(
+    db: AsyncSession, shortcodes: List[str]
+) -> Dict[str, URLStats]:
+    """
+    Stats of many shortcodes, keyed by shortcode; unknown shortcodes are left
+    out. Runs one IN query per shard and chunk of BATCH_STATS_CHUNK_SIZE.
+    """
+    found: Dict[str, URLStats] = {}
+    unique = list(dict.fromkeys(shortcodes))
+    groups = _by_shard(db, unique, key=lambda code: code)
+    await _stats_on_shards(db, groups, found)
+
+    # Rows a rebalance has not moved yet are still on their previous shard
+    previous: Dict[str, List[str]] = defaultdict(list)
+    for shortcode in unique:
+        shard_id = _previous_shard(db, shortcode)
+        if shard_id is not None and shortcode not in found:
+            previous[shard_id].append(shortcode)
+    await _stats_on_shards(db, previous, found)
+    return found
+
+
+async def _stats_on_shards(
+    db: AsyncSession, groups: Dict[str, List[str]], found: Dict[str, URLStats]
+) -> None:
+    for shard_id, shard_codes in groups.items():
+        for start in range(0, len(shard_codes), BATCH_STATS_CHUNK_SIZE):
+            result = await db.execute(
+                _STATS_BY_SHORTCODES,
+                {"shortcodes": shard_codes[start : start + BATCH_STATS_CHUNK_SIZE]},
+                bind_arguments=_shard_arguments(db, shard_id),
+            )
+            for shortcode, *stats in result:
+                found[shortcode] = URLStats(*stats)
+
+
+@labelled_queries
+async def list_shortcodes(
+    db: AsyncSession,
+    shard_id: str = COORDINATOR_SHARD,
+    after: Optional[str] = None,
+    limit: int = 10000,
+) -> List[str]:
+    """Shortcodes stored on a shard in order, starting after a given one"""
+    stmt = select(URLMapping.shortcode).order_by(URLMapping.shortcode).limit(limit)
+    if after is not None:
+        stmt = stmt.where(URLMapping.shortcode > after)
+    result = await db.execute(stmt, bind_arguments=_shard_arguments(db, shard_id))
+    shortcodes = list(result.scalars().all())
+    # End the read transaction so a long scan does not hold a connection
+    await db.commit()
+    return shortcodes
 
 
+@labelled_queries
 async def shortcode_exists(db: AsyncSession, shortcode: str) -> bool:
     """Check if a shortcode already exists"""
-    mapping = await get_url_mapping(db, shortcode)
-    return mapping is not None
 
+    async def run(on_shard):
+        result = await db.execute(
+            _SHORTCODE_BY_SHORTCODE,
+            {"shortcode": shortcode},
+            bind_arguments=on_shard,
+        )
+        return result.scalar_one_or_none()
+
+    return await _lookup(db, shortcode, run) is not None
+
+
+async def _find_by_update_id(db: AsyncSession, stmt, update_id: str):
+    """First value selected by a statement on the update_id parameter"""
+    # update_id is a UUID column; anything else cannot match
+    update_id = normalize_update_id(update_id)
+    if update_id is None:
+        return None
+    params = {"update_id": update_id}
+    ring = shard_ring_of(db)
+    shard_id = ring.shard_for_update_id(update_id) if ring else None
+    if shard_id is None:
+        result = await db.execute(stmt, params)
+        return result.scalar_one_or_none()
 
+    # The update ID names its shard; only IDs from before sharding need a scan
+    result = await db.execute(stmt, params, bind_arguments={"shard_id": shard_id})
+    value = result.scalar_one_or_none()
+    previous = previous_shard_ring_of(db)
+    if value is None and previous is not None:
+        previous_id = previous.shard_for_update_id(update_id)
+        if previous_id != shard_id:
+            result = await db.execute(
+                stmt, params, bind_arguments={"shard_id": previous_id}
+            )
+            value = result.scalar_one_or_none()
+    if value is None and SHARD_LEGACY_UPDATE_IDS:
+        result = await db.execute(stmt, params)
+        value = result.scalars().first()
+    return value
+
+
+@labelled_queries
 async def get_url_mapping_by_update_id(db: AsyncSession, update_id: str) -> URLMapping:
-    """Get URL mapping by update ID"""
-    result = await db.execute(
-        select(URLMapping).filter(URLMapping.update_id == update_id)
+    """Get URL mapping by update ID, locked until the session's transaction ends"""
+    # The lock keeps a rebalance from moving the row before its update commits
+    stmt = (
+        select(URLMapping)
+        .filter(URLMapping.update_id == bindparam("update_id"))
+        .with_for_update()
     )
-    return result.scalar_one_or_none()
+    return await _find_by_update_id(db, stmt, update_id)
 
 
+@labelled_queries
+async def get_shortcode_by_update_id(db: AsyncSession, update_id: str) -> Optional[str]:
+    """Get the shortcode an update ID belongs to without loading the mapping"""
+    return await _find_by_update_id(db, _SHORTCODE_BY_UPDATE_ID, update_id)
+
+
+@labelled_queries
 async def update_url_mapping(
     db: AsyncSession, update_id: str, new_url: str
 ) -> URLMapping:
@@ -58,18 +604,251 @@ async def update_url_mapping(
 
     if db_mapping:
         db_mapping.original_url = str(new_url)
+        # No longer a mapping of the URL it was deduplicated on
+        db_mapping.url_hash = None
         await db.commit()
         await db.refresh(db_mapping)
+        url_cache.invalidate(db_mapping.shortcode)
 
     return db_mapping
 
 
+@labelled_queries
+async def redirect_url_mapping(db: AsyncSession, shortcode: str) -> Optional[str]:
+    """
+    Count a redirect and return the original URL in a single statement.
+
+    The increment happens in the database, so concurrent redirects never
+    overwrite each other's counts. Unknown shortcodes commit nothing.
+    """
+    table = URLMapping.__table__
+    dialect = _dialect(db)
+    placement = await _locate(db, [shortcode])
+    on_shard = _shard_arguments(db, placement[shortcode])
+
+    if dialect.name == "postgresql":
+        # Use the server clock so all workers agree on redirect times
+        last_redirect = func.now()
+    else:
+        last_redirect = datetime.now(timezone.utc)
+
+    stmt = (
+        update(table)
+        .where(table.c.shortcode == shortcode)
+        .values(
+            redirect_count=func.coalesce(table.c.redirect_count, 0) + 1,
+            last_redirect=last_redirect,
+        )
+    )
+
+    if dialect.update_returning:
+        result = await db.execute(
+            stmt.returning(table.c.original_url), bind_arguments=on_shard
+        )
+        original_url = result.scalar_one_or_none()
+    else:
+        # No UPDATE ... RETURNING (SQLite < 3.35): read back in the same transaction
+        await db.execute(stmt, bind_arguments=on_shard)
+        result = await db.execute(
+            select(table.c.original_url).where(table.c.shortcode == shortcode),
+            bind_arguments=on_shard,
+        )
+        original_url = result.scalar_one_or_none()
+
+    if original_url is None:
+        # Nothing was updated, so there is nothing to commit
+        await db.rollback()
+    else:
+        await db.commit()
+    return original_url
+
+
+@labelled_queries
 async def increment_redirect_count(db: AsyncSession, shortcode: str) -> URLMapping:
     """Increment redirect count and update last redirect time"""
-    db_mapping = await get_url_mapping(db, shortcode)
-    if db_mapping:
-        db_mapping.redirect_count += 1
-        db_mapping.last_redirect = datetime.now(timezone.utc)
-        await db.commit()
-        await db.refresh(db_mapping)
-    return db_mapping
+    if await redirect_url_mapping(db, shortcode) is None:
+        return None
+    result = await db.execute(
+        select(URLMapping)
+        .filter(URLMapping.shortcode == shortcode)
+        .execution_options(populate_existing=True),
+        bind_arguments=_on_shard(db, shortcode),
+    )
+    return result.scalar_one_or_none()
+
+
+@labelled_queries
+async def apply_redirect_counts(
+    db: AsyncSession,
+    counts: Dict[str, Tuple[int, datetime]],
+    hours: Optional[Dict[Tuple[str, datetime], int]] = None,
+) -> None:
+    """
+    Add buffered redirect counts and last redirect times in one batched update,
+    and buffered redirects per (shortcode, hour) to the time series, in one
+    transaction.
+    """
+    # Buckets go wherever the mapping is, so a rebalance moves them together
+    placement = await _locate(
+        db, {*counts, *(shortcode for shortcode, _ in hours or ())}
+    )
+    if counts:
+        await _add_redirect_counts(db, counts, placement)
+    if hours:
+        await _add_redirect_buckets(db, hours, placement)
+    await db.commit()
+
+
+async def _add_redirect_counts(
+    db: AsyncSession,
+    counts: Dict[str, Tuple[int, datetime]],
+    placement: Dict[str, str],
+) -> None:
+    table = URLMapping.__table__
+    stmt = (
+        update(table)
+        .where(table.c.shortcode == bindparam("b_shortcode"))
+        .values(
+            redirect_count=func.coalesce(table.c.redirect_count, 0)
+            + bindparam("b_count"),
+            last_redirect=case(
+                (
+                    (table.c.last_redirect.is_(None))
+                    | (table.c.last_redirect < bindparam("b_last_redirect")),
+                    bindparam("b_last_redirect"),
+                ),
+                else_=table.c.last_redirect,
+            ),
+        )
+    )
+    rows = [
+        {"b_shortcode": shortcode, "b_count": count, "b_last_redirect": last}
+        for shortcode, (count, last) in counts.items()
+    ]
+    for shard_id, shard_rows in _by_shard(
+        db, rows, key=lambda row: row["b_shortcode"], placement=placement
+    ).items():
+        await db.execute(
+            stmt, shard_rows, bind_arguments=_shard_arguments(db, shard_id)
+        )
+
+
+async def _add_redirect_buckets(
+    db: AsyncSession,
+    hours: Dict[Tuple[str, datetime], int],
+    placement: Dict[str, str],
+) -> None:
+    """Add redirects per hour to the hourly, daily and monthly buckets"""
+    totals: Dict[Tuple[str, str, datetime], int] = defaultdict(int)
+    for (shortcode, hour), count in hours.items():
+        for granularity in TIMESERIES_GRANULARITIES:
+            totals[
+                (shortcode, granularity, truncate_timestamp(hour, granularity))
+            ] += count
+
+    table = RedirectCount.__table__
+    dialect = _dialect(db).name
+    if dialect == "postgresql":
+        stmt = postgresql.insert(table)
+    elif dialect == "sqlite":
+        stmt = sqlite.insert(table)
+    else:
+        raise NotImplementedError(f"Redirect buckets are not supported on {dialect}")
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.shortcode, table.c.granularity, table.c.bucket],
+        set_={"count": table.c.count + stmt.excluded["count"]},
+    )
+
+    rows = [
+        {
+            "shortcode": shortcode,
+            "granularity": granularity,
+            "bucket": bucket,
+            "count": count,
+        }
+        for (shortcode, granularity, bucket), count in totals.items()
+    ]
+    for shard_id, shard_rows in _by_shard(db, rows, placement=placement).items():
+        await db.execute(
+            stmt, shard_rows, bind_arguments=_shard_arguments(db, shard_id)
+        )
+
+
+@labelled_queries
+async def apply_event_counts(
+    db: AsyncSession,
+    counts: Dict[Tuple[str, int, datetime], int],
+    segment: Optional[str] = None,
+) -> bool:
+    """
+    Add event counts per (shortcode, status, hour) in one transaction.
+
+    With a segment name, the segment is recorded in the same transaction and
+    nothing is added if it was recorded before. Returns whether counts were
+    added.
+    """
+    dialect = _dialect(db).name
+    if dialect == "postgresql":
+        insert_for = postgresql.insert
+    elif dialect == "sqlite":
+        insert_for = sqlite.insert
+    else:
+        raise NotImplementedError(f"Event counts are not supported on {dialect}")
+    on_coordinator = _shard_arguments(db, COORDINATOR_SHARD)
+
+    if segment is not None:
+        segments = ProcessedEventSegment.__table__
+        result = await db.execute(
+            insert_for(segments)
+            .values(name=segment)
+            .on_conflict_do_nothing()
+            .returning(segments.c.name),
+            bind_arguments=on_coordinator,
+        )
+        if result.scalar_one_or_none() is None:
+            await db.rollback()
+            return False
+
+    table = RedirectEventCount.__table__
+    stmt = insert_for(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.shortcode, table.c.status, table.c.hour],
+        set_={"count": table.c.count + stmt.excluded["count"]},
+    )
+    rows = [
+        {"shortcode": shortcode, "status": status, "hour": hour, "count": count}
+        for (shortcode, status, hour), count in counts.items()
+    ]
+    if rows:
+        await db.execute(stmt, rows, bind_arguments=on_coordinator)
+    await db.commit()
+    return True
+
+
+@labelled_queries
+async def get_redirect_timeseries(
+    db: AsyncSession,
+    shortcode: str,
+    granularity: str,
+    start: datetime,
+    end: datetime,
+) -> Dict[datetime, int]:
+    """Redirects per bucket (UTC start time) for buckets starting in [start, end)"""
+    table = RedirectCount.__table__
+
+    async def run(on_shard):
+        result = await db.execute(
+            select(table.c.bucket, table.c.count).where(
+                table.c.shortcode == shortcode,
+                table.c.granularity == granularity,
+                table.c.bucket >= start,
+                table.c.bucket < end,
+            ),
+            bind_arguments=on_shard,
+        )
+        buckets = {
+            truncate_timestamp(bucket, granularity): count for bucket, count in result
+        }
+        return buckets or None
+
+    return await _lookup(db, shortcode, run) or {}
@@ -0,0 +1,366 @@
+"""
+Append-only log of redirect events on local disk.
+
+    python -m app.events aggregate
+    python -m app.events dump /var/log/url-shortener/events-....log.gz
+
+The redirect handler hands each event (shortcode, time, status) to an
+in-memory buffer without waiting. A background task writes the buffer in
+batches to segment files in EVENT_LOG_DIR; disk I/O runs in a worker thread,
+so requests never wait for it. Each segment is a series of gzip members,
+one per batch, holding length-prefixed records. A segment is closed and
+renamed once it is large or old enough, and only closed segments are read by
+the aggregator, which folds them into the redirect_event_counts table.
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import os
+import struct
+import sys
+import time
+import zlib
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from app import crud
+from app.database import AsyncSessionLocal, shard_engines
+from app.utils import truncate_timestamp
+
+logger = logging.getLogger(__name__)
+
+# Directory for event segments; the event log is off while unset
+EVENT_LOG_DIR = os.getenv("EVENT_LOG_DIR")
+# A segment is closed once it holds this many compressed bytes ...
+EVENT_LOG_SEGMENT_BYTES = int(os.getenv("EVENT_LOG_SEGMENT_BYTES", str(64 << 20)))
+# ... or has been open this long
+EVENT_LOG_SEGMENT_SECONDS = float(os.getenv("EVENT_LOG_SEGMENT_SECONDS", "3600"))
+EVENT_LOG_FLUSH_INTERVAL_SECONDS = float(
+    os.getenv("EVENT_LOG_FLUSH_INTERVAL_SECONDS", "1.0")
+)
+# Events buffered in memory at most; further events are dropped and counted
+EVENT_LOG_MAX_QUEUED = int(os.getenv("EVENT_LOG_MAX_QUEUED", "100000"))
+
+SEGMENT_SUFFIX = ".log.gz"
+OPEN_SUFFIX = ".open"
+DAMAGED_SUFFIX = ".damaged"
+
+# Record: payload length, then microseconds since the epoch, status, shortcode
+_LENGTH = struct.Struct("<I")
+_EVENT = struct.Struct("<qH")
+
+
+def encode_events(events: List[Tuple[str, int, int]]) -> bytes:
+    """Encode (shortcode, microseconds, status) events as length-prefixed records"""
+    chunks = []
+    for shortcode, micros, status in events:
+        payload = _EVENT.pack(micros, status) + shortcode.encode()
+        chunks.append(_LENGTH.pack(len(payload)))
+        chunks.append(payload)
+    return b"".join(chunks)
+
+
+def decode_events(data: bytes) -> Iterator[Tuple[str, datetime, int]]:
+    """Decode length-prefixed records into (shortcode, time, status) events"""
+    offset = 0
+    while offset + _LENGTH.size <= len(data):
+        (length,) = _LENGTH.unpack_from(data, offset)
+        offset += _LENGTH.size
+        if offset + length > len(data) or length < _EVENT.size:
+            raise ValueError("Truncated event record")
+        micros, status = _EVENT.unpack_from(data, offset)
+        shortcode = data[offset + _EVENT.size : offset + length].decode()
+        offset += length
+        at = datetime.fromtimestamp(micros / 1_000_000, tz=timezone.utc)
+        yield shortcode, at, status
+
+
+def split_segment(data: bytes) -> Tuple[List[Tuple[str, datetime, int]], bytes]:
+    """
+    Events of the complete gzip members at the start of a segment, and the
+    bytes after them, which are only non-empty when a writer died mid-batch.
+    """
+    events = []
+    view = memoryview(data)
+    offset = 0
+    while offset < len(data):
+        member = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+        try:
+            payload = member.decompress(view[offset:])
+            if not member.eof:
+                break
+            decoded = list(decode_events(payload))
+        except (zlib.error, ValueError, UnicodeDecodeError):
+            break
+        events.extend(decoded)
+        offset = len(data) - len(member.unused_data)
+    return events, bytes(view[offset:])
+
+
+def read_segment(path: str) -> Iterator[Tuple[str, datetime, int]]:
+    """Read the events of a closed segment, skipping a damaged tail"""
+    with open(path, "rb") as segment:
+        events, _ = split_segment(segment.read())
+    yield from events
+
+
+def closed_segments(directory: str) -> List[str]:
+    """Paths of the closed segments in a directory, oldest first"""
+    return sorted(
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if name.endswith(SEGMENT_SUFFIX)
+    )
+
+
+class EventLog:
+    """
+    Buffers redirect events and appends them to rotating segment files.
+
+    Segment names hold the creation time and process ID, so several worker
+    processes can share one directory.
+    """
+
+    def __init__(
+        self,
+        directory: Optional[str] = EVENT_LOG_DIR,
+        segment_bytes: int = EVENT_LOG_SEGMENT_BYTES,
+        segment_seconds: float = EVENT_LOG_SEGMENT_SECONDS,
+        flush_interval: float = EVENT_LOG_FLUSH_INTERVAL_SECONDS,
+        max_queued: int = EVENT_LOG_MAX_QUEUED,
+        clock=time.time,
+    ):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.flush_interval = flush_interval
+        self.max_queued = max_queued
+        self._clock = clock
+        self._queue: List[Tuple[str, int, int]] = []
+        self._segment = None
+        self._segment_path: Optional[str] = None
+        self._segment_opened = 0.0
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._worker: Optional[asyncio.Task] = None
+        self.written = 0
+        self.dropped = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.directory is not None
+
+    def record(self, shortcode: str, status: int, at: Optional[float] = None) -> None:
+        """Queue a redirect event; never blocks"""
+        if self.directory is None:
+            return
+        if len(self._queue) >= self.max_queued:
+            self.dropped += 1
+            return
+        at = self._clock() if at is None else at
+        self._queue.append((shortcode, int(at * 1_000_000), status))
+
+    async def flush(self) -> int:
+        """Write all queued events to the current segment, returning how many"""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+
+        async with self._flush_lock:
+            batch, self._queue = self._queue, []
+            if batch:
+                try:
+                    await asyncio.to_thread(self._write, batch)
+                except Exception:
+                    self.dropped += len(batch)
+                    raise
+                self.written += len(batch)
+            elif self._segment is not None and self._segment_expired():
+                await asyncio.to_thread(self._close_segment)
+            return len(batch)
+
+    async def start(self) -> None:
+        """Start writing events in the background"""
+        if self.directory is not None and self._worker is None:
+            os.makedirs(self.directory, exist_ok=True)
+            await asyncio.to_thread(self._close_abandoned_segments)
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Write out queued events and close the current segment"""
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+        if self.directory is not None:
+            await self.flush()
+            await asyncio.to_thread(self._close_segment)
+
+    def stats(self) -> dict:
+        """Events waiting in memory, written to disk and dropped"""
+        return {
+            "enabled": self.enabled,
+            "queued": len(self._queue),
+            "written": self.written,
+            "dropped": self.dropped,
+        }
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to write redirect events")
+
+    def _segment_expired(self) -> bool:
+        return self._clock() - self._segment_opened >= self.segment_seconds
+
+    def _write(self, batch: List[Tuple[str, int, int]]) -> None:
+        if self._segment is not None and self._segment_expired():
+            self._close_segment()
+        if self._segment is None:
+            self._open_segment()
+        self._segment.write(gzip.compress(encode_events(batch), compresslevel=6))
+        self._segment.flush()
+        if self._segment.tell() >= self.segment_bytes:
+            self._close_segment()
+
+    def _open_segment(self) -> None:
+        self._segment_opened = self._clock()
+        stamp = datetime.fromtimestamp(self._segment_opened, tz=timezone.utc)
+        name = f"events-{stamp:%Y%m%dT%H%M%S%f}-{os.getpid()}{SEGMENT_SUFFIX}"
+        self._segment_path = os.path.join(self.directory, name)
+        self._segment = open(self._segment_path + OPEN_SUFFIX, "ab")
+
+    def _close_segment(self) -> None:
+        if self._segment is None:
+            return
+        self._segment.close()
+        os.replace(self._segment_path + OPEN_SUFFIX, self._segment_path)
+        self._segment = None
+        self._segment_path = None
+
+    def _close_abandoned_segments(self) -> None:
+        """Close segments left open by processes that are no longer running"""
+        for name in os.listdir(self.directory):
+            if not name.endswith(SEGMENT_SUFFIX + OPEN_SUFFIX):
+                continue
+            pid = int(name[: -len(SEGMENT_SUFFIX + OPEN_SUFFIX)].rsplit("-", 1)[1])
+            if pid != os.getpid() and _is_running(pid):
+                continue
+            path = os.path.join(self.directory, name)
+            os.replace(path, path[: -len(OPEN_SUFFIX)])
+
+
+def _is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def fold_events(
+    events: Iterator[Tuple[str, datetime, int]],
+) -> Dict[Tuple[str, int, datetime], int]:
+    """Count events per (shortcode, status, hour)"""
+    counts: Dict[Tuple[str, int, datetime], int] = defaultdict(int)
+    for shortcode, at, status in events:
+        counts[(shortcode, status, truncate_timestamp(at, "hour"))] += 1
+    return dict(counts)
+
+
+async def aggregate(session_factory, directory: str, delete: bool = False) -> int:
+    """
+    Add the events of all closed segments to redirect_event_counts and set
+    the segments aside, returning the number of segments processed.
+
+    The live redirect counters and time series are never touched. Each
+    segment's name is recorded with its counts in one transaction, so a
+    segment left in place by a run that stopped after committing is set aside
+    on the next run without being applied again. A damaged tail left by a
+    writer that crashed mid-batch is moved to processed/ with a .damaged
+    suffix and the complete records before it are still applied.
+    """
+    processed_dir = os.path.join(directory, "processed")
+    segments = closed_segments(directory)
+    for path in segments:
+        name = os.path.basename(path)
+        with open(path, "rb") as segment:
+            events, damaged = split_segment(segment.read())
+        async with session_factory() as db:
+            applied = await crud.apply_event_counts(db, fold_events(events), name)
+        if not applied:
+            logger.warning("Segment %s was already applied; set aside", name)
+
+        os.makedirs(processed_dir, exist_ok=True)
+        if damaged:
+            logger.warning(
+                "Segment %s ends in %d damaged bytes; set aside", name, len(damaged)
+            )
+            with open(os.path.join(processed_dir, name + DAMAGED_SUFFIX), "wb") as f:
+                f.write(damaged)
+        if delete:
+            os.remove(path)
+        else:
+            os.replace(path, os.path.join(processed_dir, name))
+    return len(segments)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m app.events", description=__doc__.strip().splitlines()[0]
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    aggregate_parser = commands.add_parser(
+        "aggregate", help="Add closed segments to redirect_event_counts"
+    )
+    aggregate_parser.add_argument(
+        "--dir",
+        default=EVENT_LOG_DIR,
+        required=not EVENT_LOG_DIR,
+        help="Segment directory (default: EVENT_LOG_DIR)",
+    )
+    aggregate_parser.add_argument(
+        "--delete",
+        action="store_true",
+        help="Delete segments once applied instead of moving them to processed/",
+    )
+
+    dump_parser = commands.add_parser("dump", help="Print a segment as NDJSON")
+    dump_parser.add_argument("path")
+
+    args = parser.parse_args(argv)
+    if args.command == "dump":
+        for shortcode, at, status in read_segment(args.path):
+            print(
+                json.dumps(
+                    {"shortcode": shortcode, "at": at.isoformat(), "status": status}
+                )
+            )
+        return
+
+    asyncio.run(_aggregate(args.dir, args.delete))
+
+
+async def _aggregate(directory: str, delete: bool) -> None:
+    try:
+        segments = await aggregate(AsyncSessionLocal, directory, delete)
+        print(f"applied {segments} segments", file=sys.stderr)
+    finally:
+        for engine in shard_engines.values():
+            await engine.dispose()
+
+
+# Shared event log used by the redirect path
+event_log = EventLog()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,13 @@
 import asyncio
-from app.database import async_engine
+from app.database import shard_engines
 from app.models import Base
 
 
 async def init_db():
-    """Initialize database tables using async engine"""
-    async with async_engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    """Initialize database tables on every shard using async engines"""
+    for engine in shard_engines.values():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
 
 
 if __name__ == "__main__":
@@ -1,30 +1,202 @@
-from fastapi import FastAPI, HTTPException, Depends, status
-from fastapi.responses import RedirectResponse
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+import os
+from typing import Literal, Optional
+from fastapi import FastAPI, HTTPException, Depends, Request, status
+from fastapi.responses import JSONResponse, RedirectResponse, Response
+from pydantic import ValidationError
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.database import get_async_db, engine
-from app.models import Base
+from app.database import (
+    REPLICA_MAX_LAG_SECONDS,
+    AsyncSessionLocal,
+    ReadYourWritesMiddleware,
+    get_async_db,
+    get_async_read_db,
+    record_client_write,
+    replica_router,
+    shard_engines,
+    warm_up_pool,
+)
+from app.init_db import init_db
 from app.schemas import (
+    URLBatchShortenItem,
+    URLBatchShortenResponse,
+    URLBatchStatsRequest,
+    URLBatchStatsResponse,
+    URLBatchShortenResult,
     URLShortenRequest,
     URLShortenResponse,
+    RedirectBucket,
     URLStatsResponse,
+    URLTimeseriesResponse,
     URLUpdateRequest,
     URLUpdateResponse,
 )
-from app import crud
-from app.utils import is_valid_shortcode
+from app import admin, crud, serialization
+from app.admission import ADMISSION_ENABLED, AdmissionMiddleware, admission_controller
+from app.bloom import shortcode_filter
+from app.cache import url_cache
+from app.counters import redirect_counter
+from app.events import event_log
+from app.metrics import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE,
+    METRICS_ENABLED,
+    MetricsMiddleware,
+    instrument_engine,
+    render_metrics,
+)
+from app.profiling import ProfilingMiddleware, profile_store, profiling_available
+from app.serialization import FastJSONResponse
+from app.shortcodes import SHORTCODE_BLOCK_SIZE
+from app.singleflight import redirect_lookups, update_id_lookups
+from app.utils import (
+    MAX_SHORTCODE_LENGTH,
+    MAX_URL_LENGTH,
+    is_valid_shortcode,
+    next_bucket,
+    parse_json_batch,
+    truncate_timestamp,
+)
+
+# Largest number of URLs accepted by POST /shorten/batch
+SHORTEN_BATCH_MAX_ITEMS = int(os.getenv("SHORTEN_BATCH_MAX_ITEMS", "50000"))
+
+# Hand out the existing mapping when a URL is shortened again without a
+# custom shortcode, instead of creating another one
+SHORTEN_DEDUP = os.getenv("SHORTEN_DEDUP", "false").lower() == "true"
+
+# Largest number of shortcodes accepted by POST /stats/batch
+STATS_BATCH_MAX_ITEMS = int(os.getenv("STATS_BATCH_MAX_ITEMS", "1000"))
+
+# Most buckets returned by GET /{shortcode}/stats/timeseries
+TIMESERIES_MAX_BUCKETS = int(os.getenv("TIMESERIES_MAX_BUCKETS", "1000"))
+
+# Create missing tables on startup; deployments normally run Alembic instead
+DB_CREATE_SCHEMA = os.getenv("DB_CREATE_SCHEMA", "false").lower() == "true"
+
+# Longest pause between attempts to reach the database during startup
+STARTUP_RETRY_MAX_SECONDS = float(os.getenv("STARTUP_RETRY_MAX_SECONDS", "30"))
+
+logger = logging.getLogger(__name__)
+
+
+async def prepare_database(app: FastAPI) -> None:
+    """
+    Create the schema if enabled and warm up the pool, then mark the app ready
+    and check the shortcode block size
+    """
+    delay = 0.5
+    while True:
+        try:
+            if DB_CREATE_SCHEMA:
+                await init_db()
+            await asyncio.gather(
+                *(warm_up_pool(engine) for engine in shard_engines.values())
+            )
+            break
+        except Exception:
+            logger.exception("Database is not ready, retrying in %.1fs", delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, STARTUP_RETRY_MAX_SECONDS)
+    app.state.ready = True
+    try:
+        await check_shortcode_block_size()
+    except Exception:
+        logger.exception("Could not check the shortcode block size")
+
+
+async def check_shortcode_block_size() -> None:
+    """Warn when the block sequence's increment is not SHORTCODE_BLOCK_SIZE"""
+    async with AsyncSessionLocal() as db:
+        increment = await crud.get_shortcode_block_increment(db)
+    if increment is not None and increment != SHORTCODE_BLOCK_SIZE:
+        logger.warning(
+            "SHORTCODE_BLOCK_SIZE is %d but shortcode_block_seq reserves blocks "
+            "of %d; run ALTER SEQUENCE shortcode_block_seq INCREMENT BY %d to "
+            "use the configured size",
+            SHORTCODE_BLOCK_SIZE,
+            increment,
+            SHORTCODE_BLOCK_SIZE,
+        )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Prepare the database in the background, start background workers and
+    flush buffered redirect counts on shutdown.
+    """
+    app.state.ready = False
+    startup = asyncio.create_task(prepare_database(app))
+    await redirect_counter.start()
+    await replica_router.start()
+    await event_log.start()
+    await shortcode_filter.start()
+    try:
+        yield
+    finally:
+        startup.cancel()
+        await asyncio.gather(startup, return_exceptions=True)
+        # One worker failing to stop must not keep the others running
+        for worker in (redirect_counter, replica_router, event_log, shortcode_filter):
+            try:
+                await worker.stop()
+            except Exception:
+                logger.exception("Failed to stop %s", type(worker).__name__)
 
-# Create database tables (sync for now, can be made async in production)
-Base.metadata.create_all(bind=engine)
 
 app = FastAPI(
     title="URL Shortening Service",
     description="A scalable URL shortening service with custom shortcodes",
     version="1.0.0",
+    lifespan=lifespan,
 )
+app.include_router(admin.router)
+if ADMISSION_ENABLED:
+    # Added first, so metrics still record the requests it rejects
+    app.add_middleware(AdmissionMiddleware, controller=admission_controller)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(ReadYourWritesMiddleware)
+if profiling_available():
+    app.add_middleware(
+        ProfilingMiddleware, store=profile_store, authorize=admin.is_admin_token
+    )
+serialization.check_fast_json()
+
+for _engine in [*shard_engines.values(), *replica_router.engines]:
+    instrument_engine(_engine)
+
+
+@app.get("/ready", tags=["Root"])
+async def ready():
+    """
+    Report whether startup has finished and the connection pool is warm.
+    """
+    if not getattr(app.state, "ready", False):
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"ready": False}
+        )
+    return {"ready": True}
+
+
+@app.get("/metrics", tags=["Root"], include_in_schema=False)
+async def metrics():
+    """
+    Request latency, requests in flight and query latency of this process in
+    the Prometheus text format.
+    """
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    return Response(content=render_metrics(), media_type=METRICS_CONTENT_TYPE)
 
 
 @app.post(
-    "/shorten", response_model=URLShortenResponse, status_code=status.HTTP_201_CREATED
+    "/shorten",
+    response_model=URLShortenResponse,
+    status_code=status.HTTP_201_CREATED,
+    dependencies=[Depends(record_client_write)],
 )
 async def shorten_url(
     request: URLShortenRequest, db: AsyncSession = Depends(get_async_db)
@@ -32,7 +204,8 @@ async def shorten_url(
     """
     Shorten a URL with optional custom shortcode.
 
-    If no shortcode is provided, generates a random 6-character shortcode.
+    If no shortcode is provided, generates a random 6-character shortcode,
+    or with SHORTEN_DEDUP returns the mapping already created for the URL.
     """
     # Validate URL is present (handled by Pydantic, but explicit check for error consistency)
     if not request.url:
@@ -40,25 +213,49 @@ async def shorten_url(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Url not present"
         )
 
+    if len(str(request.url)) > MAX_URL_LENGTH:
+        raise HTTPException(
+            status_code=status.HTTP_412_PRECONDITION_FAILED,
+            detail="The provided shortcode/url is invalid",
+        )
+
     # If shortcode is provided, validate it doesn't already exist
     if request.shortcode:
-        if not is_valid_shortcode(request.shortcode):
+        if (
+            not is_valid_shortcode(request.shortcode)
+            or len(request.shortcode) > MAX_SHORTCODE_LENGTH
+        ):
             raise HTTPException(
                 status_code=status.HTTP_412_PRECONDITION_FAILED,
                 detail="The provided shortcode/url is invalid",
             )
 
-        if await crud.shortcode_exists(db, request.shortcode):
+        # The filter rules out most unused shortcodes without a query
+        if shortcode_filter.might_contain(
+            request.shortcode
+        ) and await crud.shortcode_exists(db, request.shortcode):
             raise HTTPException(
                 status_code=status.HTTP_409_CONFLICT, detail="Shortcode already in use"
             )
+        # Added before the insert, so no reader can miss it once it exists
+        shortcode_filter.add(request.shortcode)
 
     try:
         # Create the URL mapping
-        db_mapping = await crud.create_url_mapping(
-            db=db, url=request.url, shortcode=request.shortcode
-        )
+        if SHORTEN_DEDUP and not request.shortcode:
+            db_mapping = await crud.create_deduplicated_url_mapping(db, request.url)
+        else:
+            db_mapping = await crud.create_url_mapping(
+                db=db, url=request.url, shortcode=request.shortcode
+            )
+        if not request.shortcode:
+            shortcode_filter.add(db_mapping.shortcode)
 
+        if serialization.FAST_JSON_RESPONSES:
+            return FastJSONResponse(
+                {"shortcode": db_mapping.shortcode, "update_id": db_mapping.update_id},
+                status_code=status.HTTP_201_CREATED,
+            )
         return URLShortenResponse(
             shortcode=db_mapping.shortcode, update_id=db_mapping.update_id
         )
@@ -69,10 +266,114 @@ async def shorten_url(
         )
 
 
+@app.post(
+    "/shorten/batch",
+    response_model=URLBatchShortenResponse,
+    dependencies=[Depends(record_client_write)],
+)
+async def shorten_urls_batch(
+    request: Request, db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Shorten many URLs at once from a JSON array or an NDJSON body.
+
+    Each entry has the same shape as a POST /shorten request. Results are
+    reported per entry, so invalid entries or taken shortcodes do not abort
+    the rest of the batch.
+    """
+    try:
+        entries = parse_json_batch(
+            await request.body(), request.headers.get("content-type")
+        )
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Body must be a JSON array or newline-delimited JSON",
+        )
+
+    if len(entries) > SHORTEN_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"A batch may contain at most {SHORTEN_BATCH_MAX_ITEMS} URLs",
+        )
+
+    results = [None] * len(entries)
+    valid = []
+    for index, entry in enumerate(entries):
+        if isinstance(entry, ValueError):
+            results[index] = URLBatchShortenResult(
+                index=index,
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="Invalid JSON",
+            )
+            continue
+
+        try:
+            item = URLBatchShortenItem.model_validate(entry)
+        except ValidationError as e:
+            error = e.errors()[0]
+            location = ".".join(str(part) for part in error["loc"])
+            results[index] = URLBatchShortenResult(
+                index=index,
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail=f"{location}: {error['msg']}" if location else error["msg"],
+            )
+            continue
+
+        if item.shortcode is not None and not is_valid_shortcode(item.shortcode):
+            results[index] = URLBatchShortenResult(
+                index=index,
+                status=status.HTTP_412_PRECONDITION_FAILED,
+                detail="The provided shortcode/url is invalid",
+            )
+            continue
+
+        valid.append((index, item))
+
+    shortcode_filter.add_many(
+        item.shortcode for _, item in valid if item.shortcode is not None
+    )
+    created = await crud.create_url_mappings(
+        db, [(str(item.url), item.shortcode) for _, item in valid]
+    )
+    shortcode_filter.add_many(
+        mapping[0]
+        for (_, item), mapping in zip(valid, created)
+        if mapping is not None
+        and mapping is not crud.INSERT_FAILED
+        and item.shortcode is None
+    )
+    for (index, item), mapping in zip(valid, created):
+        if mapping is crud.INSERT_FAILED:
+            results[index] = URLBatchShortenResult(
+                index=index,
+                status=status.HTTP_412_PRECONDITION_FAILED,
+                shortcode=item.shortcode,
+                detail="The provided shortcode/url is invalid",
+            )
+        elif mapping is None:
+            results[index] = URLBatchShortenResult(
+                index=index,
+                status=status.HTTP_409_CONFLICT,
+                shortcode=item.shortcode,
+                detail="Shortcode already in use",
+            )
+        else:
+            results[index] = URLBatchShortenResult(
+                index=index,
+                status=status.HTTP_201_CREATED,
+                shortcode=mapping[0],
+                update_id=mapping[1],
+            )
+
+    return URLBatchShortenResponse(results=results)
+
+
 @app.post(
     "/update/{update_id}",
     response_model=URLUpdateResponse,
     status_code=status.HTTP_201_CREATED,
+    dependencies=[Depends(record_client_write)],
 )
 async def update_url(
     update_id: str, request: URLUpdateRequest, db: AsyncSession = Depends(get_async_db)
@@ -85,10 +386,17 @@ async def update_url(
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Url not present"
         )
+    if len(str(request.url)) > MAX_URL_LENGTH:
+        raise HTTPException(
+            status_code=status.HTTP_412_PRECONDITION_FAILED,
+            detail="The provided url is invalid",
+        )
 
     # Check if update_id exists
-    db_mapping = await crud.get_url_mapping_by_update_id(db, update_id)
-    if not db_mapping:
+    shortcode = await update_id_lookups.do(
+        update_id, lambda: crud.get_shortcode_by_update_id(db, update_id)
+    )
+    if not shortcode:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="The provided update ID does not exist",
@@ -97,7 +405,15 @@ async def update_url(
     try:
         # Update the URL
         updated_mapping = await crud.update_url_mapping(db, update_id, request.url)
+        # Redirects already resolving the shortcode may return the old URL
+        for on_replica in (False, True):
+            redirect_lookups.forget((updated_mapping.shortcode, on_replica))
 
+        if serialization.FAST_JSON_RESPONSES:
+            return FastJSONResponse(
+                {"shortcode": updated_mapping.shortcode},
+                status_code=status.HTTP_201_CREATED,
+            )
         return URLUpdateResponse(shortcode=updated_mapping.shortcode)
     except Exception as e:
         raise HTTPException(
@@ -106,40 +422,226 @@ async def update_url(
         )
 
 
+async def read_with_fallback(
+    lookup, shortcode: str, db: AsyncSession, read_db: AsyncSession
+):
+    """
+    Look up a shortcode on the read session, falling back to the primary when a
+    replica does not have it yet.
+    """
+    found = await lookup(read_db, shortcode)
+    if not found and read_db is not db:
+        found = await lookup(db, shortcode)
+    return found
+
+
 @app.get("/{shortcode}")
-async def redirect_to_url(shortcode: str, db: AsyncSession = Depends(get_async_db)):
+async def redirect_to_url(
+    shortcode: str,
+    db: AsyncSession = Depends(get_async_db),
+    read_db: AsyncSession = Depends(get_async_read_db),
+):
     """
     Redirect to the original URL using the shortcode.
     """
-    db_mapping = await crud.get_url_mapping(db, shortcode)
-    if not db_mapping:
+    original_url = url_cache.get(shortcode)
+    if original_url is None and not shortcode_filter.might_contain(shortcode):
+        # Unknown shortcode, answered without a query
+        event_log.record(shortcode, status.HTTP_404_NOT_FOUND)
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Shortcode not found"
         )
+    if original_url is not None:
+        # Buffer the redirect; counts are written to the database in batches
+        redirect_counter.record(shortcode)
+    else:
+        # Concurrent misses for a shortcode share one lookup. Only the caller
+        # that ran it may have counted its redirect in the database.
+        counted = False
+        on_replica = read_db is not db
 
-    # Increment redirect count and update last redirect time
-    await crud.increment_redirect_count(db, shortcode)
+        async def lookup():
+            nonlocal counted
+            # Read before the query, so a result racing an update is not cached
+            generation = url_cache.generation(shortcode)
+            ttl = None
+            if on_replica:
+                # Resolve on a replica and buffer the count, keeping reads off
+                # the primary
+                found = await read_with_fallback(
+                    crud.get_original_url, shortcode, db, read_db
+                )
+                # A replica may not have replayed an update that was already
+                # invalidated, so its answer is only cached as long as it may lag
+                ttl = REPLICA_MAX_LAG_SECONDS
+            else:
+                # Resolve and count the redirect in one round trip
+                counted = True
+                found = await crud.redirect_url_mapping(db, shortcode)
+            return found, generation, ttl
 
-    return RedirectResponse(
-        url=db_mapping.original_url, status_code=status.HTTP_302_FOUND
-    )
+        original_url, generation, ttl = await redirect_lookups.do(
+            (shortcode, on_replica), lookup
+        )
+        if not original_url:
+            event_log.record(shortcode, status.HTTP_404_NOT_FOUND)
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Shortcode not found"
+            )
+        # A counted redirect is in the database; the time series still needs it
+        redirect_counter.record(shortcode, counted=counted)
+        url_cache.set(shortcode, original_url, generation, ttl)
+
+    event_log.record(shortcode, status.HTTP_302_FOUND)
+    return RedirectResponse(url=original_url, status_code=status.HTTP_302_FOUND)
 
 
 @app.get("/{shortcode}/stats", response_model=URLStatsResponse)
-async def get_url_stats(shortcode: str, db: AsyncSession = Depends(get_async_db)):
+async def get_url_stats(
+    shortcode: str,
+    db: AsyncSession = Depends(get_async_db),
+    read_db: AsyncSession = Depends(get_async_read_db),
+):
     """
     Get statistics for a shortcode including creation time, last redirect, and redirect count.
     """
-    db_mapping = await crud.get_url_mapping(db, shortcode)
-    if not db_mapping:
+    url_stats = None
+    if shortcode_filter.might_contain(shortcode):
+        url_stats = await read_with_fallback(crud.get_url_stats, shortcode, db, read_db)
+    if not url_stats:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Shortcode not found"
         )
 
+    # Include redirects that are buffered but not yet written to the database
+    redirect_count, last_redirect = redirect_counter.merge_pending(
+        shortcode, url_stats.redirect_count, url_stats.last_redirect
+    )
+
+    if serialization.FAST_JSON_RESPONSES:
+        # Skips response_model validation; the keys are those of URLStatsResponse
+        return FastJSONResponse(
+            {
+                "created": url_stats.created_at,
+                "lastRedirect": last_redirect,
+                "redirectCount": redirect_count,
+            }
+        )
     return URLStatsResponse(
-        created=db_mapping.created_at,
-        lastRedirect=db_mapping.last_redirect,
-        redirectCount=db_mapping.redirect_count,
+        created=url_stats.created_at,
+        lastRedirect=last_redirect,
+        redirectCount=redirect_count,
+    )
+
+
+@app.post("/stats/batch", response_model=URLBatchStatsResponse)
+async def get_url_stats_batch(
+    request: URLBatchStatsRequest,
+    db: AsyncSession = Depends(get_async_db),
+    read_db: AsyncSession = Depends(get_async_read_db),
+):
+    """
+    Get the statistics of many shortcodes at once, keyed by shortcode.
+
+    Shortcodes that do not exist are listed under "missing".
+    """
+    if len(request.shortcodes) > STATS_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"A batch may contain at most {STATS_BATCH_MAX_ITEMS} shortcodes",
+        )
+
+    shortcodes = list(dict.fromkeys(request.shortcodes))
+    candidates = [code for code in shortcodes if shortcode_filter.might_contain(code)]
+    found = await crud.get_url_stats_many(read_db, candidates)
+    if read_db is not db and len(found) < len(candidates):
+        # Shortcodes created moments ago may not have reached the replica yet
+        found.update(
+            await crud.get_url_stats_many(
+                db, [code for code in candidates if code not in found]
+            )
+        )
+
+    stats = {}
+    missing = []
+    for shortcode in shortcodes:
+        url_stats = found.get(shortcode)
+        if url_stats is None:
+            missing.append(shortcode)
+            continue
+        # Include redirects that are buffered but not yet written to the database
+        redirect_count, last_redirect = redirect_counter.merge_pending(
+            shortcode, url_stats.redirect_count, url_stats.last_redirect
+        )
+        stats[shortcode] = {
+            "created": url_stats.created_at,
+            "lastRedirect": last_redirect,
+            "redirectCount": redirect_count,
+        }
+
+    if serialization.FAST_JSON_RESPONSES:
+        return FastJSONResponse({"stats": stats, "missing": missing})
+    return URLBatchStatsResponse(stats=stats, missing=missing)
+
+
+@app.get("/{shortcode}/stats/timeseries", response_model=URLTimeseriesResponse)
+async def get_url_timeseries(
+    shortcode: str,
+    granularity: Literal["hour", "day", "month"] = "hour",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_async_db),
+    read_db: AsyncSession = Depends(get_async_read_db),
+):
+    """
+    Get redirects per hour, day or month between start and end (UTC; the
+    last 7 days by default), served from pre-aggregated buckets.
+    """
+    end = next_bucket(
+        truncate_timestamp(end or datetime.now(timezone.utc), granularity), granularity
+    )
+    start = truncate_timestamp(start or end - timedelta(days=7), granularity)
+    if start >= end:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="start must be before end"
+        )
+
+    buckets = []
+    bucket = start
+    while bucket < end:
+        if len(buckets) == TIMESERIES_MAX_BUCKETS:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"A time series may have at most {TIMESERIES_MAX_BUCKETS} buckets",
+            )
+        buckets.append(bucket)
+        bucket = next_bucket(bucket, granularity)
+
+    if not await read_with_fallback(crud.shortcode_exists, shortcode, db, read_db):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Shortcode not found"
+        )
+
+    counts = await crud.get_redirect_timeseries(
+        read_db, shortcode, granularity, start, end
+    )
+    # Include redirects that are buffered but not yet written to the database
+    pending = redirect_counter.pending(shortcode)
+    if pending is not None:
+        for hour, count in pending.hours.items():
+            bucket = truncate_timestamp(hour, granularity)
+            if start <= bucket < end:
+                counts[bucket] = counts.get(bucket, 0) + count
+
+    return URLTimeseriesResponse(
+        shortcode=shortcode,
+        granularity=granularity,
+        start=start,
+        end=end,
+        buckets=[
+            RedirectBucket(start=bucket, count=counts.get(bucket, 0))
+            for bucket in buckets
+        ],
     )
 
 
@@ -0,0 +1,233 @@
+"""
+Prometheus metrics for requests and database queries.
+
+Metrics are kept in plain dictionaries per process and rendered in the
+Prometheus text format by GET /metrics. Recording a sample is a bisect and
+two additions, so the instrumentation stays on in production.
+"""
+
+import bisect
+import contextvars
+import functools
+import os
+import time
+from typing import Dict, List, Sequence, Tuple
+
+from sqlalchemy import event
+
+# Expose GET /metrics
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Requests that matched no route share one label, so scans cannot add series
+UNMATCHED_ROUTE = "unmatched"
+# Queries issued outside a crud function
+OTHER_QUERY = "other"
+
+_query_label: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "query_label", default=OTHER_QUERY
+)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """Latency histogram with one series per combination of label values"""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str],
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        # Per series: counts per bucket (the last one is +Inf) and the sum
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, labels: Tuple[str, ...], seconds: float) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+        counts, total = series
+        counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        total[0] += seconds
+
+    def clear(self) -> None:
+        self._series.clear()
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        for labels, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                label_text = _labels(self.label_names, labels, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{label_text} {cumulative}")
+            label_text = _labels(self.label_names, labels)
+            lines.append(f"{self.name}_sum{label_text} {total[0]!r}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Value that goes up and down, with one series per combination of label values"""
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str]):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def add(self, labels: Tuple[str, ...], amount: float) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, labels: Tuple[str, ...]) -> float:
+        return self._values.get(labels, 0.0)
+
+    def clear(self) -> None:
+        self._values.clear()
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} gauge",
+        ]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, labels)} {value!r}")
+        return lines
+
+
+request_latency = Histogram(
+    "http_request_duration_seconds",
+    "Time spent handling HTTP requests.",
+    ("method", "route", "status"),
+)
+requests_in_flight = Gauge(
+    "http_requests_in_flight",
+    "HTTP requests being handled.",
+    ("method",),
+)
+query_latency = Histogram(
+    "db_query_duration_seconds",
+    "Time spent executing database queries, by calling crud function.",
+    ("function",),
+)
+
+REGISTRY = (request_latency, requests_in_flight, query_latency)
+
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def clear_metrics() -> None:
+    for metric in REGISTRY:
+        metric.clear()
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording the latency of each HTTP request per method,
+    route template and status code, and the number of requests in flight.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status_code = 500
+        requests_in_flight.add((method,), 1)
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            requests_in_flight.add((method,), -1)
+            # The router stores the matched route in the scope
+            route = scope.get("route")
+            path = getattr(route, "path", UNMATCHED_ROUTE)
+            request_latency.observe((method, path, str(status_code)), elapsed)
+
+
+def labelled_queries(function):
+    """Label the database queries run by a crud function with its name"""
+
+    @functools.wraps(function)
+    async def wrapper(*args, **kwargs):
+        token = _query_label.set(function.__name__)
+        try:
+            return await function(*args, **kwargs)
+        finally:
+            _query_label.reset(token)
+
+    return wrapper
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._query_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_query_started", None)
+    if started is not None:
+        query_latency.observe((_query_label.get(),), time.perf_counter() - started)
+
+
+def instrument_engine(engine) -> None:
+    """Time every query run through an async engine"""
+    sync_engine = engine.sync_engine
+    if not event.contains(sync_engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
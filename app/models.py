@@ -1,19 +1,135 @@
-from sqlalchemy import Column, String, DateTime, Integer
+from sqlalchemy import (
+    DDL,
+    Column,
+    String,
+    BigInteger,
+    DateTime,
+    Index,
+    Integer,
+    LargeBinary,
+    Sequence,
+    Uuid,
+    event,
+)
 from sqlalchemy.sql import func
 from app.database import Base
+from app.utils import MAX_SHORTCODE_LENGTH, MAX_URL_LENGTH
 import uuid
 
+# Free space left on each heap page on PostgreSQL, so counter updates can stay
+# on the same page as heap-only tuple (HOT) updates without touching indexes
+COUNTER_TABLE_FILLFACTOR = 90
+
 
 class URLMapping(Base):
     __tablename__ = "url_mappings"
 
-    shortcode = Column(String(255), primary_key=True, index=True)
-    original_url = Column(String(2048), nullable=False)
+    shortcode = Column(String(MAX_SHORTCODE_LENGTH), primary_key=True)
+    original_url = Column(String(MAX_URL_LENGTH), nullable=False)
+    # Native 16-byte UUID on PostgreSQL, handled as a string in Python
     update_id = Column(
-        String(36), unique=True, nullable=False, default=lambda: str(uuid.uuid4())
+        Uuid(as_uuid=False),
+        unique=True,
+        nullable=False,
+        default=lambda: str(uuid.uuid4()),
     )
 
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     last_redirect = Column(DateTime(timezone=True), nullable=True)
     redirect_count = Column(Integer, default=0)
+
+    # Digest of the normalized URL (app.utils.url_hash) on mappings that
+    # deduplicated shortens may hand out again; NULL on all others
+    url_hash = Column(LargeBinary(16), nullable=True)
+
+    __table_args__ = (
+        # Partial, so mappings without a hash take no space in the index
+        Index(
+            "ix_url_mappings_url_hash",
+            url_hash,
+            unique=True,
+            postgresql_where=url_hash.isnot(None),
+            sqlite_where=url_hash.isnot(None),
+        ),
+    )
+
+
+# Block size the sequence below is created and migrated with, and the default
+# SHORTCODE_BLOCK_SIZE
+DEFAULT_SHORTCODE_BLOCK_SIZE = 1000
+
+# Hands out blocks of shortcode IDs on databases with sequences (PostgreSQL).
+# Each value ends a block as long as the increment: nextval() returning v
+# reserves IDs [v - increment, v). The increment is the block size, so
+# changing it (ALTER SEQUENCE ... INCREMENT BY) never overlaps earlier blocks.
+shortcode_block_seq = Sequence(
+    "shortcode_block_seq",
+    start=DEFAULT_SHORTCODE_BLOCK_SIZE,
+    increment=DEFAULT_SHORTCODE_BLOCK_SIZE,
+    metadata=Base.metadata,
+)
+
+
+class ShortcodeBlock(Base):
+    """
+    Reserved shortcode ID blocks on databases without sequences (SQLite).
+    Each block starts where the previous one ended, whatever its size.
+    """
+
+    __tablename__ = "shortcode_blocks"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    start_id = Column(BigInteger, nullable=False, unique=True)
+    end_id = Column(BigInteger, nullable=False)
+
+
+class RedirectCount(Base):
+    """Redirects of a shortcode per hour, day or month, starting at bucket (UTC)"""
+
+    __tablename__ = "redirect_counts"
+
+    shortcode = Column(String(255), primary_key=True)
+    granularity = Column(String(5), primary_key=True)
+    bucket = Column(DateTime(timezone=True), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class RedirectEventCount(Base):
+    """
+    Events of the redirect event log per shortcode, status and hour (UTC).
+
+    Only filled by folding the event log, never by the redirect handler, so
+    it never counts a redirect the live counters already hold. Kept on the
+    coordinator shard.
+    """
+
+    __tablename__ = "redirect_event_counts"
+
+    shortcode = Column(String(255), primary_key=True)
+    status = Column(Integer, primary_key=True)
+    hour = Column(DateTime(timezone=True), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class ProcessedEventSegment(Base):
+    """
+    Event log segments already folded into redirect_event_counts, recorded in
+    the same transaction as their counts so a segment is never applied twice.
+    Kept on the coordinator shard.
+    """
+
+    __tablename__ = "processed_event_segments"
+
+    name = Column(String(255), primary_key=True)
+    processed_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+for _table in (URLMapping.__table__, RedirectCount.__table__):
+    event.listen(
+        _table,
+        "after_create",
+        DDL(
+            f"ALTER TABLE {_table.name} SET (fillfactor = {COUNTER_TABLE_FILLFACTOR})"
+        ).execute_if(dialect="postgresql"),
+    )
@@ -0,0 +1,212 @@
+"""
+Sampled profiling of HTTP requests with pyinstrument.
+
+With PROFILE_ENABLED, a fraction PROFILE_SAMPLE_RATE of requests, and every
+request whose X-Profile header holds the admin token, runs under a sampling
+profiler. Profiles are written to PROFILE_DIR, which keeps the newest
+PROFILE_MAX_FILES of them, and are listed and rendered by /admin/profiles.
+
+pyinstrument is an optional dependency, the profiling extra. Without
+PROFILE_ENABLED the middleware is not installed and requests pay nothing;
+with it but without pyinstrument the application refuses to start.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import tempfile
+import time
+from datetime import datetime, timezone
+from itertools import count
+from typing import Callable, List, Optional, Tuple
+
+try:
+    from pyinstrument import Profiler
+    from pyinstrument.renderers import ConsoleRenderer, HTMLRenderer
+    from pyinstrument.session import Session
+except ImportError:  # pragma: no cover - optional dependency
+    Profiler = None
+
+logger = logging.getLogger(__name__)
+
+PROFILE_ENABLED = os.getenv("PROFILE_ENABLED", "false").lower() == "true"
+# Fraction of requests profiled at random; requests with the header always are
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_SECONDS = float(os.getenv("PROFILE_INTERVAL_SECONDS", "0.001"))
+PROFILE_DIR = os.getenv(
+    "PROFILE_DIR", os.path.join(tempfile.gettempdir(), "url-shortener-profiles")
+)
+# Profiles kept on disk; older ones are deleted
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "100"))
+
+# Request header that asks for a profile; its value must be the admin token
+PROFILE_HEADER = b"x-profile"
+
+PROFILE_SUFFIX = ".json"
+_PROFILE_NAME = re.compile(r"^profile-\d{8}T\d{12}-\d+-\d+$")
+
+
+class ProfileStore:
+    """
+    Ring buffer of profiles in a directory.
+
+    Each file holds a JSON line describing the request followed by a JSON
+    line with the pyinstrument session, so listing only reads first lines.
+    """
+
+    def __init__(
+        self, directory: str = PROFILE_DIR, max_files: int = PROFILE_MAX_FILES
+    ):
+        self.directory = directory
+        self.max_files = max_files
+        self._sequence = count()
+
+    def save(self, request: dict, session) -> str:
+        """Write a profile, drop the oldest beyond max_files and return its name"""
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+        name = f"profile-{stamp}-{os.getpid()}-{next(self._sequence)}"
+        path = os.path.join(self.directory, name + PROFILE_SUFFIX)
+        with open(path + ".tmp", "w") as target:
+            target.write(json.dumps({"name": name, **request}) + "\n")
+            target.write(json.dumps(session.to_json()) + "\n")
+        os.replace(path + ".tmp", path)
+        self._trim()
+        return name
+
+    def list(self) -> List[dict]:
+        """Requests of the stored profiles, newest first"""
+        profiles = []
+        for name in reversed(self._names()):
+            try:
+                with open(self._path(name)) as source:
+                    profiles.append(json.loads(source.readline()))
+            except (OSError, ValueError):
+                # Deleted by another worker or half written
+                continue
+        return profiles
+
+    def load(self, name: str) -> Optional[Tuple[dict, "Session"]]:
+        """Request and session of a stored profile, or None if there is none"""
+        if not _PROFILE_NAME.match(name):
+            return None
+        try:
+            with open(self._path(name)) as source:
+                request = json.loads(source.readline())
+                session = Session.from_json(json.loads(source.readline()))
+        except (OSError, ValueError):
+            return None
+        return request, session
+
+    def _names(self) -> List[str]:
+        try:
+            files = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        # Names start with the UTC time, so they sort oldest first
+        return sorted(
+            name[: -len(PROFILE_SUFFIX)]
+            for name in files
+            if name.endswith(PROFILE_SUFFIX)
+        )
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name + PROFILE_SUFFIX)
+
+    def _trim(self) -> None:
+        names = self._names()
+        for name in names[: max(len(names) - self.max_files, 0)]:
+            try:
+                os.remove(self._path(name))
+            except FileNotFoundError:
+                pass
+
+
+def render_profile(session, output: str = "html") -> str:
+    """Render a session as pyinstrument's HTML page or as a text call tree"""
+    renderer = HTMLRenderer() if output == "html" else ConsoleRenderer()
+    return renderer.render(session)
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware running sampled requests, and requests carrying an
+    authorized X-Profile header, under pyinstrument.
+    """
+
+    def __init__(
+        self,
+        app,
+        store: ProfileStore,
+        sample_rate: float = PROFILE_SAMPLE_RATE,
+        interval: float = PROFILE_INTERVAL_SECONDS,
+        authorize: Callable[[Optional[str]], bool] = lambda token: False,
+        rng: Callable[[], float] = random.random,
+    ):
+        self.app = app
+        self.store = store
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.authorize = authorize
+        self._rng = rng
+
+    def _wants_profile(self, scope) -> bool:
+        if self.sample_rate and self._rng() < self.sample_rate:
+            return True
+        for name, value in scope["headers"]:
+            if name == PROFILE_HEADER:
+                return self.authorize(value.decode("latin-1"))
+        return False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._wants_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        profiler = Profiler(interval=self.interval, async_mode="enabled")
+        started = time.time()
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            session = profiler.stop()
+            route = scope.get("route")
+            request = {
+                "started": datetime.fromtimestamp(started, tz=timezone.utc).isoformat(),
+                "method": scope["method"],
+                "path": scope["path"],
+                "route": getattr(route, "path", None),
+                "status": status_code,
+                "duration_ms": round(session.duration * 1000, 3),
+            }
+            try:
+                await asyncio.to_thread(self.store.save, request, session)
+            except Exception:
+                logger.exception("Failed to save a request profile")
+
+
+def profiling_available() -> bool:
+    """Whether profiling is enabled, raising when pyinstrument is missing for it"""
+    if not PROFILE_ENABLED:
+        return False
+    if Profiler is None:
+        raise RuntimeError(
+            "PROFILE_ENABLED is set but pyinstrument is not installed; "
+            "install the profiling extra (pip install '.[profiling]')"
+        )
+    return True
+
+
+# Profiles written by this process and read by the admin endpoints
+profile_store = ProfileStore()
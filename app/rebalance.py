@@ -0,0 +1,208 @@
+"""
+Move url_mappings rows to the shard that owns them on the hash ring.
+
+    python -m app.rebalance --dry-run
+    python -m app.rebalance
+
+Run it after adding a database to SHARD_DATABASE_URLS, or after importing
+mappings into the main database of a sharded setup. Each shard is read in
+shortcode order, and rows owned by another shard are copied there and then
+deleted, one batch at a time. Only the key ranges the ring assigns elsewhere
+move, and an interrupted run can simply be started again.
+
+While it runs, the service should have SHARD_REBALANCE_FROM set to the
+number of shards before the new ones, so it finds rows that have not moved
+yet and locks them while writing, as this tool does while moving them.
+"""
+
+import argparse
+import asyncio
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.database import shard_engines
+from app.models import RedirectCount, URLMapping
+from app.sharding import HashRing
+from app.transfer import COLUMNS, Progress
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+async def rebalance(
+    engines: Dict[str, AsyncEngine],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    dry_run: bool = False,
+    progress: Optional[Progress] = None,
+) -> Dict[Tuple[str, str], int]:
+    """
+    Move misplaced rows between shards, returning the number of rows per
+    (from shard, to shard) pair.
+    """
+    ring = HashRing(list(engines))
+    progress = progress or Progress("checked" if dry_run else "moved")
+    moved: Dict[Tuple[str, str], int] = Counter()
+    for source_id, source in engines.items():
+        async for batch in _misplaced_rows(source_id, source, ring, batch_size):
+            for target_id, rows in batch.items():
+                if not dry_run:
+                    await _move(source, engines[target_id], rows, ring, target_id)
+                moved[(source_id, target_id)] += len(rows)
+                progress.add(len(rows))
+    progress.finish()
+    return dict(moved)
+
+
+async def _misplaced_rows(
+    source_id: str, source: AsyncEngine, ring: HashRing, batch_size: int
+):
+    """Yield rows of a shard owned by other shards, grouped by owner, batch by batch"""
+    table = URLMapping.__table__
+    last_shortcode = None
+    while True:
+        stmt = select(*(table.c[column] for column in COLUMNS)).order_by(
+            table.c.shortcode
+        )
+        if last_shortcode is not None:
+            stmt = stmt.where(table.c.shortcode > last_shortcode)
+        async with source.connect() as conn:
+            rows = (await conn.execute(stmt.limit(batch_size))).mappings().all()
+        if not rows:
+            return
+        last_shortcode = rows[-1]["shortcode"]
+
+        batch: Dict[str, List[dict]] = defaultdict(list)
+        for row in rows:
+            owner = ring.shard_for_shortcode(row["shortcode"])
+            if owner != source_id:
+                batch[owner].append(dict(row))
+        if batch:
+            yield batch
+
+
+async def _move(
+    source: AsyncEngine,
+    target: AsyncEngine,
+    rows: List[dict],
+    ring: HashRing,
+    target_id: str,
+) -> None:
+    """
+    Copy rows and their redirect buckets to their shard, then delete them from
+    the old one.
+
+    The rows are read again and locked on the old shard in the transaction
+    that deletes them, so a write landing there meanwhile either finishes
+    before the copy or waits and then finds the row on its new shard.
+
+    A row keeps its url_hash only if its URL also belongs on the new shard
+    and no other row there claims the hash already; elsewhere deduplicated
+    shortens would not look for it.
+    """
+    shortcodes = [row["shortcode"] for row in rows]
+    mappings = URLMapping.__table__
+    buckets = RedirectCount.__table__
+    insert = postgresql.insert if target.dialect.name == "postgresql" else sqlite.insert
+
+    async with source.begin() as source_conn:
+        result = await source_conn.execute(
+            select(*(mappings.c[column] for column in COLUMNS))
+            .where(mappings.c.shortcode.in_(shortcodes))
+            .with_for_update()
+        )
+        rows = [dict(row) for row in result.mappings()]
+        result = await source_conn.execute(
+            select(buckets).where(buckets.c.shortcode.in_(shortcodes))
+        )
+        bucket_rows = [dict(row) for row in result.mappings()]
+        if not rows:
+            return
+
+        async with target.begin() as conn:
+            hashes = [
+                row["url_hash"]
+                for row in rows
+                if row["url_hash"] is not None
+                and ring.shard_for_url_hash(row["url_hash"]) == target_id
+            ]
+            claimed = set()
+            if hashes:
+                result = await conn.execute(
+                    select(mappings.c.url_hash).where(
+                        mappings.c.url_hash.in_(hashes),
+                        mappings.c.shortcode.notin_(shortcodes),
+                    )
+                )
+                claimed = set(result.scalars())
+            for row in rows:
+                if row["url_hash"] not in hashes or row["url_hash"] in claimed:
+                    row["url_hash"] = None
+
+            # Rows copied by an interrupted earlier run are replaced, as the
+            # old shard kept taking writes until now
+            stmt = insert(mappings)
+            await conn.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=[mappings.c.shortcode],
+                    set_={
+                        column: stmt.excluded[column]
+                        for column in COLUMNS
+                        if column != "shortcode"
+                    },
+                ),
+                rows,
+            )
+            if bucket_rows:
+                stmt = insert(buckets)
+                await conn.execute(
+                    stmt.on_conflict_do_update(
+                        index_elements=[
+                            buckets.c.shortcode,
+                            buckets.c.granularity,
+                            buckets.c.bucket,
+                        ],
+                        set_={"count": stmt.excluded["count"]},
+                    ),
+                    bucket_rows,
+                )
+
+        for table in (mappings, buckets):
+            await source_conn.execute(
+                delete(table).where(table.c.shortcode.in_(shortcodes))
+            )
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m app.rebalance", description=__doc__.strip().splitlines()[0]
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help="Rows read from a shard per round trip",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Only count the rows that would move",
+    )
+    args = parser.parse_args(argv)
+    asyncio.run(_run(args.batch_size, args.dry_run))
+
+
+async def _run(batch_size: int, dry_run: bool) -> None:
+    try:
+        moved = await rebalance(shard_engines, batch_size, dry_run)
+        for (source_id, target_id), rows in sorted(moved.items()):
+            print(f"shard {source_id} -> shard {target_id}: {rows} rows")
+    finally:
+        for engine in shard_engines.values():
+            await engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
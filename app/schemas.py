@@ -1,6 +1,15 @@
 from datetime import datetime
 from pydantic import BaseModel, ConfigDict, HttpUrl, field_validator
-from typing import Optional
+from typing import Dict, List, Optional
+
+from app.utils import MAX_SHORTCODE_LENGTH, MAX_URL_LENGTH
+
+
+def _check_url_length(url: HttpUrl) -> HttpUrl:
+    # HttpUrl allows longer URLs than the original_url column stores
+    if len(str(url)) > MAX_URL_LENGTH:
+        raise ValueError(f"URL must be at most {MAX_URL_LENGTH} characters")
+    return url
 
 
 class URLShortenRequest(BaseModel):
@@ -15,11 +24,41 @@ class URLShortenRequest(BaseModel):
         return v
 
 
+class URLBatchShortenItem(URLShortenRequest):
+    """One entry of POST /shorten/batch, rejected on its own if it does not fit"""
+
+    @field_validator("url")
+    @classmethod
+    def validate_url(cls, v):
+        return _check_url_length(v)
+
+    @field_validator("shortcode")
+    @classmethod
+    def validate_shortcode_length(cls, v):
+        if v is not None and len(v) > MAX_SHORTCODE_LENGTH:
+            raise ValueError(
+                f"Shortcode must be at most {MAX_SHORTCODE_LENGTH} characters"
+            )
+        return v
+
+
 class URLShortenResponse(BaseModel):
     shortcode: str
     update_id: str
 
 
+class URLBatchShortenResult(BaseModel):
+    index: int
+    status: int
+    shortcode: Optional[str] = None
+    update_id: Optional[str] = None
+    detail: Optional[str] = None
+
+
+class URLBatchShortenResponse(BaseModel):
+    results: List[URLBatchShortenResult]
+
+
 class URLUpdateRequest(BaseModel):
     url: HttpUrl
 
@@ -34,3 +73,25 @@ class URLStatsResponse(BaseModel):
     created: datetime
     lastRedirect: Optional[datetime] = None
     redirectCount: int
+
+
+class URLBatchStatsRequest(BaseModel):
+    shortcodes: List[str]
+
+
+class URLBatchStatsResponse(BaseModel):
+    stats: Dict[str, URLStatsResponse]
+    missing: List[str]
+
+
+class RedirectBucket(BaseModel):
+    start: datetime
+    count: int
+
+
+class URLTimeseriesResponse(BaseModel):
+    shortcode: str
+    granularity: str
+    start: datetime
+    end: datetime
+    buckets: List[RedirectBucket]
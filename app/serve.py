@@ -0,0 +1,320 @@
+"""
+Production entry point: pre-forked uvicorn workers sharing one socket.
+
+    python -m app.serve --workers 8 --port 8000 --db-pool-budget 64
+
+The parent process binds the listening socket and forks the workers, by
+default one per core. Each worker runs uvicorn on uvloop with the httptools
+parser when they are installed. The parent restarts any worker that exits,
+so a worker can retire after SERVE_MAX_REQUESTS requests (with some jitter,
+so they do not all restart together) to bound memory creep. SIGTERM or
+SIGINT stops the workers gracefully and SIGHUP replaces them one at a time.
+
+With DB_POOL_BUDGET, each worker's pool gets an equal share of that many
+connections, so the pools of all workers add up to the budget. The shared
+redirect cache and shortcode filter segments are created once by the parent
+before forking and removed when it exits.
+"""
+
+import argparse
+import logging
+import os
+import random
+import signal
+import socket
+import sys
+import time
+from typing import Dict, Optional
+
+import uvicorn
+
+logger = logging.getLogger("app.serve")
+
+SERVE_HOST = os.getenv("SERVE_HOST", "0.0.0.0")
+SERVE_PORT = int(os.getenv("SERVE_PORT", "8000"))
+# Worker processes; 0 starts one per core
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", "0"))
+# Requests after which a worker exits and is replaced; 0 never replaces workers
+SERVE_MAX_REQUESTS = int(os.getenv("SERVE_MAX_REQUESTS", "0"))
+# Up to this many requests are added to SERVE_MAX_REQUESTS per worker
+SERVE_MAX_REQUESTS_JITTER = int(os.getenv("SERVE_MAX_REQUESTS_JITTER", "0"))
+# Seconds a stopping worker waits for requests in progress
+SERVE_GRACEFUL_TIMEOUT = int(os.getenv("SERVE_GRACEFUL_TIMEOUT", "30"))
+SERVE_ACCESS_LOG = os.getenv("SERVE_ACCESS_LOG", "false").lower() == "true"
+# Connections per database for all workers together; unset keeps DB_POOL_SIZE
+# and DB_MAX_OVERFLOW per worker
+DB_POOL_BUDGET = os.getenv("DB_POOL_BUDGET")
+
+# Exit status of a worker whose app failed to start; restarting will not help
+STARTUP_FAILURE = 3
+# Poll interval of the parent while it watches the workers
+SUPERVISE_INTERVAL_SECONDS = 0.5
+
+
+def default_workers() -> int:
+    """One worker per core available to this process"""
+    if hasattr(os, "sched_getaffinity"):
+        return max(len(os.sched_getaffinity(0)), 1)
+    return os.cpu_count() or 1
+
+
+def pool_settings(budget: int, workers: int) -> Dict[str, str]:
+    """
+    Pool settings giving each worker an equal, fixed share of a connection
+    budget, as environment variables for app.database.
+    """
+    share = budget // workers
+    if share < 1:
+        raise ValueError(
+            f"A budget of {budget} connections cannot be shared by {workers} workers"
+        )
+    # Overflow connections are opened and closed under load; with a fixed
+    # share the pool simply holds all of them
+    return {"DB_POOL_SIZE": str(share), "DB_MAX_OVERFLOW": "0"}
+
+
+def check_shared_filter(workers: int) -> None:
+    """
+    Refuse to start several workers that would each keep their own shortcode
+    filter, as each would report the shortcodes the others create as absent.
+    """
+    from app.bloom import SHORTCODE_FILTER_ENABLED
+    from app.cache import URL_CACHE_BACKEND
+
+    if workers > 1 and SHORTCODE_FILTER_ENABLED and URL_CACHE_BACKEND != "shared":
+        raise ValueError(
+            "SHORTCODE_FILTER_ENABLED with more than one worker needs "
+            "URL_CACHE_BACKEND=shared, so the workers share one filter"
+        )
+
+
+def event_loop() -> str:
+    """uvloop when installed, else the standard asyncio loop"""
+    try:
+        import uvloop  # noqa: F401
+    except ImportError:
+        return "asyncio"
+    return "uvloop"
+
+
+def http_protocol() -> str:
+    """The httptools parser when installed, else h11"""
+    try:
+        import httptools  # noqa: F401
+    except ImportError:
+        return "h11"
+    return "httptools"
+
+
+def open_shared_segments() -> list:
+    """
+    Create the shared memory segments the workers use, so they exist before
+    any worker starts, and return the objects owning them.
+    """
+    from app.cache import URL_CACHE_BACKEND, url_cache
+
+    if URL_CACHE_BACKEND != "shared":
+        return []
+    from app.bloom import shortcode_filter
+
+    segments = [url_cache]
+    if shortcode_filter.bloom is not None:
+        segments.append(shortcode_filter.bloom)
+    return segments
+
+
+class Supervisor:
+    """Forks uvicorn workers on a shared socket and keeps them running"""
+
+    def __init__(
+        self,
+        config: uvicorn.Config,
+        workers: int,
+        max_requests: int = 0,
+        max_requests_jitter: int = 0,
+    ):
+        self.config = config
+        self.workers = workers
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.children: Dict[int, float] = {}
+        self.exit_code = 0
+        self._stopping = False
+        self._replace = []
+
+    def run(self, sock: socket.socket) -> int:
+        self.sock = sock
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        signal.signal(signal.SIGHUP, self._handle_reload)
+
+        logger.info(
+            "Starting %d workers on %s:%d (loop %s, http %s)",
+            self.workers,
+            self.config.host,
+            self.config.port,
+            self.config.loop,
+            self.config.http,
+        )
+        for _ in range(self.workers):
+            self.spawn()
+        while not self._stopping:
+            self.reap()
+            if self._replace and not self._stopping:
+                self._replace_next()
+            time.sleep(SUPERVISE_INTERVAL_SECONDS)
+        self.stop_all()
+        return self.exit_code
+
+    def spawn(self) -> int:
+        pid = os.fork()
+        if pid == 0:
+            self._run_worker()
+        self.children[pid] = time.monotonic()
+        return pid
+
+    def _run_worker(self) -> None:
+        """Serve in a forked child; never returns"""
+        code = 0
+        server = None
+        try:
+            for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+                signal.signal(signum, signal.SIG_DFL)
+            # Forked children start with the parent's random state
+            random.seed()
+            if self.max_requests:
+                self.config.limit_max_requests = self.max_requests + random.randint(
+                    0, self.max_requests_jitter
+                )
+            server = uvicorn.Server(self.config)
+            server.run(sockets=[self.sock])
+        except BaseException:
+            logger.exception("Worker %d failed", os.getpid())
+            code = 1
+        finally:
+            # Includes an app that cannot be imported, where uvicorn exits
+            if server is None or not server.started:
+                code = STARTUP_FAILURE
+            logging.shutdown()
+            sys.stdout.flush()
+            sys.stderr.flush()
+            # Leave without running the parent's cleanup in this process
+            os._exit(code)
+
+    def reap(self) -> None:
+        """Restart workers that exited, or stop if one could not start"""
+        while self.children:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                return
+            self.children.pop(pid, None)
+            code = os.waitstatus_to_exitcode(status)
+            if code == STARTUP_FAILURE:
+                logger.error("Worker %d failed to start, shutting down", pid)
+                self.exit_code = STARTUP_FAILURE
+                self._stopping = True
+                return
+            if not self._stopping:
+                logger.info("Worker %d exited with %d, starting another", pid, code)
+                self.spawn()
+
+    def _replace_next(self) -> None:
+        """Stop one old worker once the previous replacement is up"""
+        if len(self.children) < self.workers:
+            return
+        pid = self._replace.pop(0)
+        if pid in self.children:
+            os.kill(pid, signal.SIGTERM)
+
+    def stop_all(self) -> None:
+        """Stop every worker gracefully and wait for them"""
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + SERVE_GRACEFUL_TIMEOUT + 5
+        while self.children and time.monotonic() < deadline:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                time.sleep(0.1)
+            else:
+                self.children.pop(pid, None)
+        for pid in self.children:
+            logger.warning("Worker %d did not stop in time, killing it", pid)
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        self.children.clear()
+
+    def _handle_stop(self, signum, frame) -> None:
+        self._stopping = True
+
+    def _handle_reload(self, signum, frame) -> None:
+        # Workers are stopped one at a time and reap() starts their replacements
+        self._replace = list(self.children)
+
+
+def main(argv: Optional[list] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default=SERVE_HOST)
+    parser.add_argument("--port", type=int, default=SERVE_PORT)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=SERVE_WORKERS,
+        help="Worker processes (default: one per core)",
+    )
+    parser.add_argument("--max-requests", type=int, default=SERVE_MAX_REQUESTS)
+    parser.add_argument(
+        "--max-requests-jitter", type=int, default=SERVE_MAX_REQUESTS_JITTER
+    )
+    parser.add_argument(
+        "--db-pool-budget",
+        type=int,
+        default=int(DB_POOL_BUDGET) if DB_POOL_BUDGET else None,
+        help="Connections per database for all workers together",
+    )
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args(argv)
+    workers = args.workers or default_workers()
+
+    logging.basicConfig(level=args.log_level.upper())
+    try:
+        check_shared_filter(workers)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.db_pool_budget is not None:
+        # Read by app.database when the workers import the app
+        settings = pool_settings(args.db_pool_budget, workers)
+        os.environ.update(settings)
+        logger.info(
+            "Each worker keeps %s connections per database", settings["DB_POOL_SIZE"]
+        )
+
+    config = uvicorn.Config(
+        "app.main:app",
+        host=args.host,
+        port=args.port,
+        loop=event_loop(),
+        http=http_protocol(),
+        log_level=args.log_level,
+        access_log=SERVE_ACCESS_LOG,
+        timeout_graceful_shutdown=SERVE_GRACEFUL_TIMEOUT,
+    )
+    sock = config.bind_socket()
+    segments = open_shared_segments()
+    supervisor = Supervisor(
+        config, workers, args.max_requests, args.max_requests_jitter
+    )
+    try:
+        code = supervisor.run(sock)
+    finally:
+        sock.close()
+        for segment in segments:
+            segment.close()
+            segment.unlink()
+    sys.exit(code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Consistent-hash routing of url_mappings rows to database shards.
+
+DATABASE_URL is shard "0" and also holds the shortcode block sequence;
+SHARD_DATABASE_URLS lists further shards "1", "2", ... Each shortcode hashes
+to a 32-bit token, and each shard owns the token ranges ending at its virtual
+nodes on the ring. Adding a shard only takes ranges over from existing shards,
+so rebalancing moves about 1/N of the rows.
+
+Update IDs carry the token of their shortcode in their first 32 bits, so an
+update ID is routed to its shard without knowing the shortcode.
+"""
+
+import bisect
+import hashlib
+import os
+import uuid
+from typing import Dict, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy.ext.horizontal_shard import ShardedSession
+from sqlalchemy.orm import sessionmaker
+
+# Databases holding url_mappings in addition to DATABASE_URL
+SHARD_DATABASE_URLS = [
+    url.strip()
+    for url in os.getenv("SHARD_DATABASE_URLS", "").split(",")
+    if url.strip()
+]
+# Points per shard on the hash ring; more points spread keys more evenly
+SHARD_VIRTUAL_NODES = int(os.getenv("SHARD_VIRTUAL_NODES", "64"))
+# Look update IDs issued before sharding up on every shard when the routed shard misses
+SHARD_LEGACY_UPDATE_IDS = os.getenv("SHARD_LEGACY_UPDATE_IDS", "true").lower() == "true"
+
+# While rows move to newly added shards, the number of shards before they were
+# added; shortcodes missing on their new shard are then looked up on their
+# previous one. Unset (0) once app.rebalance has finished.
+SHARD_REBALANCE_FROM = int(os.getenv("SHARD_REBALANCE_FROM", "0"))
+
+# Shard holding the shortcode block sequence and other unsharded tables
+COORDINATOR_SHARD = "0"
+
+_TOKEN_BITS = 32
+_RANDOM_MASK = (1 << (128 - _TOKEN_BITS)) - 1
+
+
+def hash_token(key: str) -> int:
+    """Stable 32-bit position of a key on the hash ring"""
+    return int.from_bytes(
+        hashlib.blake2b(key.encode(), digest_size=_TOKEN_BITS // 8).digest(), "big"
+    )
+
+
+def make_update_id(shortcode: str) -> str:
+    """Random UUID whose first 32 bits are the ring token of the shortcode"""
+    random_bits = uuid.uuid4().int & _RANDOM_MASK
+    return str(
+        uuid.UUID(int=(hash_token(shortcode) << (128 - _TOKEN_BITS)) | random_bits)
+    )
+
+
+def update_id_token(update_id: str) -> Optional[int]:
+    """Ring token stored in an update ID, or None if it is not a UUID"""
+    try:
+        return uuid.UUID(update_id).int >> (128 - _TOKEN_BITS)
+    except (ValueError, AttributeError, TypeError):
+        return None
+
+
+class HashRing:
+    """Consistent hash ring mapping tokens to shard IDs"""
+
+    def __init__(self, shard_ids: List[str], virtual_nodes: int = SHARD_VIRTUAL_NODES):
+        if not shard_ids:
+            raise ValueError("A hash ring needs at least one shard")
+        self.shard_ids = list(shard_ids)
+        points = sorted(
+            (hash_token(f"{shard_id}#{node}"), shard_id)
+            for shard_id in self.shard_ids
+            for node in range(virtual_nodes)
+        )
+        self._tokens = [token for token, _ in points]
+        self._owners = [shard_id for _, shard_id in points]
+
+    def shard_for_token(self, token: int) -> str:
+        """Shard owning a token: the one with the next point clockwise"""
+        index = bisect.bisect_left(self._tokens, token)
+        return self._owners[index % len(self._owners)]
+
+    def shard_for_shortcode(self, shortcode: str) -> str:
+        """Shard storing a shortcode"""
+        return self.shard_for_token(hash_token(shortcode))
+
+    def shard_for_update_id(self, update_id: str) -> Optional[str]:
+        """Shard storing the mapping for an update ID, or None if it is malformed"""
+        token = update_id_token(update_id)
+        return None if token is None else self.shard_for_token(token)
+
+    def shard_for_url_hash(self, digest: bytes) -> str:
+        """Shard storing the deduplicated mapping of a URL with this digest"""
+        return self.shard_for_token(int.from_bytes(digest[:4], "big"))
+
+    def session_options(
+        self, engines: Dict[str, AsyncEngine], previous: Optional["HashRing"] = None
+    ) -> dict:
+        """
+        Keyword arguments that make an AsyncSession route through this ring,
+        and fall back to the previous ring while rows are being rebalanced
+        """
+
+        def shard_chooser(mapper, instance, clause=None):
+            shortcode = getattr(instance, "shortcode", None)
+            if shortcode is not None:
+                return self.shard_for_shortcode(shortcode)
+            return COORDINATOR_SHARD
+
+        def identity_chooser(mapper, primary_key, **kw):
+            if mapper.local_table.name == "url_mappings":
+                return [self.shard_for_shortcode(primary_key[0])]
+            return [COORDINATOR_SHARD]
+
+        def execute_chooser(orm_context):
+            # Statements that are not pinned to a shard run on all of them
+            return self.shard_ids
+
+        return {
+            "sync_session_class": ShardedSession,
+            "shards": {
+                shard_id: engine.sync_engine for shard_id, engine in engines.items()
+            },
+            "shard_chooser": shard_chooser,
+            "identity_chooser": identity_chooser,
+            "execute_chooser": execute_chooser,
+            "info": {"shard_ring": self, "previous_shard_ring": previous},
+        }
+
+
+def sharded_sessionmaker(
+    engines: Dict[str, AsyncEngine], rebalance_from: int = SHARD_REBALANCE_FROM
+) -> sessionmaker:
+    """
+    Async session factory spreading url_mappings over the given shard engines.
+    With rebalance_from, the first that many shards form the previous ring.
+    """
+    ring = HashRing(list(engines))
+    previous = None
+    if 0 < rebalance_from < len(engines):
+        previous = HashRing(list(engines)[:rebalance_from])
+    return sessionmaker(
+        class_=AsyncSession,
+        autocommit=False,
+        autoflush=False,
+        **ring.session_options(engines, previous),
+    )
+
+
+def shard_ring_of(db: AsyncSession) -> Optional[HashRing]:
+    """The hash ring a session routes through, or None for an unsharded session"""
+    return db.info.get("shard_ring")
+
+
+def previous_shard_ring_of(db: AsyncSession) -> Optional[HashRing]:
+    """The ring a session routed through before a rebalance, or None outside one"""
+    return db.info.get("previous_shard_ring")
+
+
+def shard_ids_of(db: AsyncSession) -> List[str]:
+    """Shards a session reaches: those of its ring, or only the coordinator"""
+    ring = shard_ring_of(db)
+    return ring.shard_ids if ring is not None else [COORDINATOR_SHARD]
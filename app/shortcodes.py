@@ -0,0 +1,119 @@
+import asyncio
+import hashlib
+import os
+from typing import List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import DEFAULT_SHORTCODE_BLOCK_SIZE
+from app.utils import SHORTCODE_ALPHABET, encode_shortcode
+
+SHORTCODE_LENGTH = 6
+SHORTCODE_SPACE = len(SHORTCODE_ALPHABET) ** SHORTCODE_LENGTH
+
+SHORTCODE_BLOCK_SIZE = int(
+    os.getenv("SHORTCODE_BLOCK_SIZE", str(DEFAULT_SHORTCODE_BLOCK_SIZE))
+)
+# Changing the secret reshuffles all future shortcodes, so keep it stable
+SHORTCODE_SECRET = os.getenv("SHORTCODE_SECRET", "url-shortener")
+
+# Longest secret blake2b accepts as a key
+MAX_SECRET_BYTES = 64
+
+# The Feistel network permutes 36-bit numbers, just above SHORTCODE_SPACE
+_HALF_BITS = 18
+_HALF_MASK = (1 << _HALF_BITS) - 1
+_ROUNDS = 4
+
+
+def scramble(number: int, secret: str = SHORTCODE_SECRET) -> int:
+    """
+    Map a number in [0, SHORTCODE_SPACE) to another number in the same range.
+
+    The mapping is a keyed bijection, so distinct inputs always give distinct
+    outputs, while consecutive inputs give unrelated-looking outputs.
+    """
+    if not 0 <= number < SHORTCODE_SPACE:
+        raise ValueError(f"{number} is outside the shortcode space")
+
+    key = secret.encode()
+    # Cycle-walk: the 36-bit permutation may land outside the shortcode space
+    while True:
+        number = _feistel(number, key)
+        if number < SHORTCODE_SPACE:
+            return number
+
+
+def _feistel(number: int, key: bytes) -> int:
+    left, right = number >> _HALF_BITS, number & _HALF_MASK
+    for round_number in range(_ROUNDS):
+        digest = hashlib.blake2b(
+            right.to_bytes(3, "big"),
+            key=key,
+            digest_size=4,
+            salt=round_number.to_bytes(1, "big"),
+        ).digest()
+        left, right = right, left ^ (int.from_bytes(digest, "big") & _HALF_MASK)
+    return (left << _HALF_BITS) | right
+
+
+class ShortcodeAllocator:
+    """
+    Hands out unique auto-generated shortcodes without checking the database.
+
+    IDs are reserved from the database in blocks (hi/lo), so a worker only
+    touches the database once per block. Blocks are block_size IDs long, or
+    as long as the sequence's increment on PostgreSQL. Each ID is scrambled and
+    encoded into a 6-character shortcode.
+    """
+
+    def __init__(
+        self, block_size: int = SHORTCODE_BLOCK_SIZE, secret: str = SHORTCODE_SECRET
+    ):
+        if len(secret.encode()) > MAX_SECRET_BYTES:
+            raise ValueError(
+                f"SHORTCODE_SECRET must be at most {MAX_SECRET_BYTES} bytes"
+            )
+        self.block_size = block_size
+        self.secret = secret
+        self._next_id = 0
+        self._end_id = 0
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def next_shortcode(self, db: AsyncSession) -> str:
+        """Get the next unused auto-generated shortcode"""
+        return (await self.next_shortcodes(db, 1))[0]
+
+    async def next_shortcodes(self, db: AsyncSession, count: int) -> List[str]:
+        """Get count unused auto-generated shortcodes"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        ids = []
+        async with self._lock:
+            while len(ids) < count:
+                if self._next_id >= self._end_id:
+                    await self._reserve_block(db)
+                take = min(count - len(ids), self._end_id - self._next_id)
+                ids.extend(range(self._next_id, self._next_id + take))
+                self._next_id += take
+
+        return [encode_shortcode(scramble(i, self.secret)) for i in ids]
+
+    async def _reserve_block(self, db: AsyncSession) -> None:
+        # Imported here to avoid a circular import with app.crud
+        from app import crud
+
+        start, end = await crud.reserve_shortcode_block(db, self.block_size)
+        if end > SHORTCODE_SPACE:
+            raise RuntimeError("Auto-generated shortcode space is exhausted")
+        self._next_id, self._end_id = start, end
+
+    def reset(self) -> None:
+        """Forget the current block, so the next shortcode reserves a new one"""
+        self._next_id = 0
+        self._end_id = 0
+
+
+# Shared allocator used when creating mappings
+shortcode_allocator = ShortcodeAllocator()
@@ -0,0 +1,93 @@
+"""
+Single-flight coalescing of concurrent lookups.
+
+When a hot shortcode is not cached, every concurrent redirect would run the
+same query. With SingleFlight, the first caller for a key runs the lookup and
+the others await its result. Nothing is kept once the lookup finishes, so a
+failure reaches the callers waiting at that moment and the next caller
+starts a new lookup.
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class _LeaderCancelled(Exception):
+    """The caller running a lookup was cancelled before it finished"""
+
+
+class SingleFlight:
+    """Runs at most one lookup per key at a time and shares its outcome"""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self.lookups = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, lookup: Callable[[], Awaitable[T]]) -> T:
+        """
+        Return the result of lookup(), or of the lookup already running for
+        the key. Exceptions raised by the lookup are raised to every caller.
+        """
+        while True:
+            future = self._calls.get(key)
+            if future is None:
+                break
+            self.coalesced += 1
+            try:
+                # Shielded, so a waiter that gives up leaves the others waiting
+                return await asyncio.shield(future)
+            except _LeaderCancelled:
+                # The lookup was abandoned with its caller; run it again
+                self.coalesced -= 1
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        self.lookups += 1
+        try:
+            result = await lookup()
+        except asyncio.CancelledError:
+            self._fail(future, _LeaderCancelled())
+            raise
+        except BaseException as error:
+            self._fail(future, error)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+    @staticmethod
+    def _fail(future: asyncio.Future, error: BaseException) -> None:
+        future.set_exception(error)
+        # Mark it retrieved, so asyncio does not log it when nobody waited
+        future.exception()
+
+    def forget(self, key: Hashable) -> None:
+        """Make later callers start a new lookup instead of joining a running one"""
+        self._calls.pop(key, None)
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self.in_flight(),
+            "lookups": self.lookups,
+            "coalesced": self.coalesced,
+        }
+
+    def clear(self) -> None:
+        self._calls.clear()
+        self.lookups = 0
+        self.coalesced = 0
+
+
+# Redirect lookups of shortcodes missing from the cache
+redirect_lookups = SingleFlight()
+# Update ID lookups of the update endpoint
+update_id_lookups = SingleFlight()
@@ -0,0 +1,384 @@
+"""
+Stream url_mappings in and out of the database as NDJSON or CSV.
+
+    python -m app.transfer export mappings.ndjson
+    python -m app.transfer import mappings.csv --format csv
+
+On PostgreSQL rows move through server-side cursors and COPY; on other
+databases (SQLite) they are read in batches and inserted with multi-row
+INSERTs. Either way memory stays flat regardless of table size. Imported rows
+whose shortcode already exists, or is a reserved name, are skipped.
+"""
+
+import argparse
+import asyncio
+import csv
+import io
+import json
+import re
+import sys
+import time
+from datetime import datetime
+from typing import BinaryIO, Iterator, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from app.database import async_engine
+from app.models import URLMapping
+from app.utils import is_valid_shortcode, normalize_update_id
+
+COLUMNS = [
+    "shortcode",
+    "original_url",
+    "update_id",
+    "created_at",
+    "last_redirect",
+    "redirect_count",
+    "url_hash",
+]
+TIMESTAMP_COLUMNS = ("created_at", "last_redirect")
+
+DEFAULT_CHUNK_SIZE = 5000
+
+# SQLite caps the number of bound parameters in one statement
+SQLITE_MAX_VARIABLES = 32766
+
+_TIMESTAMP_PATTERN = re.compile(
+    r"^(?P<base>\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2})(?:\.(?P<fraction>\d+))?"
+    r"(?P<offset>Z|[+-]\d{2}(?::?\d{2})?)?$"
+)
+
+
+class Progress:
+    """Prints the running row count and throughput to stderr about once a second"""
+
+    def __init__(self, action: str, stream=sys.stderr, interval: float = 1.0):
+        self.action = action
+        self.stream = stream
+        self.interval = interval
+        self.rows = 0
+        self.skipped = 0
+        self.reserved = 0
+        self._started = time.monotonic()
+        self._last_report = self._started
+
+    def add(self, rows: int, skipped: int = 0, reserved: int = 0) -> None:
+        self.rows += rows
+        self.skipped += skipped
+        self.reserved += reserved
+        now = time.monotonic()
+        if now - self._last_report >= self.interval:
+            self._last_report = now
+            self._report(now)
+
+    def finish(self) -> None:
+        self._report(time.monotonic(), final=True)
+
+    def _report(self, now: float, final: bool = False) -> None:
+        elapsed = max(now - self._started, 1e-9)
+        message = f"{self.action} {self.rows} rows ({self.rows / elapsed:,.0f} rows/s)"
+        if self.skipped:
+            message += f", skipped {self.skipped} existing"
+        if self.reserved:
+            message += f", skipped {self.reserved} reserved"
+        if final:
+            message += f" in {elapsed:.1f}s"
+        print(message, file=self.stream, flush=True)
+
+
+def parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    """Parse ISO 8601 timestamps as written by this tool or by PostgreSQL COPY"""
+    if not value:
+        return None
+    match = _TIMESTAMP_PATTERN.match(value.strip())
+    if not match:
+        raise ValueError(f"Invalid timestamp: {value!r}")
+
+    text = match["base"].replace(" ", "T")
+    if match["fraction"]:
+        text += "." + match["fraction"][:6].ljust(6, "0")
+    offset = match["offset"]
+    if offset == "Z":
+        text += "+00:00"
+    elif offset:
+        digits = offset[1:].replace(":", "")
+        text += f"{offset[0]}{digits[:2]}:{digits[2:4] or '00'}"
+    return datetime.fromisoformat(text)
+
+
+def _format_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        # The hex form PostgreSQL COPY writes for bytea
+        return "\\x" + value.hex()
+    return value
+
+
+def parse_bytes(value: Optional[str]) -> Optional[bytes]:
+    """Parse binary values written as \\x-prefixed hex"""
+    if not value:
+        return None
+    if not value.startswith("\\x"):
+        raise ValueError(f"Invalid binary value: {value!r}")
+    return bytes.fromhex(value[2:])
+
+
+def _parse_row(row: dict) -> Optional[dict]:
+    """Convert an imported record to column values, or None for a reserved shortcode"""
+    missing = [
+        column for column in ("shortcode", "original_url") if not row.get(column)
+    ]
+    if missing:
+        raise ValueError(f"Missing required columns: {', '.join(missing)}")
+
+    values = {column: row.get(column) for column in COLUMNS}
+    if not is_valid_shortcode(values["shortcode"]):
+        return None
+    for column in TIMESTAMP_COLUMNS:
+        value = values[column]
+        if isinstance(value, str) or value is None:
+            values[column] = parse_timestamp(value)
+    values["redirect_count"] = int(values["redirect_count"] or 0)
+    values["url_hash"] = parse_bytes(values["url_hash"])
+    if not values["update_id"]:
+        raise ValueError(f"Missing update_id for shortcode {values['shortcode']!r}")
+    update_id = normalize_update_id(values["update_id"])
+    if update_id is None:
+        raise ValueError(f"Invalid update_id for shortcode {values['shortcode']!r}")
+    values["update_id"] = update_id
+    return values
+
+
+def _read_records(source: BinaryIO, fmt: str) -> Iterator[dict]:
+    text = io.TextIOWrapper(source, encoding="utf-8", newline="")
+    if fmt == "csv":
+        yield from csv.DictReader(text)
+        return
+    for line in text:
+        if line.strip():
+            yield json.loads(line)
+
+
+def _chunks(
+    records: Iterator[dict], size: int, progress: Progress
+) -> Iterator[List[dict]]:
+    chunk = []
+    for record in records:
+        row = _parse_row(record)
+        if row is None:
+            progress.add(0, reserved=1)
+            continue
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+async def export_mappings(
+    engine: AsyncEngine,
+    output: BinaryIO,
+    fmt: str = "ndjson",
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    progress: Optional[Progress] = None,
+) -> int:
+    """Write every URL mapping to output, returning the number of rows"""
+    progress = progress or Progress("exported")
+    async with engine.connect() as conn:
+        if fmt == "csv" and engine.dialect.name == "postgresql":
+            await _copy_out(conn, output, progress)
+        else:
+            await _stream_out(conn, output, fmt, chunk_size, progress)
+    progress.finish()
+    return progress.rows
+
+
+async def _copy_out(conn: AsyncConnection, output: BinaryIO, progress: Progress):
+    raw = await conn.get_raw_connection()
+    header = True
+
+    async def write(data: bytes) -> None:
+        nonlocal header
+        output.write(data)
+        rows = data.count(b"\n")
+        if header and rows:
+            rows -= 1
+            header = False
+        progress.add(rows)
+
+    await raw.driver_connection.copy_from_query(
+        f"SELECT {', '.join(COLUMNS)} FROM {URLMapping.__tablename__}",
+        output=write,
+        format="csv",
+        header=True,
+    )
+
+
+async def _stream_out(
+    conn: AsyncConnection,
+    output: BinaryIO,
+    fmt: str,
+    chunk_size: int,
+    progress: Progress,
+):
+    table = URLMapping.__table__
+    result = await conn.stream(
+        select(*(table.c[column] for column in COLUMNS)).execution_options(
+            yield_per=chunk_size
+        )
+    )
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n") if fmt == "csv" else None
+    if writer:
+        writer.writerow(COLUMNS)
+
+    async for partition in result.partitions():
+        for row in partition:
+            values = [_format_value(value) for value in row]
+            if writer:
+                writer.writerow(values)
+            else:
+                buffer.write(json.dumps(dict(zip(COLUMNS, values))) + "\n")
+        output.write(buffer.getvalue().encode("utf-8"))
+        buffer.seek(0)
+        buffer.truncate()
+        progress.add(len(partition))
+
+    output.write(buffer.getvalue().encode("utf-8"))
+
+
+async def import_mappings(
+    engine: AsyncEngine,
+    source: BinaryIO,
+    fmt: str = "ndjson",
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    progress: Optional[Progress] = None,
+) -> int:
+    """Load URL mappings from source, skipping existing shortcodes; returns rows added"""
+    progress = progress or Progress("imported")
+    chunks = _chunks(_read_records(source, fmt), chunk_size, progress)
+    if engine.dialect.name == "postgresql":
+        await _copy_in(engine, chunks, progress)
+    else:
+        await _insert_in(engine, chunks, progress)
+    progress.finish()
+    return progress.rows
+
+
+async def _copy_in(
+    engine: AsyncEngine, chunks: Iterator[List[dict]], progress: Progress
+):
+    table = URLMapping.__tablename__
+    staging = f"{table}_import"
+    columns = ", ".join(COLUMNS)
+    selected = ", ".join(
+        "COALESCE(created_at, now())" if column == "created_at" else column
+        for column in COLUMNS
+    )
+    async with engine.connect() as conn:
+        raw = (await conn.get_raw_connection()).driver_connection
+        # COPY into a staging table first, so existing shortcodes can be skipped
+        await raw.execute(
+            f"CREATE TEMPORARY TABLE {staging} "
+            f"(LIKE {table} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+        )
+        try:
+            for chunk in chunks:
+                async with raw.transaction():
+                    await raw.copy_records_to_table(
+                        staging,
+                        records=[tuple(row[c] for c in COLUMNS) for row in chunk],
+                        columns=COLUMNS,
+                    )
+                    status = await raw.execute(
+                        f"INSERT INTO {table} ({columns}) "
+                        f"SELECT {selected} FROM {staging} ON CONFLICT DO NOTHING"
+                    )
+                inserted = int(status.rsplit(" ", 1)[-1])
+                progress.add(inserted, skipped=len(chunk) - inserted)
+        finally:
+            await raw.execute(f"DROP TABLE IF EXISTS {staging}")
+
+
+async def _insert_in(
+    engine: AsyncEngine, chunks: Iterator[List[dict]], progress: Progress
+):
+    table = URLMapping.__table__
+    for chunk in chunks:
+        for row in chunk:
+            if row["created_at"] is None:
+                # Let the server default fill it in
+                del row["created_at"]
+        inserted = 0
+        async with engine.begin() as conn:
+            for rows in _same_columns(chunk, SQLITE_MAX_VARIABLES // len(COLUMNS)):
+                result = await conn.execute(
+                    sqlite.insert(table)
+                    .values(rows)
+                    .on_conflict_do_nothing()
+                    .returning(table.c.shortcode)
+                )
+                inserted += len(result.all())
+        progress.add(inserted, skipped=len(chunk) - inserted)
+
+
+def _same_columns(rows: List[dict], max_rows: int) -> Iterator[List[dict]]:
+    """Split rows into runs with the same keys, as a multi-row INSERT requires"""
+    run: List[dict] = []
+    for row in rows:
+        if run and (row.keys() != run[0].keys() or len(run) >= max_rows):
+            yield run
+            run = []
+        run.append(row)
+    if run:
+        yield run
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m app.transfer", description=__doc__.strip().splitlines()[0]
+    )
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("path", help="File to write or read, or - for stdout/stdin")
+    parser.add_argument(
+        "--format",
+        choices=["ndjson", "csv"],
+        help="File format (default: from the file extension, else ndjson)",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help="Rows fetched or inserted per round trip",
+    )
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ("csv" if args.path.endswith(".csv") else "ndjson")
+    asyncio.run(_run(args.command, args.path, fmt, args.chunk_size))
+
+
+async def _run(command: str, path: str, fmt: str, chunk_size: int) -> None:
+    try:
+        if command == "export":
+            if path == "-":
+                await export_mappings(async_engine, sys.stdout.buffer, fmt, chunk_size)
+            else:
+                with open(path, "wb") as output:
+                    await export_mappings(async_engine, output, fmt, chunk_size)
+        else:
+            if path == "-":
+                await import_mappings(async_engine, sys.stdin.buffer, fmt, chunk_size)
+            else:
+                with open(path, "rb") as source:
+                    await import_mappings(async_engine, source, fmt, chunk_size)
+    finally:
+        await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
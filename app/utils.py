@@ -1,7 +1,48 @@
+import hashlib
+import json
 import random
 import string
 import re
-from urllib.parse import urlparse
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, List, Optional
+from urllib.parse import urlparse, urlsplit, urlunsplit
+
+# Content types for newline-delimited JSON request bodies
+NDJSON_MEDIA_TYPES = (
+    "application/x-ndjson",
+    "application/ndjson",
+    "application/jsonl",
+)
+
+# Bucket sizes of the redirect time series, from finest to coarsest
+TIMESERIES_GRANULARITIES = ("hour", "day", "month")
+
+# Longest URL and shortcode the url_mappings columns hold
+MAX_URL_LENGTH = 2048
+MAX_SHORTCODE_LENGTH = 255
+
+# First path segments of the service's own routes. A mapping with one of these
+# as its shortcode could never be redirected to, so they cannot be used.
+RESERVED_SHORTCODES = frozenset(
+    [
+        "admin",
+        "docs",
+        "metrics",
+        "openapi.json",
+        "ready",
+        "redoc",
+        "shorten",
+        "stats",
+        "update",
+    ]
+)
+
+# Ports left out of normalized URLs
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+# Characters allowed in auto-generated shortcodes
+SHORTCODE_ALPHABET = string.ascii_letters + string.digits + "_"
 
 
 def generate_shortcode(length: int = 6) -> str:
@@ -9,8 +50,23 @@ def generate_shortcode(length: int = 6) -> str:
     Generate a random shortcode with specified length.
     Contains only alphanumeric characters and underscores.
     """
-    characters = string.ascii_letters + string.digits + "_"
-    return "".join(random.choice(characters) for _ in range(length))
+    return "".join(random.choice(SHORTCODE_ALPHABET) for _ in range(length))
+
+
+def encode_shortcode(number: int, length: int = 6) -> str:
+    """
+    Encode a number as a fixed-length shortcode over SHORTCODE_ALPHABET.
+    The number must be below len(SHORTCODE_ALPHABET) ** length.
+    """
+    base = len(SHORTCODE_ALPHABET)
+    if not 0 <= number < base**length:
+        raise ValueError(f"{number} does not fit in a {length}-character shortcode")
+
+    chars = []
+    for _ in range(length):
+        number, digit = divmod(number, base)
+        chars.append(SHORTCODE_ALPHABET[digit])
+    return "".join(reversed(chars))
 
 
 def is_valid_url(url: str) -> bool:
@@ -27,11 +83,47 @@ def is_valid_url(url: str) -> bool:
 def is_valid_shortcode(shortcode: str) -> bool:
     """
     Validate if a shortcode meets the basic requirements.
-    For user-provided shortcodes, any format is allowed.
+    For user-provided shortcodes, any format is allowed except the
+    names of the service's own routes.
     """
     if not shortcode or len(shortcode) == 0:
         return False
-    return True
+    return shortcode not in RESERVED_SHORTCODES
+
+
+def normalize_update_id(update_id: str) -> Optional[str]:
+    """
+    Canonical lowercase, hyphenated form of an update ID, or None if it is
+    not a UUID and so cannot match any mapping.
+    """
+    try:
+        return str(uuid.UUID(update_id))
+    except (ValueError, AttributeError, TypeError):
+        return None
+
+
+def normalize_url(url: str) -> str:
+    """
+    Form of a URL shared by all spellings that redirect to the same place:
+    lowercase scheme and host, no default port and "/" for an empty path.
+    The path, query and fragment are kept as they are.
+    """
+    parts = urlsplit(str(url))
+    scheme = parts.scheme.lower()
+    host = parts.hostname or ""
+    if ":" in host:
+        host = f"[{host}]"
+    netloc = (
+        parts.netloc.rpartition("@")[0] + "@" + host if "@" in parts.netloc else host
+    )
+    if parts.port is not None and parts.port != DEFAULT_PORTS.get(scheme):
+        netloc += f":{parts.port}"
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, parts.fragment))
+
+
+def url_hash(url: str) -> bytes:
+    """Fixed-width 16-byte digest of a URL's normalized form"""
+    return hashlib.blake2b(normalize_url(url).encode(), digest_size=16).digest()
 
 
 def is_auto_generated_shortcode_valid(shortcode: str) -> bool:
@@ -44,3 +136,59 @@ def is_auto_generated_shortcode_valid(shortcode: str) -> bool:
         return False
     pattern = re.compile(r"^[a-zA-Z0-9_]+$")
     return bool(pattern.match(shortcode))
+
+
+def parse_json_batch(body: bytes, content_type: Optional[str] = None) -> List[Any]:
+    """
+    Parse a request body holding either a JSON array or newline-delimited JSON.
+
+    A malformed JSON array raises ValueError. Malformed NDJSON lines are
+    returned as ValueError instances so the other lines can still be used.
+    """
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    if media_type not in NDJSON_MEDIA_TYPES and body.lstrip().startswith(b"["):
+        entries = json.loads(body)
+        if not isinstance(entries, list):
+            raise ValueError("Expected a JSON array")
+        return entries
+
+    entries = []
+    for line in body.splitlines():
+        if not line.strip():
+            continue
+        try:
+            entries.append(json.loads(line))
+        except ValueError as e:
+            entries.append(e)
+    return entries
+
+
+def truncate_timestamp(at: datetime, granularity: str) -> datetime:
+    """
+    Start of the hour, day or month containing a timestamp, in UTC.
+    Naive timestamps are taken to be in UTC.
+    """
+    if at.tzinfo is None:
+        at = at.replace(tzinfo=timezone.utc)
+    at = at.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    if granularity == "hour":
+        return at
+    at = at.replace(hour=0)
+    if granularity == "day":
+        return at
+    if granularity == "month":
+        return at.replace(day=1)
+    raise ValueError(f"Unknown granularity: {granularity}")
+
+
+def next_bucket(start: datetime, granularity: str) -> datetime:
+    """Start of the bucket after the one starting at start"""
+    if granularity == "hour":
+        return start + timedelta(hours=1)
+    if granularity == "day":
+        return start + timedelta(days=1)
+    if granularity == "month":
+        if start.month == 12:
+            return start.replace(year=start.year + 1, month=1)
+        return start.replace(month=start.month + 1)
+    raise ValueError(f"Unknown granularity: {granularity}")
@@ -0,0 +1,494 @@
+"""
+Load test for the URL shortener.
+
+    python -m bench.loadtest --duration 30 --concurrency 64
+    python -m bench.loadtest --target uvicorn --database-url postgresql://...
+    python -m bench.loadtest --target http://localhost:8000 --replay trace.jsonl
+
+Seeds a set of shortcodes, then drives a weighted mix of POST /shorten,
+POST /update/{update_id}, GET /{shortcode} and GET /{shortcode}/stats from
+concurrent clients. Shortcodes are picked with a Zipfian distribution, so a
+few hot keys take most of the traffic as in production. Latency percentiles
+and throughput are printed per route and written as JSON with --output, and
+--compare prints the change against an earlier result file.
+
+The app runs in this process through httpx's ASGI transport by default, in a
+uvicorn subprocess with --target uvicorn, or is reached at a URL.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+DEFAULT_DATABASE_URL = "sqlite+aiosqlite:///./bench.db"
+DEFAULT_MIX = "redirect=80,stats=10,shorten=5,update=5"
+
+ROUTES = {
+    "shorten": "POST /shorten",
+    "update": "POST /update/{update_id}",
+    "redirect": "GET /{shortcode}",
+    "stats": "GET /{shortcode}/stats",
+}
+
+
+@dataclass
+class Config:
+    target: str = "inprocess"
+    database_url: Optional[str] = None
+    mix: Dict[str, float] = field(default_factory=lambda: parse_mix(DEFAULT_MIX))
+    concurrency: int = 32
+    duration: float = 10.0
+    requests: Optional[int] = None
+    keys: int = 1000
+    zipf_s: float = 1.1
+    replay: Optional[str] = None
+    workers: int = 1
+    seed: int = 0
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    """Parse "redirect=80,stats=10" into route weights"""
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ROUTES:
+            raise ValueError(f"Unknown route {name!r}, expected one of {list(ROUTES)}")
+        mix[name] = float(weight)
+    if not any(weight > 0 for weight in mix.values()):
+        raise ValueError("The mix needs at least one route with a positive weight")
+    return mix
+
+
+class ZipfSampler:
+    """Draws items with probability proportional to 1 / rank**s"""
+
+    def __init__(self, items: List, s: float, rng: random.Random):
+        self.items = list(items)
+        self._cum_weights = list(
+            itertools.accumulate(1 / rank**s for rank in range(1, len(items) + 1))
+        )
+        self._rng = rng
+
+    def sample(self):
+        return self._rng.choices(self.items, cum_weights=self._cum_weights)[0]
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(samples: List[float], errors: int, elapsed: float) -> dict:
+    """Request count, errors, throughput and latency percentiles in milliseconds"""
+    ordered = sorted(samples)
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "rps": round(len(ordered) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3) if ordered else 0.0,
+    }
+
+
+def route_of(method: str, path: str) -> str:
+    """Route template a replayed request belongs to"""
+    path = path.split("?", 1)[0]
+    if method == "POST":
+        if path.startswith("/update/"):
+            return ROUTES["update"]
+        return f"POST {path}"
+    if path.endswith("/stats"):
+        return ROUTES["stats"]
+    if path.count("/") == 1 and path != "/":
+        return ROUTES["redirect"]
+    return f"{method} {path}"
+
+
+def load_trace(path: str) -> List[dict]:
+    """
+    Read a JSONL trace of {"method", "path", "json"} objects. "{shortcode}" and
+    "{update_id}" in paths are filled in with seeded keys when replayed.
+    """
+    trace = []
+    with open(path) as source:
+        for line_number, line in enumerate(source, 1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if "path" not in entry:
+                raise ValueError(f"{path}:{line_number}: missing 'path'")
+            trace.append(
+                {
+                    "method": entry.get("method", "GET").upper(),
+                    "path": entry["path"],
+                    "json": entry.get("json"),
+                }
+            )
+    if not trace:
+        raise ValueError(f"{path} holds no requests")
+    return trace
+
+
+class Recorder:
+    """Collects latencies and errors per route"""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.statuses: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+
+    def add(self, route: str, seconds: float, status: Optional[int], ok: bool):
+        self.samples[route].append(seconds)
+        self.statuses[route][status or 0] += 1
+        if not ok:
+            self.errors[route] += 1
+
+    def report(self, elapsed: float) -> dict:
+        routes = {
+            route: {
+                **summarize(samples, self.errors[route], elapsed),
+                "statuses": {
+                    str(code): n for code, n in sorted(self.statuses[route].items())
+                },
+            }
+            for route, samples in sorted(self.samples.items())
+        }
+        everything = [s for samples in self.samples.values() for s in samples]
+        return {
+            "routes": routes,
+            "total": summarize(everything, sum(self.errors.values()), elapsed),
+        }
+
+
+async def seed(client: httpx.AsyncClient, count: int) -> List[Tuple[str, str]]:
+    """Create shortcodes to drive the load against, returning (shortcode, update_id)"""
+    keys = []
+    run = uuid.uuid4().hex[:8]
+    for start in range(0, count, 500):
+        body = [
+            {"url": f"https://example.com/{run}/{i}"}
+            for i in range(start, min(start + 500, count))
+        ]
+        response = await client.post("/shorten/batch", json=body)
+        response.raise_for_status()
+        for result in response.json()["results"]:
+            if result["status"] == 201:
+                keys.append((result["shortcode"], result["update_id"]))
+    if not keys:
+        raise RuntimeError("Seeding created no shortcodes")
+    return keys
+
+
+async def drive(
+    client: httpx.AsyncClient,
+    config: Config,
+    keys: List[Tuple[str, str]],
+    trace: Optional[List[dict]] = None,
+) -> dict:
+    """Send the configured load and return the per-route report"""
+    rng = random.Random(config.seed)
+    sampler = ZipfSampler(keys, config.zipf_s, rng)
+    names = [name for name, weight in config.mix.items() if weight > 0]
+    weights = [config.mix[name] for name in names]
+    recorder = Recorder()
+    counter = itertools.count()
+    trace_position = itertools.count()
+    started = time.perf_counter()
+    deadline = started + config.duration
+
+    def next_request():
+        shortcode, update_id = sampler.sample()
+        if trace is not None:
+            entry = trace[next(trace_position) % len(trace)]
+            path = entry["path"].format(shortcode=shortcode, update_id=update_id)
+            return route_of(entry["method"], path), entry["method"], path, entry["json"]
+        name = rng.choices(names, weights=weights)[0]
+        if name == "shorten":
+            body = {"url": f"https://example.com/new/{uuid.uuid4().hex}"}
+            return ROUTES[name], "POST", "/shorten", body
+        if name == "update":
+            body = {"url": f"https://example.org/{uuid.uuid4().hex}"}
+            return ROUTES[name], "POST", f"/update/{update_id}", body
+        if name == "stats":
+            return ROUTES[name], "GET", f"/{shortcode}/stats", None
+        return ROUTES[name], "GET", f"/{shortcode}", None
+
+    async def worker():
+        while True:
+            if config.requests is not None:
+                if next(counter) >= config.requests:
+                    return
+            elif time.perf_counter() >= deadline:
+                return
+            route, method, path, body = next_request()
+            sent = time.perf_counter()
+            try:
+                response = await client.request(method, path, json=body)
+                status = response.status_code
+                ok = status < 400 or (trace is not None and status < 500)
+            except httpx.HTTPError:
+                status, ok = None, False
+            recorder.add(route, time.perf_counter() - sent, status, ok)
+
+    await asyncio.gather(*(worker() for _ in range(config.concurrency)))
+    return recorder.report(time.perf_counter() - started)
+
+
+async def wait_until_ready(client: httpx.AsyncClient, timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if (await client.get("/ready")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        if time.monotonic() >= deadline:
+            raise RuntimeError("The app did not become ready in time")
+        await asyncio.sleep(0.1)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@asynccontextmanager
+async def open_client(config: Config):
+    """HTTP client for the target, starting the app first if needed"""
+    limits = httpx.Limits(
+        max_connections=config.concurrency, max_keepalive_connections=config.concurrency
+    )
+    timeout = httpx.Timeout(30.0)
+
+    if config.target == "inprocess":
+        # The app reads its settings on import
+        from app.main import app
+
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://bench", timeout=timeout
+            ) as client:
+                await wait_until_ready(client)
+                yield client
+        return
+
+    process = None
+    if config.target == "uvicorn":
+        port = _free_port()
+        process = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "uvicorn",
+                "app.main:app",
+                "--host",
+                "127.0.0.1",
+                "--port",
+                str(port),
+                "--workers",
+                str(config.workers),
+                "--log-level",
+                "warning",
+                "--no-access-log",
+            ],
+            env=os.environ.copy(),
+        )
+        base_url = f"http://127.0.0.1:{port}"
+    else:
+        base_url = config.target
+
+    try:
+        async with httpx.AsyncClient(
+            base_url=base_url, limits=limits, timeout=timeout
+        ) as client:
+            await wait_until_ready(client)
+            yield client
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+
+
+async def run(config: Config) -> dict:
+    """Seed keys, run the load and return the full result document"""
+    trace = load_trace(config.replay) if config.replay else None
+    async with open_client(config) as client:
+        keys = await seed(client, config.keys)
+        report = await drive(client, config, keys, trace)
+
+    config_dict = asdict(config)
+    if config.database_url:
+        config_dict["database_url"] = _without_password(config.database_url)
+    return {
+        "started": datetime.now(timezone.utc).isoformat(),
+        "config": config_dict,
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "commit": _git_commit(),
+        },
+        **report,
+    }
+
+
+def _without_password(url: str) -> str:
+    scheme, _, rest = url.partition("://")
+    credentials, at, host = rest.rpartition("@")
+    if not at:
+        return url
+    user = credentials.split(":", 1)[0]
+    return f"{scheme}://{user}@{host}"
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def format_report(result: dict, baseline: Optional[dict] = None) -> str:
+    """Human-readable table of a result, with changes against a baseline"""
+    lines = [
+        f"{'route':<28} {'requests':>9} {'errors':>7} {'req/s':>9} "
+        f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+    ]
+    rows = list(result["routes"].items()) + [("total", result["total"])]
+    for route, stats in rows:
+        lines.append(
+            f"{route:<28} {stats['requests']:>9} {stats['errors']:>7} "
+            f"{stats['rps']:>9.1f} {stats['p50_ms']:>9.2f} {stats['p95_ms']:>9.2f} "
+            f"{stats['p99_ms']:>9.2f}"
+        )
+        if baseline is None:
+            continue
+        before = (
+            baseline["total"]
+            if route == "total"
+            else baseline.get("routes", {}).get(route)
+        )
+        if before:
+            lines.append(
+                f"{'  vs baseline':<28} {'':>9} {'':>7} "
+                f"{_change(before['rps'], stats['rps']):>9} "
+                f"{_change(before['p50_ms'], stats['p50_ms']):>9} "
+                f"{_change(before['p95_ms'], stats['p95_ms']):>9} "
+                f"{_change(before['p99_ms'], stats['p99_ms']):>9}"
+            )
+    return "\n".join(lines)
+
+
+def _change(before: float, after: float) -> str:
+    if not before:
+        return "n/a"
+    return f"{(after - before) / before:+.1%}"
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m bench.loadtest", description=__doc__.strip().splitlines()[0]
+    )
+    parser.add_argument(
+        "--target",
+        default="inprocess",
+        help="inprocess, uvicorn, or the base URL of a running server",
+    )
+    parser.add_argument(
+        "--database-url",
+        help=f"DATABASE_URL for inprocess and uvicorn targets "
+        f"(default: DATABASE_URL, else {DEFAULT_DATABASE_URL})",
+    )
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default=parse_mix(DEFAULT_MIX),
+        help=f"Route weights (default: {DEFAULT_MIX})",
+    )
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument(
+        "--duration", type=float, default=10.0, help="Seconds to run for"
+    )
+    parser.add_argument(
+        "--requests", type=int, help="Stop after this many requests instead"
+    )
+    parser.add_argument(
+        "--keys", type=int, default=1000, help="Shortcodes seeded before the run"
+    )
+    parser.add_argument(
+        "--zipf-s",
+        type=float,
+        default=1.1,
+        help="Zipf exponent for picking shortcodes; 0 is uniform",
+    )
+    parser.add_argument("--replay", help="JSONL trace to replay instead of the mix")
+    parser.add_argument(
+        "--workers", type=int, default=1, help="uvicorn workers for --target uvicorn"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--output", help="Write the result as JSON to this file")
+    parser.add_argument("--compare", help="Earlier result file to compare against")
+    args = parser.parse_args(argv)
+
+    config = Config(
+        target=args.target,
+        database_url=args.database_url,
+        mix=args.mix,
+        concurrency=args.concurrency,
+        duration=args.duration,
+        requests=args.requests,
+        keys=args.keys,
+        zipf_s=args.zipf_s,
+        replay=args.replay,
+        workers=args.workers,
+        seed=args.seed,
+    )
+    if config.target in ("inprocess", "uvicorn"):
+        config.database_url = (
+            config.database_url or os.getenv("DATABASE_URL") or DEFAULT_DATABASE_URL
+        )
+        os.environ["DATABASE_URL"] = config.database_url
+        os.environ.setdefault("DB_CREATE_SCHEMA", "true")
+
+    result = asyncio.run(run(config))
+    baseline = None
+    if args.compare:
+        with open(args.compare) as source:
+            baseline = json.load(source)
+    print(format_report(result, baseline))
+    if args.output:
+        with open(args.output, "w") as target:
+            json.dump(result, target, indent=2)
+
+
+if __name__ == "__main__":
+    main()
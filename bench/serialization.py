@@ -0,0 +1,128 @@
+"""
+CPU cost per response of the response_model path against FAST_JSON_RESPONSES.
+
+    python -m bench.serialization --requests 20000
+
+Serves the GET /{shortcode}/stats and POST /shorten response bodies from
+memory, so no database time is included, and calls the ASGI app directly.
+Prints the CPU time per request of each path.
+"""
+
+import argparse
+import asyncio
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from fastapi import FastAPI, status
+
+from app.schemas import URLShortenResponse, URLStatsResponse
+from app.serialization import FastJSONResponse, orjson
+
+CREATED = datetime(2024, 1, 2, 3, 4, 5, 678901, tzinfo=timezone.utc)
+UPDATE_ID = str(uuid.uuid4())
+
+
+def build_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/model/stats", response_model=URLStatsResponse)
+    async def model_stats():
+        return URLStatsResponse(
+            created=CREATED, lastRedirect=CREATED, redirectCount=12345
+        )
+
+    @app.get("/fast/stats", response_model=URLStatsResponse)
+    async def fast_stats():
+        return FastJSONResponse(
+            {"created": CREATED, "lastRedirect": CREATED, "redirectCount": 12345}
+        )
+
+    @app.post(
+        "/model/shorten",
+        response_model=URLShortenResponse,
+        status_code=status.HTTP_201_CREATED,
+    )
+    async def model_shorten():
+        return URLShortenResponse(shortcode="abc123", update_id=UPDATE_ID)
+
+    @app.post(
+        "/fast/shorten",
+        response_model=URLShortenResponse,
+        status_code=status.HTTP_201_CREATED,
+    )
+    async def fast_shorten():
+        return FastJSONResponse(
+            {"shortcode": "abc123", "update_id": UPDATE_ID},
+            status_code=status.HTTP_201_CREATED,
+        )
+
+    return app
+
+
+async def call(app: FastAPI, method: str, path: str) -> bytes:
+    """One request through the ASGI interface, returning the body"""
+    body = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            body.append(message.get("body", b""))
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [],
+        "client": ("127.0.0.1", 1234),
+        "server": ("test", 80),
+    }
+    await app(scope, receive, send)
+    return b"".join(body)
+
+
+async def measure(app: FastAPI, method: str, path: str, requests: int) -> float:
+    """CPU microseconds per request"""
+    for _ in range(min(requests, 1000)):
+        await call(app, method, path)
+    started = time.process_time()
+    for _ in range(requests):
+        await call(app, method, path)
+    return (time.process_time() - started) / requests * 1e6
+
+
+async def run(requests: int) -> List[str]:
+    app = build_app()
+    lines = [f"encoder: {'orjson' if orjson is not None else 'json'}"]
+    for method, route in (("GET", "stats"), ("POST", "shorten")):
+        model = await call(app, method, f"/model/{route}")
+        fast = await call(app, method, f"/fast/{route}")
+        assert model == fast, (model, fast)
+
+        before = await measure(app, method, f"/model/{route}", requests)
+        after = await measure(app, method, f"/fast/{route}", requests)
+        lines.append(
+            f"{route:<8} response_model {before:6.1f} us   fast {after:6.1f} us"
+            f"   saved {before - after:5.1f} us ({(before - after) / before:.0%})"
+        )
+    return lines
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args(argv)
+    print("\n".join(asyncio.run(run(args.requests))))
+
+
+if __name__ == "__main__":
+    main()
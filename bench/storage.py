@@ -0,0 +1,170 @@
+"""
+Compare the url_mappings storage layout before and after the b0d213d3e538
+migration on PostgreSQL.
+
+    python -m bench.storage --database-url postgresql://... --rows 1000000
+
+Creates both layouts in scratch schemas, fills them with the same generated
+rows, applies rounds of redirect counter updates and prints the heap and
+index sizes and how many updates were heap-only (HOT). The schemas are
+dropped afterwards.
+"""
+
+import argparse
+import asyncio
+import os
+from typing import Dict, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+LAYOUTS = {
+    "before": [
+        """
+        CREATE TABLE url_mappings (
+            shortcode VARCHAR(255) PRIMARY KEY,
+            original_url VARCHAR(2048) NOT NULL,
+            update_id VARCHAR(36) NOT NULL UNIQUE,
+            created_at TIMESTAMPTZ DEFAULT now(),
+            last_redirect TIMESTAMPTZ,
+            redirect_count INTEGER
+        )
+        """,
+        "CREATE INDEX ix_url_mappings_shortcode ON url_mappings (shortcode)",
+    ],
+    "after": [
+        """
+        CREATE TABLE url_mappings (
+            shortcode VARCHAR(255) PRIMARY KEY,
+            original_url VARCHAR(2048) NOT NULL,
+            update_id UUID NOT NULL UNIQUE,
+            created_at TIMESTAMPTZ DEFAULT now(),
+            last_redirect TIMESTAMPTZ,
+            redirect_count INTEGER
+        ) WITH (fillfactor = 90)
+        """,
+    ],
+}
+
+# Multiplying by an odd constant mod 2**32 scatters the keys without collisions
+FILL = """
+INSERT INTO url_mappings (shortcode, original_url, update_id, redirect_count)
+SELECT lpad(to_hex(i::bigint * 2654435761 % 4294967296), 8, '0'),
+       'https://example.com/articles/' || i,
+       CAST(md5('update' || i)::uuid AS {update_id_type}),
+       0
+FROM generate_series(1, :rows) AS i
+"""
+
+# Same statement as the counter flush, over a random sample of shortcodes
+UPDATE = """
+UPDATE url_mappings
+SET redirect_count = redirect_count + 1, last_redirect = now()
+WHERE shortcode IN (
+    SELECT lpad(to_hex(i::bigint * 2654435761 % 4294967296), 8, '0')
+    FROM generate_series(1, :rows) AS i
+    WHERE random() < :fraction
+)
+"""
+
+SIZES = """
+SELECT c.relname, pg_relation_size(c.oid)
+FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE n.nspname = :schema AND c.relkind IN ('r', 'i')
+ORDER BY c.relkind DESC, c.relname
+"""
+
+HOT_UPDATES = """
+SELECT n_tup_upd, n_tup_hot_upd FROM pg_stat_user_tables
+WHERE schemaname = :schema AND relname = 'url_mappings'
+"""
+
+
+async def measure(
+    conn, layout: str, rows: int, rounds: int, fraction: float
+) -> Dict[str, object]:
+    schema = f"storage_{layout}"
+    await conn.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+    await conn.execute(text(f"CREATE SCHEMA {schema}"))
+    await conn.execute(text(f"SET search_path TO {schema}"))
+    try:
+        for statement in LAYOUTS[layout]:
+            await conn.execute(text(statement))
+        update_id_type = "uuid" if layout == "after" else "text"
+        await conn.execute(
+            text(FILL.format(update_id_type=update_id_type)), {"rows": rows}
+        )
+        await conn.execute(text("ANALYZE url_mappings"))
+        for _ in range(rounds):
+            await conn.execute(text(UPDATE), {"rows": rows, "fraction": fraction})
+        await conn.execute(text("SELECT pg_stat_force_next_flush()"))
+
+        sizes = dict((await conn.execute(text(SIZES), {"schema": schema})).all())
+        updates, hot_updates = (
+            await conn.execute(text(HOT_UPDATES), {"schema": schema})
+        ).one()
+        return {"sizes": sizes, "updates": updates, "hot_updates": hot_updates}
+    finally:
+        await conn.execute(text("RESET search_path"))
+        await conn.execute(text(f"DROP SCHEMA {schema} CASCADE"))
+
+
+async def run(database_url: str, rows: int, rounds: int, fraction: float) -> dict:
+    engine = create_async_engine(
+        database_url.replace("postgresql://", "postgresql+asyncpg://"),
+        isolation_level="AUTOCOMMIT",
+    )
+    try:
+        async with engine.connect() as conn:
+            return {
+                layout: await measure(conn, layout, rows, rounds, fraction)
+                for layout in LAYOUTS
+            }
+    finally:
+        await engine.dispose()
+
+
+def _megabytes(size: int) -> str:
+    return f"{size / 2**20:8.1f} MB"
+
+
+def format_report(result: dict) -> str:
+    lines: List[str] = []
+    for layout, measured in result.items():
+        sizes = measured["sizes"]
+        lines.append(f"{layout}:")
+        for name, size in sizes.items():
+            lines.append(f"  {name:<32} {_megabytes(size)}")
+        lines.append(f"  {'total':<32} {_megabytes(sum(sizes.values()))}")
+        updates = measured["updates"]
+        hot = measured["hot_updates"]
+        share = hot / updates if updates else 0
+        lines.append(f"  HOT updates: {hot} of {updates} ({share:.0%})")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--database-url",
+        default=os.getenv("DATABASE_URL"),
+        help="PostgreSQL database to create the scratch schemas in",
+    )
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--rounds", type=int, default=5, help="Counter update rounds")
+    parser.add_argument(
+        "--fraction",
+        type=float,
+        default=0.05,
+        help="Share of rows updated per round",
+    )
+    args = parser.parse_args(argv)
+    if not args.database_url or not args.database_url.startswith("postgresql"):
+        parser.error("--database-url must be a PostgreSQL URL")
+
+    result = asyncio.run(run(args.database_url, args.rows, args.rounds, args.fraction))
+    print(format_report(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi.responses import PlainTextResponse
+
+from app import admin
+from app.admission import (
+    AdmissionController,
+    AdmissionMiddleware,
+    TokenBuckets,
+    parse_limits,
+    route_class,
+)
+from app.main import app
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class BlockingApp:
+    """ASGI app whose requests wait until released"""
+
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.started = 0
+
+    async def __call__(self, scope, receive, send):
+        self.started += 1
+        await self.release.wait()
+        await PlainTextResponse("done")(scope, receive, send)
+
+
+def client_for(asgi_app):
+    transport = httpx.ASGITransport(app=asgi_app)
+    return httpx.AsyncClient(transport=transport, base_url="http://test")
+
+
+def controller(**kwargs):
+    options = {
+        "client_rate": 0,
+        "concurrency": {},
+        "max_pool_waiters": 0,
+        "pool_waiters": lambda: 0,
+    }
+    options.update(kwargs)
+    return AdmissionController(**options)
+
+
+class TestTokenBuckets:
+    def test_refills_at_rate(self):
+        """Should allow a burst, then one request per 1/rate seconds."""
+        clock = FakeClock()
+        buckets = TokenBuckets(rate=2, burst=3, clock=clock)
+        assert [buckets.take("a") for _ in range(3)] == [0, 0, 0]
+        assert buckets.take("a") == pytest.approx(0.5)
+        # Other clients have their own bucket
+        assert buckets.take("b") == 0
+
+        clock.now += 0.25
+        assert buckets.take("a") == pytest.approx(0.25)
+        clock.now += 0.25
+        assert buckets.take("a") == 0
+
+        clock.now += 100
+        assert [buckets.take("a") for _ in range(4)][-1] > 0
+
+    def test_forgets_least_recent_clients(self):
+        """Should keep buckets for at most max_keys clients."""
+        buckets = TokenBuckets(rate=1, burst=1, max_keys=2, clock=FakeClock())
+        for key in ["a", "b", "a", "c"]:
+            buckets.take(key)
+        assert len(buckets) == 2
+        # "a" was seen more recently than "b", so only "b" starts over
+        assert buckets.take("a") > 0
+        assert buckets.take("b") == 0
+
+
+class TestRouteClass:
+    def test_classes(self):
+        assert route_class("GET", "/abc123") == "redirect"
+        assert route_class("GET", "/abc123/stats") == "read"
+        assert route_class("GET", "/abc123/stats/timeseries") == "read"
+        assert route_class("POST", "/stats/batch") == "read"
+        assert route_class("POST", "/shorten") == "write"
+        assert route_class("POST", "/update/some-id") == "write"
+        for path in ["/", "/ready", "/metrics", "/docs", "/admin/pool"]:
+            assert route_class("GET", path) is None
+
+    def test_parse_limits(self):
+        assert parse_limits("redirect=10, write=2") == {"redirect": 10, "write": 2}
+        with pytest.raises(ValueError):
+            parse_limits("everything=1")
+
+
+class TestAdmissionMiddleware:
+    @pytest.mark.asyncio
+    async def test_rate_limits_each_client(self):
+        """Should answer 429 with Retry-After once a client's bucket is empty."""
+        admission = controller(client_rate=1, client_burst=2)
+        limited = AdmissionMiddleware(
+            PlainTextResponse("ok"), admission, client_header="X-Forwarded-For"
+        )
+        headers = {"X-Forwarded-For": "203.0.113.1, 10.0.0.1"}
+        async with client_for(limited) as client:
+            for _ in range(2):
+                assert (await client.get("/abc", headers=headers)).status_code == 200
+            response = await client.get("/abc", headers=headers)
+            assert response.status_code == 429
+            assert response.headers["retry-after"] == "1"
+            assert response.json() == {"detail": "Too many requests"}
+
+            other = {"X-Forwarded-For": "203.0.113.2"}
+            assert (await client.get("/abc", headers=other)).status_code == 200
+            # Service endpoints are never limited
+            assert (await client.get("/ready", headers=headers)).status_code == 200
+
+        assert admission.rejected["rate_limited"] == 1
+        assert admission.admitted == 3
+
+    @pytest.mark.asyncio
+    async def test_limits_concurrency_per_route_class(self):
+        """Should shed requests beyond a class's limit without waiting."""
+        blocking = BlockingApp()
+        admission = controller(concurrency={"write": 1})
+        async with client_for(AdmissionMiddleware(blocking, admission)) as client:
+            first = asyncio.create_task(client.post("/shorten"))
+            while blocking.started < 1:
+                await asyncio.sleep(0)
+
+            response = await client.post("/update/abc")
+            assert response.status_code == 503
+            assert response.headers["retry-after"] == "1"
+            assert admission.in_flight["write"] == 1
+
+            # Other route classes are not affected
+            reads = asyncio.create_task(client.get("/abc/stats"))
+            while blocking.started < 2:
+                await asyncio.sleep(0)
+
+            blocking.release.set()
+            assert (await first).status_code == 200
+            assert (await reads).status_code == 200
+
+        assert admission.in_flight == {"redirect": 0, "read": 0, "write": 0}
+        assert admission.rejected["concurrency"] == 1
+
+    @pytest.mark.asyncio
+    async def test_sheds_while_connections_are_awaited(self):
+        """Should answer 503 while too many queries wait for a connection."""
+        waiters = [0]
+        admission = controller(
+            max_pool_waiters=4, pool_waiters=lambda: waiters[0], retry_after=2
+        )
+        limited = AdmissionMiddleware(PlainTextResponse("ok"), admission)
+        async with client_for(limited) as client:
+            assert (await client.get("/abc")).status_code == 200
+            waiters[0] = 4
+            response = await client.get("/abc")
+            assert response.status_code == 503
+            assert response.headers["retry-after"] == "2"
+            waiters[0] = 3
+            assert (await client.get("/abc")).status_code == 200
+
+        assert admission.rejected["pool"] == 1
+
+
+class TestAdmissionAdmin:
+    @pytest.mark.asyncio
+    async def test_stats(self, monkeypatch):
+        monkeypatch.setattr(admin, "ADMIN_TOKEN", "secret")
+        async with client_for(app) as client:
+            response = await client.get(
+                "/admin/admission", headers={"X-Admin-Token": "secret"}
+            )
+        assert response.status_code == 200
+        stats = response.json()
+        assert set(stats["in_flight"]) == {"redirect", "read", "write"}
+        assert stats["rejected"] == {"rate_limited": 0, "concurrency": 0, "pool": 0}
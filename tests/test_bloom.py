@@ -0,0 +1,236 @@
+import uuid
+
+import httpx
+import pytest
+import pytest_asyncio
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+import app.main as main
+from app import admin, crud
+from app.bloom import BloomFilter, SharedBloomFilter, ShortcodeFilter, filter_size
+from app.cache import url_cache
+from app.counters import redirect_counter
+from app.database import get_async_db, Base
+from app.main import app
+from app.sharding import sharded_sessionmaker
+from app.shortcodes import shortcode_allocator
+
+engines = {
+    "0": create_async_engine(
+        "sqlite+aiosqlite:///./test.db", connect_args={"check_same_thread": False}
+    ),
+    "1": create_async_engine(
+        "sqlite+aiosqlite:///./test_crud.db", connect_args={"check_same_thread": False}
+    ),
+}
+TestingAsyncSessionLocal = sessionmaker(
+    bind=engines["0"], class_=AsyncSession, autocommit=False, autoflush=False
+)
+
+
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as session:
+        yield session
+
+
+@pytest_asyncio.fixture
+async def clean_db():
+    for engine in engines.values():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+            await conn.run_sync(Base.metadata.create_all)
+    url_cache.clear()
+    redirect_counter.clear()
+    shortcode_allocator.reset()
+    yield
+    redirect_counter.clear()
+    shortcode_allocator.reset()
+
+
+def built(keys, capacity=1000):
+    bloom = BloomFilter(capacity, 0.01)
+    assert bloom.begin_rebuild()
+    bloom.fill(keys)
+    bloom.finish_rebuild()
+    return bloom
+
+
+class TestBloomFilter:
+    def test_size(self):
+        """Should use about 9.6 bits and 7 hashes per key at 1%."""
+        bits, hashes = filter_size(1000, 0.01)
+        assert 9500 < bits < 9700
+        assert hashes == 7
+
+    def test_unknown_until_built(self):
+        """Should report every key as possibly present before the first build."""
+        bloom = BloomFilter(1000, 0.01)
+        assert not bloom.ready
+        assert bloom.might_contain("anything")
+
+    def test_no_false_negatives_and_few_false_positives(self):
+        """Should find every added key and reject nearly all others."""
+        keys = [f"code{i}" for i in range(1000)]
+        bloom = built(keys)
+        assert all(bloom.might_contain(key) for key in keys)
+        false_positives = sum(bloom.might_contain(f"other{i}") for i in range(10000))
+        assert false_positives < 300
+
+        stats = bloom.stats()
+        assert stats["ready"] and stats["items"] == 1000
+        assert 0.4 < stats["fill_ratio"] < 0.6
+        assert 0.005 < stats["false_positive_rate"] < 0.02
+
+    def test_rebuild_keeps_keys_added_meanwhile(self):
+        """Should keep keys added during a rebuild and drop ones not rebuilt."""
+        bloom = built([f"old{i}" for i in range(100)])
+        assert bloom.begin_rebuild()
+        assert not bloom.begin_rebuild()
+        bloom.add("created-during-rebuild")
+        # Lookups use the old array until the rebuild finishes
+        assert bloom.might_contain("old1")
+        bloom.fill([f"new{i}" for i in range(100)])
+        bloom.finish_rebuild()
+
+        assert bloom.might_contain("created-during-rebuild")
+        assert all(bloom.might_contain(f"new{i}") for i in range(100))
+        assert sum(bloom.might_contain(f"old{i}") for i in range(100)) < 10
+        assert bloom.stats()["generation"] == 2
+
+    def test_min_age(self):
+        """Should skip a rebuild when the filter is recent enough."""
+        now = [1000.0]
+        bloom = BloomFilter(100, 0.01, clock=lambda: now[0])
+        assert bloom.begin_rebuild(min_age=60)
+        bloom.finish_rebuild()
+        assert not bloom.begin_rebuild(min_age=60)
+        now[0] += 61
+        assert bloom.begin_rebuild(min_age=60)
+
+
+class TestSharedBloomFilter:
+    def test_shared_between_instances(self):
+        """Should see keys added and builds finished through another instance."""
+        name = f"test_filter_{uuid.uuid4().hex[:8]}"
+        first = SharedBloomFilter(1000, 0.01, name=name)
+        second = SharedBloomFilter(1000, 0.01, name=name)
+        try:
+            assert first.begin_rebuild()
+            assert not second.begin_rebuild()
+            first.fill(["abc"])
+            second.add("def")
+            first.finish_rebuild()
+            assert second.ready
+            assert second.might_contain("abc") and second.might_contain("def")
+            assert not second.might_contain("missing")
+            assert second.stats()["backend"] == "shared"
+        finally:
+            second.close()
+            first.close()
+            first.unlink()
+
+
+class TestShortcodeFilter:
+    @pytest.mark.asyncio
+    async def test_rebuild_scans_every_shard(self, clean_db):
+        """Should load the shortcodes of every shard."""
+        ShardedSessionLocal = sharded_sessionmaker(engines)
+        async with ShardedSessionLocal() as db:
+            await crud.create_url_mappings(
+                db, [(f"https://example.com/{i}", f"code{i}") for i in range(50)]
+            )
+        shortcode_filter = ShortcodeFilter(
+            BloomFilter(1000, 0.01), ShardedSessionLocal, batch_size=7
+        )
+        assert await shortcode_filter.rebuild()
+        assert all(shortcode_filter.might_contain(f"code{i}") for i in range(50))
+        assert not shortcode_filter.might_contain("unknown")
+        stats = shortcode_filter.stats()
+        assert stats["items"] == 50
+        assert stats["checks"] == 51 and stats["negatives"] == 1
+
+    def test_disabled(self):
+        """Should treat every shortcode as possibly existing without a filter."""
+        shortcode_filter = ShortcodeFilter(None)
+        shortcode_filter.add("abc")
+        assert shortcode_filter.might_contain("anything")
+        assert shortcode_filter.stats() == {"enabled": False}
+
+
+class TestRedirectWithFilter:
+    @pytest_asyncio.fixture
+    async def client(self, clean_db, monkeypatch):
+        shortcode_filter = ShortcodeFilter(
+            BloomFilter(1000, 0.01), TestingAsyncSessionLocal
+        )
+        await shortcode_filter.rebuild()
+        monkeypatch.setattr(main, "shortcode_filter", shortcode_filter)
+        monkeypatch.setattr(admin, "shortcode_filter", shortcode_filter)
+        monkeypatch.setattr(admin, "ADMIN_TOKEN", "secret")
+        app.dependency_overrides[get_async_db] = override_get_async_db
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+            yield ac
+
+    @pytest.mark.asyncio
+    async def test_unknown_shortcode_skips_database(self, client, monkeypatch):
+        """Should answer 404 for unknown shortcodes without a query."""
+
+        async def no_query(*args, **kwargs):
+            raise AssertionError("queried the database")
+
+        monkeypatch.setattr(crud, "redirect_url_mapping", no_query)
+        monkeypatch.setattr(crud, "get_url_mapping", no_query)
+        monkeypatch.setattr(crud, "get_original_url", no_query)
+        monkeypatch.setattr(crud, "get_url_stats", no_query)
+        assert (await client.get("/unknown")).status_code == 404
+        assert (await client.get("/unknown/stats")).status_code == 404
+
+    @pytest.mark.asyncio
+    async def test_created_shortcodes_are_found(self, client):
+        """Should learn shortcodes as they are created."""
+        response = await client.post(
+            "/shorten", json={"url": "https://example.com/", "shortcode": "custom"}
+        )
+        assert response.status_code == 201
+        auto = (
+            await client.post("/shorten", json={"url": "https://example.com/a"})
+        ).json()["shortcode"]
+        batch = await client.post(
+            "/shorten/batch",
+            json=[
+                {"url": "https://example.com/b"},
+                {"url": "https://example.com/c", "shortcode": "mine12"},
+            ],
+        )
+        batch_codes = [result["shortcode"] for result in batch.json()["results"]]
+
+        for shortcode in ["custom", auto, *batch_codes]:
+            assert (await client.get(f"/{shortcode}")).status_code == 302
+
+        response = await client.post(
+            "/shorten", json={"url": "https://example.com/", "shortcode": "custom"}
+        )
+        assert response.status_code == 409
+
+        response = await client.get(
+            "/admin/filter", headers={"X-Admin-Token": "secret"}
+        )
+        assert response.status_code == 200
+        assert response.json()["enabled"] is True
+        assert response.json()["items"] == 4
+
+    @pytest.mark.asyncio
+    async def test_failed_batch_adds_nothing(self, client, monkeypatch):
+        """Should not learn anything from a batch chunk the database rejected."""
+
+        async def rejected(db, items):
+            return [crud.INSERT_FAILED] * len(items)
+
+        monkeypatch.setattr(crud, "create_url_mappings", rejected)
+        response = await client.post(
+            "/shorten/batch", json=[{"url": "https://example.com/"}]
+        )
+        assert response.json()["results"][0]["status"] == 412
+        assert main.shortcode_filter.stats()["items"] == 0
@@ -0,0 +1,177 @@
+import struct
+import subprocess
+import sys
+import uuid
+
+import pytest
+
+from app.cache import SharedURLCache, URLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestURLCache:
+
+    def test_get_and_set(self):
+        cache = URLCache(max_size=10, ttl=60)
+        assert cache.get("abc123") is None
+
+        cache.set("abc123", "https://www.example.com/")
+        assert cache.get("abc123") == "https://www.example.com/"
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+
+    def test_lru_eviction(self):
+        cache = URLCache(max_size=2, ttl=60)
+        cache.set("a", "https://a.example.com/")
+        cache.set("b", "https://b.example.com/")
+
+        # Touch "a" so "b" becomes the least recently used entry
+        cache.get("a")
+        cache.set("c", "https://c.example.com/")
+
+        assert cache.get("b") is None
+        assert cache.get("a") == "https://a.example.com/"
+        assert cache.get("c") == "https://c.example.com/"
+        assert cache.evictions == 1
+
+    def test_ttl_expiry(self):
+        clock = FakeClock()
+        cache = URLCache(max_size=10, ttl=5, clock=clock)
+        cache.set("abc123", "https://www.example.com/")
+
+        clock.now = 4.9
+        assert cache.get("abc123") == "https://www.example.com/"
+
+        clock.now = 5.0
+        assert cache.get("abc123") is None
+        assert cache.stats()["size"] == 0
+
+    def test_invalidate(self):
+        cache = URLCache(max_size=10, ttl=60)
+        cache.set("abc123", "https://www.example.com/")
+        cache.invalidate("abc123")
+        cache.invalidate("missing")
+
+        assert cache.get("abc123") is None
+
+    def test_set_skipped_after_invalidation(self):
+        cache = URLCache(max_size=10, ttl=60)
+        generation = cache.generation("abc123")
+        cache.invalidate("abc123")
+        cache.set("abc123", "https://www.example.com/", generation)
+        assert cache.get("abc123") is None
+
+        cache.set("abc123", "https://www.example.org/", cache.generation("abc123"))
+        assert cache.get("abc123") == "https://www.example.org/"
+
+    def test_disabled_when_max_size_is_zero(self):
+        cache = URLCache(max_size=0, ttl=60)
+        cache.set("abc123", "https://www.example.com/")
+
+        assert cache.get("abc123") is None
+        assert cache.stats()["size"] == 0
+
+
+@pytest.fixture
+def shared_cache():
+    cache = SharedURLCache(max_size=16, ttl=60, name=f"test_cache_{uuid.uuid4().hex}")
+    yield cache
+    cache.close()
+    cache.unlink()
+
+
+class TestSharedURLCache:
+
+    def test_get_set_and_invalidate(self, shared_cache):
+        assert shared_cache.get("abc123") is None
+
+        shared_cache.set("abc123", "https://www.example.com/")
+        assert shared_cache.get("abc123") == "https://www.example.com/"
+        shared_cache.set("abc123", "https://www.example.org/")
+        assert shared_cache.get("abc123") == "https://www.example.org/"
+        assert shared_cache.stats()["size"] == 1
+
+        shared_cache.invalidate("abc123")
+        assert shared_cache.get("abc123") is None
+        assert shared_cache.stats()["size"] == 0
+
+    def test_set_skipped_after_invalidation(self, shared_cache):
+        generation = shared_cache.generation("abc123")
+        shared_cache.invalidate("abc123")
+        shared_cache.set("abc123", "https://www.example.com/", generation)
+        assert shared_cache.get("abc123") is None
+
+        generation = shared_cache.generation("abc123")
+        shared_cache.set("abc123", "https://www.example.org/", generation)
+        assert shared_cache.get("abc123") == "https://www.example.org/"
+
+    def test_ttl_expiry(self, shared_cache):
+        clock = FakeClock()
+        shared_cache._clock = clock
+        shared_cache.set("abc123", "https://www.example.com/")
+
+        clock.now = 59.9
+        assert shared_cache.get("abc123") == "https://www.example.com/"
+        clock.now = 60.0
+        assert shared_cache.get("abc123") is None
+
+    def test_eviction_when_full(self, shared_cache):
+        for number in range(200):
+            shared_cache.set(f"code{number}", f"https://{number}.example.com/")
+
+        assert shared_cache.evictions > 0
+        assert shared_cache.stats()["size"] <= shared_cache.slot_count
+        assert shared_cache.get("code199") == "https://199.example.com/"
+
+    def test_recovers_slot_left_half_written(self, shared_cache):
+        """Should overwrite a slot whose writer died, instead of failing on it."""
+        shared_cache.set("abc123", "https://www.example.com/")
+        _, home = shared_cache._home(b"abc123")
+        offset = shared_cache._offset(home)
+        # An odd version marks a write in progress that never finished
+        struct.pack_into("<I", shared_cache._buf, offset, 7)
+        assert shared_cache.get("abc123") is None
+
+        shared_cache.set("abc123", "https://www.example.org/")
+        assert shared_cache.get("abc123") == "https://www.example.org/"
+        struct.pack_into("<I", shared_cache._buf, offset, 9)
+        shared_cache.invalidate("abc123")
+        assert shared_cache.get("abc123") is None
+
+        shared_cache.set("abc123", "https://www.example.org/")
+        struct.pack_into("<I", shared_cache._buf, offset, 11)
+        shared_cache.clear()
+        assert shared_cache.stats()["size"] == 0
+
+    def test_skips_oversized_urls(self, shared_cache):
+        shared_cache.set("abc123", "https://example.com/" + "a" * 1000)
+        assert shared_cache.get("abc123") is None
+
+    def test_shared_between_processes(self, shared_cache):
+        shared_cache.set("abc123", "https://www.example.com/")
+        script = (
+            "import sys\n"
+            "from app.cache import SharedURLCache\n"
+            "cache = SharedURLCache(max_size=16, ttl=60, name=sys.argv[1])\n"
+            "print(cache.get('abc123'))\n"
+            "cache.set('other1', 'https://other.example.com/')\n"
+            "cache.invalidate('abc123')\n"
+            "cache.close()\n"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", script, shared_cache.name],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+
+        assert result.stdout.strip() == "https://www.example.com/"
+        assert shared_cache.get("abc123") is None
+        assert shared_cache.get("other1") == "https://other.example.com/"
@@ -0,0 +1,237 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import pytest_asyncio
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.counters import RedirectCounter
+from app import crud
+
+# Use a local SQLite database for testing (async)
+SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./test_crud.db"
+async_engine = create_async_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+TestingAsyncSessionLocal = sessionmaker(
+    bind=async_engine, class_=AsyncSession, autocommit=False, autoflush=False
+)
+
+
+@pytest_asyncio.fixture
+async def db_session():
+    """Yields a fresh database session for each test."""
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+
+    async with TestingAsyncSessionLocal() as session:
+        try:
+            yield session
+        finally:
+            await session.close()
+
+
+@pytest.fixture
+def counter():
+    return RedirectCounter(
+        session_factory=TestingAsyncSessionLocal, flush_interval=60, max_pending=100
+    )
+
+
+class TestRedirectCounter:
+    @pytest.mark.asyncio
+    async def test_record_aggregates_per_shortcode(self, counter):
+        """Should keep one pending entry per shortcode with the latest timestamp."""
+        first = datetime(2025, 8, 6, 10, 0, tzinfo=timezone.utc)
+        counter.record("abc123", first)
+        counter.record("abc123", first + timedelta(minutes=5))
+        counter.record("other", first)
+
+        pending = counter.pending("abc123")
+        assert pending.count == 2
+        assert pending.last_redirect == first + timedelta(minutes=5)
+        assert counter.pending("missing") is None
+
+    @pytest.mark.asyncio
+    async def test_flush_writes_batched_counts(self, db_session, counter):
+        """Should add pending counts to the stored counts in one flush."""
+        await crud.create_url_mapping(db_session, "https://www.example.com/", "one")
+        await crud.create_url_mapping(db_session, "https://www.example.com/", "two")
+
+        for _ in range(3):
+            counter.record("one")
+        counter.record("two")
+        assert await counter.flush() == 2
+        assert counter.pending("one") is None
+
+        counter.record("one")
+        await counter.flush()
+
+        db_session.expire_all()
+        one = await crud.get_url_mapping(db_session, "one")
+        two = await crud.get_url_mapping(db_session, "two")
+        assert one.redirect_count == 4
+        assert two.redirect_count == 1
+        assert one.last_redirect is not None
+
+    @pytest.mark.asyncio
+    async def test_merge_pending(self, counter):
+        """Should report stored and pending redirects together."""
+        stored = datetime(2025, 8, 6, 10, 0)
+        counter.record("abc123")
+
+        count, last_redirect = counter.merge_pending("abc123", 5, stored)
+        assert count == 6
+        assert last_redirect > stored.replace(tzinfo=timezone.utc)
+
+        assert counter.merge_pending("other", None, None) == (0, None)
+
+    @pytest.mark.asyncio
+    async def test_flushed_redirects_are_not_counted_twice(self, db_session, counter):
+        """Should stop reporting flushed redirects as pending once committed."""
+        await crud.create_url_mapping(db_session, "https://www.example.com/", "one")
+        seen = []
+
+        class ClosingSlowly:
+            """Session whose close runs after the commit, like a real one"""
+
+            async def __aenter__(self):
+                self.session = TestingAsyncSessionLocal()
+                return self.session
+
+            async def __aexit__(self, *exc_info):
+                async with TestingAsyncSessionLocal() as reader:
+                    stats = await crud.get_url_stats(reader, "one")
+                seen.append(counter.merge_pending("one", stats.redirect_count, None))
+                await self.session.close()
+
+        counter.session_factory = ClosingSlowly
+        counter.record("one")
+        await counter.flush()
+        assert seen[0][0] == 1
+
+    @pytest.mark.asyncio
+    async def test_failed_flush_keeps_pending(self, counter):
+        """Should retry redirects from a failed flush on the next one."""
+
+        def broken_session():
+            raise RuntimeError("database unavailable")
+
+        counter.session_factory = broken_session
+        counter.record("abc123")
+        with pytest.raises(RuntimeError):
+            await counter.flush()
+
+        counter.record("abc123")
+        assert counter.pending("abc123").count == 2
+
+    @pytest.mark.asyncio
+    async def test_failed_flush_keeps_at_most_retry_max_pending(self, counter):
+        """Should drop redirects of shortcodes beyond the retry limit."""
+
+        def broken_session():
+            raise RuntimeError("database unavailable")
+
+        counter.session_factory = broken_session
+        counter.retry_max_pending = 2
+        for shortcode in ("one", "two", "three"):
+            counter.record(shortcode)
+        with pytest.raises(RuntimeError):
+            await counter.flush()
+
+        assert counter.pending("one").count == 1
+        assert counter.pending("two").count == 1
+        assert counter.pending("three") is None
+        assert counter.dropped == 1
+
+    @pytest.mark.asyncio
+    async def test_failed_flush_holds_off_early_flushes(self):
+        """Should wait a doubling pause before max_pending flushes again."""
+        now = [0.0]
+        flushes = []
+
+        def broken_session():
+            flushes.append(now[0])
+            raise RuntimeError("database unavailable")
+
+        counter = RedirectCounter(
+            session_factory=broken_session,
+            flush_interval=1,
+            max_pending=1,
+            retry_max_seconds=3,
+            clock=lambda: now[0],
+        )
+        for at in (0.0, 0.5, 1.0, 2.5, 3.0, 7.0):
+            now[0] = at
+            counter.record("one")
+            await asyncio.sleep(0)
+            await asyncio.sleep(0)
+        # Pauses of 1, 2 and then at most 3 seconds
+        assert flushes == [0.0, 1.0, 3.0, 7.0]
+
+    @pytest.mark.asyncio
+    async def test_flush_when_max_pending_reached(self, db_session, counter):
+        """Should flush in the background once enough shortcodes are pending."""
+        counter.max_pending = 2
+        await crud.create_url_mapping(db_session, "https://www.example.com/", "one")
+        await crud.create_url_mapping(db_session, "https://www.example.com/", "two")
+
+        counter.record("one")
+        counter.record("two")
+        await asyncio.sleep(0.1)
+
+        assert counter.pending("one") is None
+        db_session.expire_all()
+        assert (await crud.get_url_mapping(db_session, "one")).redirect_count == 1
+
+    @pytest.mark.asyncio
+    async def test_stop_flushes_pending(self, db_session, counter):
+        """Should write out pending redirects on shutdown."""
+        await crud.create_url_mapping(db_session, "https://www.example.com/", "one")
+        await counter.start()
+        counter.record("one")
+        await counter.stop()
+
+        db_session.expire_all()
+        assert (await crud.get_url_mapping(db_session, "one")).redirect_count == 1
+
+    @pytest.mark.asyncio
+    async def test_flush_writes_time_series(self, db_session, counter):
+        """Should add redirects to hourly, daily and monthly buckets."""
+        await crud.create_url_mapping(db_session, "https://www.example.com/", "one")
+        first = datetime(2025, 8, 31, 23, 30, tzinfo=timezone.utc)
+        counter.record("one", first)
+        counter.record("one", first + timedelta(minutes=10))
+        counter.record("one", first + timedelta(hours=1), counted=True)
+        await counter.flush()
+        counter.record("one", first)
+        await counter.flush()
+
+        start = datetime(2025, 8, 1, tzinfo=timezone.utc)
+        end = datetime(2025, 10, 1, tzinfo=timezone.utc)
+        hours = await crud.get_redirect_timeseries(
+            db_session, "one", "hour", start, end
+        )
+        assert hours == {
+            datetime(2025, 8, 31, 23, tzinfo=timezone.utc): 3,
+            datetime(2025, 9, 1, 0, tzinfo=timezone.utc): 1,
+        }
+        days = await crud.get_redirect_timeseries(db_session, "one", "day", start, end)
+        assert days == {
+            datetime(2025, 8, 31, tzinfo=timezone.utc): 3,
+            datetime(2025, 9, 1, tzinfo=timezone.utc): 1,
+        }
+        months = await crud.get_redirect_timeseries(
+            db_session, "one", "month", start, end
+        )
+        assert months == {
+            datetime(2025, 8, 1, tzinfo=timezone.utc): 3,
+            datetime(2025, 9, 1, tzinfo=timezone.utc): 1,
+        }
+
+        # The counted redirect was already in the database's redirect count
+        db_session.expire_all()
+        assert (await crud.get_url_mapping(db_session, "one")).redirect_count == 3
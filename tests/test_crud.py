@@ -1,3 +1,4 @@
+import asyncio
 import time
 import tempfile
 import pytest
@@ -7,6 +8,7 @@ from sqlalchemy.orm import sessionmaker
 
 from app.database import Base
 from app.models import URLMapping
+from app.cache import url_cache
 from app import crud
 
 # Use a local SQLite database for testing (async)
@@ -25,6 +27,7 @@ async def db_session():
     async with async_engine.begin() as conn:
         await conn.run_sync(Base.metadata.drop_all)
         await conn.run_sync(Base.metadata.create_all)
+    url_cache.clear()
 
     async with TestingAsyncSessionLocal() as session:
         try:
@@ -90,3 +93,149 @@ class TestCRUDOperations:
 
         # Some random shortcode should still not exist
         assert not await crud.shortcode_exists(db_session, "doesnotexist")
+
+    @pytest.mark.asyncio
+    async def test_lightweight_reads(self, db_session):
+        """Should read single columns as plain values without loading mappings."""
+        created = await crud.create_url_mapping(
+            db_session, "https://www.example.com/", "light"
+        )
+        update_id = created.update_id
+        db_session.expunge_all()
+
+        assert await crud.get_original_url(db_session, "light") == (
+            "https://www.example.com/"
+        )
+        stats = await crud.get_url_stats(db_session, "light")
+        assert isinstance(stats, crud.URLStats)
+        assert stats.created_at is not None
+        assert stats.last_redirect is None
+        assert stats.redirect_count == 0
+        assert await crud.get_shortcode_by_update_id(db_session, update_id) == "light"
+        assert len(db_session.identity_map) == 0
+
+        assert await crud.get_original_url(db_session, "missing") is None
+        assert await crud.get_url_stats(db_session, "missing") is None
+        assert await crud.get_shortcode_by_update_id(db_session, "invalid") is None
+
+    @pytest.mark.asyncio
+    async def test_update_url_mapping_invalidates_cache(self, db_session):
+        """Should make an updated URL visible right away."""
+        mapping = await crud.create_url_mapping(
+            db_session, "https://www.example.com/", "stale"
+        )
+        url_cache.set("stale", "https://www.example.com/")
+
+        await crud.update_url_mapping(
+            db_session, mapping.update_id, "https://www.updated.com/"
+        )
+
+        assert url_cache.get("stale") is None
+        assert (
+            await crud.get_original_url(db_session, "stale")
+            == "https://www.updated.com/"
+        )
+
+    @pytest.mark.asyncio
+    async def test_redirect_url_mapping(self, db_session):
+        """Should return the original URL and count the redirect in one call."""
+        await crud.create_url_mapping(db_session, "https://www.example.com/", "atomic")
+
+        assert (
+            await crud.redirect_url_mapping(db_session, "atomic")
+            == "https://www.example.com/"
+        )
+        assert await crud.redirect_url_mapping(db_session, "unknown") is None
+
+        mapping = await crud.increment_redirect_count(db_session, "atomic")
+        assert mapping.redirect_count == 2
+        assert mapping.last_redirect is not None
+
+    @pytest.mark.asyncio
+    async def test_redirect_unknown_shortcode_commits_nothing(
+        self, db_session, monkeypatch
+    ):
+        """Should not commit when no mapping was counted."""
+
+        async def no_commit():
+            raise AssertionError("committed")
+
+        monkeypatch.setattr(db_session, "commit", no_commit)
+        assert await crud.redirect_url_mapping(db_session, "unknown") is None
+
+    @pytest.mark.asyncio
+    async def test_redirect_url_mapping_concurrent(self, db_session):
+        """Should not lose increments when redirects run in parallel."""
+        await crud.create_url_mapping(db_session, "https://www.example.com/", "busy")
+
+        async def redirect():
+            async with TestingAsyncSessionLocal() as session:
+                return await crud.redirect_url_mapping(session, "busy")
+
+        results = await asyncio.gather(*(redirect() for _ in range(50)))
+        assert results == ["https://www.example.com/"] * 50
+
+        db_session.expire_all()
+        mapping = await crud.get_url_mapping(db_session, "busy")
+        assert mapping.redirect_count == 50
+
+    @pytest.mark.asyncio
+    async def test_create_deduplicated_url_mapping(self, db_session):
+        """Should hand out one mapping per normalized URL until it is updated."""
+        first = await crud.create_deduplicated_url_mapping(
+            db_session, "https://www.example.com/"
+        )
+        again = await crud.create_deduplicated_url_mapping(
+            db_session, "HTTPS://WWW.EXAMPLE.COM:443"
+        )
+        assert again == first
+        other = await crud.create_deduplicated_url_mapping(
+            db_session, "https://www.example.com/other"
+        )
+        assert other.shortcode != first.shortcode
+
+        # Mappings created without deduplication are never handed out
+        plain = await crud.create_url_mapping(db_session, "https://www.example.org/")
+        plain_shortcode = plain.shortcode
+        deduplicated = await crud.create_deduplicated_url_mapping(
+            db_session, "https://www.example.org/"
+        )
+        assert deduplicated.shortcode != plain_shortcode
+
+        # An updated mapping no longer stands for its first URL
+        await crud.update_url_mapping(
+            db_session, first.update_id, "https://www.updated.com/"
+        )
+        fresh = await crud.create_deduplicated_url_mapping(
+            db_session, "https://www.example.com/"
+        )
+        assert fresh.shortcode != first.shortcode
+
+    @pytest.mark.asyncio
+    async def test_create_deduplicated_url_mapping_concurrent(
+        self, db_session, monkeypatch
+    ):
+        """Should create a single row when identical requests race."""
+        find_by_url_hash = crud._find_by_url_hash
+        checked = 0
+
+        async def miss_first_lookup(db, digest, shard_id):
+            # Every caller misses before any has inserted, as in a race
+            nonlocal checked
+            checked += 1
+            if checked <= 10:
+                await asyncio.sleep(0.01)
+                return None
+            return await find_by_url_hash(db, digest, shard_id)
+
+        monkeypatch.setattr(crud, "_find_by_url_hash", miss_first_lookup)
+
+        async def shorten():
+            async with TestingAsyncSessionLocal() as session:
+                return await crud.create_deduplicated_url_mapping(
+                    session, "https://www.example.com/race"
+                )
+
+        results = await asyncio.gather(*(shorten() for _ in range(10)))
+        assert len(set(results)) == 1
+        assert len(await crud.list_shortcodes(db_session)) == 1
@@ -0,0 +1,103 @@
+import pytest
+from sqlalchemy import exc, text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.database import (
+    InstrumentedAsyncPool,
+    ReplicaRouter,
+    get_pool_stats,
+    warm_up_pool,
+)
+
+
+class TestInstrumentedAsyncPool:
+    @pytest.mark.asyncio
+    async def test_records_checkouts_and_timeouts(self):
+        """Should count checkouts, waits and timeouts."""
+        engine = create_async_engine(
+            "sqlite+aiosqlite:///./test_crud.db",
+            poolclass=InstrumentedAsyncPool,
+            pool_size=1,
+            max_overflow=0,
+            pool_timeout=0.05,
+        )
+        try:
+            async with engine.connect() as conn:
+                await conn.execute(text("SELECT 1"))
+                assert get_pool_stats(engine)["checked_out"] == 1
+
+                with pytest.raises(exc.TimeoutError):
+                    async with engine.connect():
+                        pass
+
+            stats = get_pool_stats(engine)
+            assert stats["checked_out"] == 0
+            assert stats["checkouts"] == 1
+            assert stats["timeouts"] == 1
+            assert stats["waiting"] == 0
+            assert stats["wait_time_max"] >= 0
+        finally:
+            await engine.dispose()
+
+    @pytest.mark.asyncio
+    async def test_warm_up_pool(self):
+        """Should leave the requested number of connections open in the pool."""
+        engine = create_async_engine(
+            "sqlite+aiosqlite:///./test_crud.db",
+            poolclass=InstrumentedAsyncPool,
+            pool_size=3,
+        )
+        try:
+            await warm_up_pool(engine, 3)
+            assert engine.pool.checkedin() == 3
+            assert engine.pool.checkedout() == 0
+
+            # Never more than the pool keeps
+            await warm_up_pool(engine, 10)
+            assert engine.pool.checkedin() == 3
+        finally:
+            await engine.dispose()
+
+
+class TestReplicaRouter:
+    def test_without_replicas_reads_primary(self):
+        """Should route every read to the primary when no replicas are configured."""
+        router = ReplicaRouter([])
+        assert router.write_token() is None
+        assert router.choose() is None
+
+    @pytest.mark.asyncio
+    async def test_round_robin_lag_and_read_your_writes(self):
+        """Should balance over healthy replicas and keep recent writers on the primary."""
+        now = [1000.0]
+        router = ReplicaRouter(
+            ["sqlite+aiosqlite:///./test.db", "sqlite+aiosqlite:///./test_crud.db"],
+            max_lag=5,
+            read_your_writes=2,
+            clock=lambda: now[0],
+        )
+        try:
+            # Lag is unknown until checked
+            assert router.choose() is None
+
+            await router.check_lag()
+            assert router.lag == [0.0, 0.0]
+            chosen = [router.choose() for _ in range(4)]
+            assert chosen == router.sessionmakers * 2
+
+            router.lag[0] = 10.0
+            assert {router.choose() for _ in range(3)} == {router.sessionmakers[1]}
+
+            token = router.write_token()
+            assert router.choose(token) is None
+            assert router.choose() is router.sessionmakers[1]
+            # Tokens that were not handed out here are ignored
+            assert router.choose("9999999999") is router.sessionmakers[1]
+            assert router.choose("garbage") is router.sessionmakers[1]
+            now[0] += 3.0
+            assert router.choose(token) is router.sessionmakers[1]
+
+            router.lag[1] = None
+            assert router.choose("client") is None
+        finally:
+            await router.stop()
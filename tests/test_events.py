@@ -0,0 +1,185 @@
+import gzip
+import os
+from datetime import datetime, timezone
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from app import crud, events
+from app.database import Base
+from app.models import RedirectCount, RedirectEventCount
+from app.events import (
+    EventLog,
+    aggregate,
+    closed_segments,
+    decode_events,
+    encode_events,
+    read_segment,
+)
+
+# Use a local SQLite database for testing (async)
+async_engine = create_async_engine(
+    "sqlite+aiosqlite:///./test_crud.db", connect_args={"check_same_thread": False}
+)
+TestingAsyncSessionLocal = sessionmaker(
+    bind=async_engine, class_=AsyncSession, autocommit=False, autoflush=False
+)
+
+
+async def event_counts(db):
+    result = await db.execute(select(RedirectEventCount))
+    return {
+        (row.shortcode, row.status, row.hour.replace(tzinfo=None)): row.count
+        for row in result.scalars()
+    }
+
+
+AUGUST_6 = datetime(2025, 8, 6, 10, 30, tzinfo=timezone.utc).timestamp()
+
+
+@pytest_asyncio.fixture
+async def db_session():
+    """Yields a fresh database session for each test."""
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+
+    async with TestingAsyncSessionLocal() as session:
+        yield session
+
+
+class TestEventLog:
+    def test_encode_and_decode(self):
+        """Should round-trip events through length-prefixed records."""
+        data = encode_events([("abc123", 1_000_000, 302), ("ünï", 2_500_000, 404)])
+        assert list(decode_events(data)) == [
+            ("abc123", datetime(1970, 1, 1, 0, 0, 1, tzinfo=timezone.utc), 302),
+            ("ünï", datetime(1970, 1, 1, 0, 0, 2, 500000, tzinfo=timezone.utc), 404),
+        ]
+        with pytest.raises(ValueError):
+            list(decode_events(data[:-1]))
+
+    @pytest.mark.asyncio
+    async def test_writes_and_rotates_segments(self, tmp_path):
+        """Should append batches to a segment and close it once it is large."""
+        log = EventLog(directory=str(tmp_path), segment_bytes=200)
+        await log.start()
+        try:
+            for i in range(3):
+                log.record("abc123", 302, at=AUGUST_6 + i)
+            await log.flush()
+            assert closed_segments(str(tmp_path)) == []
+
+            for i in range(100):
+                log.record(f"code{i}", 302, at=AUGUST_6)
+            await log.flush()
+            log.record("last", 404, at=AUGUST_6)
+        finally:
+            await log.stop()
+
+        segments = closed_segments(str(tmp_path))
+        assert len(segments) == 2
+        events = [event for path in segments for event in read_segment(path)]
+        assert len(events) == 104
+        assert events[0][0] == "abc123"
+        assert events[-1][0] == "last"
+        assert events[-1][2] == 404
+        assert log.stats()["written"] == 104
+
+    def test_drops_events_when_queue_is_full(self, tmp_path):
+        """Should never let the queue grow past max_queued."""
+        log = EventLog(directory=str(tmp_path), max_queued=2)
+        for _ in range(5):
+            log.record("abc123", 302)
+        assert log.stats()["queued"] == 2
+        assert log.stats()["dropped"] == 3
+
+        disabled = EventLog(directory=None)
+        disabled.record("abc123", 302)
+        assert disabled.stats()["queued"] == 0
+
+    @pytest.mark.asyncio
+    async def test_closes_abandoned_segments(self, tmp_path):
+        """Should close segments left open by a process that died."""
+        name = "events-20250806T103000000000-999999999.log.gz.open"
+        (tmp_path / name).write_bytes(b"")
+        log = EventLog(directory=str(tmp_path))
+        await log.start()
+        await log.stop()
+        assert os.listdir(tmp_path) == [name[: -len(".open")]]
+
+
+class TestAggregate:
+    @pytest.mark.asyncio
+    async def test_folds_segments_into_event_counts(self, tmp_path, db_session):
+        """Should count events per hour and status without touching live counters."""
+        await crud.create_url_mapping(db_session, "https://www.example.com/", "one")
+        log = EventLog(directory=str(tmp_path))
+        await log.start()
+        log.record("one", 302, at=AUGUST_6)
+        log.record("one", 302, at=AUGUST_6 + 60)
+        log.record("one", 302, at=AUGUST_6 + 3600)
+        log.record("missing", 404, at=AUGUST_6)
+        await log.stop()
+
+        assert await aggregate(TestingAsyncSessionLocal, str(tmp_path)) == 1
+        assert closed_segments(str(tmp_path)) == []
+        assert len(os.listdir(tmp_path / "processed")) == 1
+        assert await aggregate(TestingAsyncSessionLocal, str(tmp_path)) == 0
+
+        assert await event_counts(db_session) == {
+            ("one", 302, datetime(2025, 8, 6, 10)): 2,
+            ("one", 302, datetime(2025, 8, 6, 11)): 1,
+            ("missing", 404, datetime(2025, 8, 6, 10)): 1,
+        }
+        # Redirects are already counted live; the log must not add them again
+        db_session.expire_all()
+        mapping = await crud.get_url_mapping(db_session, "one")
+        assert mapping.redirect_count == 0
+        assert (await db_session.execute(select(RedirectCount))).first() is None
+
+    @pytest.mark.asyncio
+    async def test_segment_left_in_place_is_not_applied_again(
+        self, tmp_path, db_session, monkeypatch
+    ):
+        """Should skip a segment whose counts were committed before a crash."""
+        log = EventLog(directory=str(tmp_path))
+        await log.start()
+        log.record("one", 302, at=AUGUST_6)
+        await log.stop()
+
+        def crash(source, target):
+            raise OSError("disk went away")
+
+        # Fail after the counts are committed but before the segment moves
+        with monkeypatch.context() as patch:
+            patch.setattr(events.os, "replace", crash)
+            with pytest.raises(OSError):
+                await aggregate(TestingAsyncSessionLocal, str(tmp_path))
+        assert len(closed_segments(str(tmp_path))) == 1
+
+        assert await aggregate(TestingAsyncSessionLocal, str(tmp_path)) == 1
+        assert closed_segments(str(tmp_path)) == []
+        assert await event_counts(db_session) == {
+            ("one", 302, datetime(2025, 8, 6, 10)): 1
+        }
+
+    @pytest.mark.asyncio
+    async def test_sets_truncated_tail_aside(self, tmp_path, db_session):
+        """Should apply the complete batches of a segment cut off mid-write."""
+        complete = gzip.compress(encode_events([("one", int(AUGUST_6 * 1e6), 302)]))
+        cut = gzip.compress(encode_events([("one", int(AUGUST_6 * 1e6), 302)] * 50))
+        name = "events-20250806T103000000000-1.log.gz"
+        (tmp_path / name).write_bytes(complete + cut[:-10])
+
+        assert list(read_segment(str(tmp_path / name))) == [
+            ("one", datetime.fromtimestamp(AUGUST_6, tz=timezone.utc), 302)
+        ]
+        assert await aggregate(TestingAsyncSessionLocal, str(tmp_path)) == 1
+        assert (tmp_path / "processed" / (name + ".damaged")).read_bytes() == cut[:-10]
+        assert await event_counts(db_session) == {
+            ("one", 302, datetime(2025, 8, 6, 10)): 1
+        }
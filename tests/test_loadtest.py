@@ -0,0 +1,142 @@
+import json
+import random
+from collections import Counter
+
+import httpx
+import pytest
+import pytest_asyncio
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from app.cache import url_cache
+from app.counters import redirect_counter
+from app.database import get_async_db, Base
+from app.main import app
+from app.shortcodes import shortcode_allocator
+from bench.loadtest import (
+    ROUTES,
+    Config,
+    ZipfSampler,
+    drive,
+    format_report,
+    load_trace,
+    parse_mix,
+    percentile,
+    route_of,
+    seed,
+)
+
+async_engine = create_async_engine(
+    "sqlite+aiosqlite:///./test.db", connect_args={"check_same_thread": False}
+)
+TestingAsyncSessionLocal = sessionmaker(
+    bind=async_engine, class_=AsyncSession, autocommit=False, autoflush=False
+)
+
+
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as session:
+        yield session
+
+
+@pytest_asyncio.fixture
+async def client():
+    """Client for the app on an empty test database"""
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    url_cache.clear()
+    redirect_counter.clear()
+    shortcode_allocator.reset()
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+        yield ac
+    redirect_counter.clear()
+    shortcode_allocator.reset()
+
+
+class TestHelpers:
+    def test_parse_mix(self):
+        """Should parse route weights and reject unknown routes."""
+        assert parse_mix("redirect=8,stats=2") == {"redirect": 8.0, "stats": 2.0}
+        with pytest.raises(ValueError):
+            parse_mix("delete=1")
+        with pytest.raises(ValueError):
+            parse_mix("redirect=0")
+
+    def test_percentile(self):
+        """Should use the nearest rank."""
+        values = [float(i) for i in range(1, 101)]
+        assert percentile(values, 0.50) == 50.0
+        assert percentile(values, 0.99) == 99.0
+        assert percentile([3.0], 0.95) == 3.0
+        assert percentile([], 0.5) == 0.0
+
+    def test_zipf_sampler_favours_first_keys(self):
+        """Should draw low ranks far more often than high ones."""
+        sampler = ZipfSampler(list(range(100)), 1.2, random.Random(1))
+        counts = Counter(sampler.sample() for _ in range(10000))
+        assert counts[0] > 5 * counts[10] > 0
+        uniform = ZipfSampler(list(range(4)), 0, random.Random(1))
+        assert set(Counter(uniform.sample() for _ in range(1000))) == {0, 1, 2, 3}
+
+    def test_route_of(self):
+        """Should group replayed paths by route template."""
+        assert route_of("GET", "/abc123") == ROUTES["redirect"]
+        assert route_of("GET", "/abc123/stats") == ROUTES["stats"]
+        assert route_of("POST", "/update/some-id") == ROUTES["update"]
+        assert route_of("POST", "/shorten") == ROUTES["shorten"]
+        assert route_of("GET", "/") == "GET /"
+
+    def test_load_trace(self, tmp_path):
+        """Should read a JSONL trace and reject lines without a path."""
+        trace = tmp_path / "trace.jsonl"
+        trace.write_text(
+            json.dumps({"path": "/{shortcode}"})
+            + "\n\n"
+            + json.dumps({"method": "post", "path": "/shorten", "json": {"url": "x"}})
+            + "\n"
+        )
+        assert load_trace(str(trace)) == [
+            {"method": "GET", "path": "/{shortcode}", "json": None},
+            {"method": "POST", "path": "/shorten", "json": {"url": "x"}},
+        ]
+        trace.write_text(json.dumps({"method": "GET"}) + "\n")
+        with pytest.raises(ValueError):
+            load_trace(str(trace))
+
+
+class TestDrive:
+    @pytest.mark.asyncio
+    async def test_mix_reports_every_route(self, client):
+        """Should send the mix and report each route without errors."""
+        keys = await seed(client, 20)
+        assert len(keys) == 20
+
+        config = Config(
+            mix=parse_mix("redirect=4,stats=2,shorten=1,update=1"),
+            concurrency=4,
+            requests=80,
+            keys=20,
+        )
+        result = await drive(client, config, keys)
+        assert set(result["routes"]) == set(ROUTES.values())
+        assert result["total"]["requests"] == 80
+        assert result["total"]["errors"] == 0
+        redirects = result["routes"][ROUTES["redirect"]]
+        assert redirects["statuses"] == {"302": redirects["requests"]}
+        assert "GET /{shortcode}" in format_report(result, baseline=result)
+
+    @pytest.mark.asyncio
+    async def test_replay(self, client):
+        """Should replay a trace, filling in seeded keys."""
+        keys = await seed(client, 5)
+        trace = [
+            {"method": "GET", "path": "/{shortcode}/stats", "json": None},
+            {"method": "GET", "path": "/missing", "json": None},
+        ]
+        result = await drive(client, Config(concurrency=2, requests=10), keys, trace)
+        assert result["routes"][ROUTES["stats"]]["statuses"] == {"200": 5}
+        assert result["routes"][ROUTES["redirect"]]["statuses"] == {"404": 5}
+        assert result["total"]["errors"] == 0
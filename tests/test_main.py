@@ -5,8 +5,13 @@ from httpx import AsyncClient
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from app.main import app
+from app import admin, crud, database, main
 from app.database import get_async_db, Base
+from app.cache import url_cache
+from app.counters import redirect_counter
+from app.utils import RESERVED_SHORTCODES
 import asyncio
+from sqlalchemy.exc import DataError
 
 # Create a temporary SQLite database for testing (async)
 SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
@@ -36,6 +41,8 @@ async def clean_db():
     async with async_engine.begin() as conn:
         await conn.run_sync(Base.metadata.drop_all)
         await conn.run_sync(Base.metadata.create_all)
+    url_cache.clear()
+    redirect_counter.clear()
 
 
 @pytest_asyncio.fixture
@@ -78,6 +85,29 @@ class TestURLShortening:
         response = await async_client.post("/shorten", json={"shortcode": "test"})
         assert response.status_code == 422  # Pydantic validation error
 
+    @pytest.mark.asyncio
+    async def test_shorten_url_reserved_shortcode(self, clean_db, async_client):
+        """Test that the service's own paths cannot be used as shortcodes"""
+        for shortcode in ["ready", "metrics", "stats"]:
+            response = await async_client.post(
+                "/shorten",
+                json={"url": "https://www.example.com/", "shortcode": shortcode},
+            )
+            assert response.status_code == 412
+
+        response = await async_client.post(
+            "/shorten/batch",
+            json=[{"url": "https://www.example.com/", "shortcode": "docs"}],
+        )
+        assert response.json()["results"][0]["status"] == 412
+
+    def test_reserved_shortcodes_cover_routes(self):
+        """Test that every fixed top-level route segment is reserved"""
+        for route in app.routes:
+            segment = route.path.strip("/").split("/")[0]
+            if segment and "{" not in segment:
+                assert segment in RESERVED_SHORTCODES, route.path
+
     @pytest.mark.asyncio
     async def test_shorten_url_duplicate_shortcode(self, clean_db, async_client):
         """Test error when shortcode already exists"""
@@ -103,6 +133,161 @@ class TestURLShortening:
         response = await async_client.post("/shorten", json={"url": "not-a-valid-url"})
         assert response.status_code == 422  # Pydantic validation error
 
+    @pytest.mark.asyncio
+    async def test_shorten_url_dedup(self, clean_db, async_client, monkeypatch):
+        """Test that SHORTEN_DEDUP returns the existing mapping for a URL"""
+        monkeypatch.setattr(main, "SHORTEN_DEDUP", True)
+        first = await async_client.post(
+            "/shorten", json={"url": "https://www.example.com/"}
+        )
+        again = await async_client.post(
+            "/shorten", json={"url": "https://WWW.EXAMPLE.COM"}
+        )
+        assert first.status_code == again.status_code == 201
+        assert again.json() == first.json()
+
+        # Custom shortcodes always create a mapping
+        custom = await async_client.post(
+            "/shorten", json={"url": "https://www.example.com/", "shortcode": "mine"}
+        )
+        assert custom.json()["shortcode"] == "mine"
+
+
+class TestURLBatchShortening:
+    """Test bulk URL shortening"""
+
+    @pytest.mark.asyncio
+    async def test_batch_json_array(self, clean_db, async_client):
+        """Test per-item results for a JSON array batch"""
+        await async_client.post(
+            "/shorten", json={"url": "https://www.example.com/", "shortcode": "taken"}
+        )
+
+        response = await async_client.post(
+            "/shorten/batch",
+            json=[
+                {"url": "https://www.one.com/"},
+                {"url": "https://www.two.com/", "shortcode": "two"},
+                {"url": "https://www.three.com/", "shortcode": "taken"},
+                {"url": "not-a-valid-url"},
+                {"url": "https://www.five.com/", "shortcode": "two"},
+            ],
+        )
+        assert response.status_code == 200
+        results = response.json()["results"]
+        assert [r["status"] for r in results] == [201, 201, 409, 422, 409]
+        assert [r["index"] for r in results] == [0, 1, 2, 3, 4]
+        assert len(results[0]["shortcode"]) == 6
+        assert results[0]["update_id"] is not None
+        assert results[1]["shortcode"] == "two"
+        assert results[3]["detail"].startswith("url:")
+
+        response = await async_client.get(
+            f"/{results[0]['shortcode']}", follow_redirects=False
+        )
+        assert response.headers["location"] == "https://www.one.com/"
+
+        response = await async_client.get("/two/stats")
+        assert response.json()["redirectCount"] == 0
+
+    @pytest.mark.asyncio
+    async def test_batch_ndjson(self, clean_db, async_client):
+        """Test an NDJSON batch with a malformed line"""
+        body = b'{"url": "https://www.one.com/"}\n\nnot json\n{"url": "https://www.two.com/"}\n'
+        response = await async_client.post(
+            "/shorten/batch",
+            content=body,
+            headers={"content-type": "application/x-ndjson"},
+        )
+        assert response.status_code == 200
+        results = response.json()["results"]
+        assert [r["status"] for r in results] == [201, 422, 201]
+        assert results[1]["detail"] == "Invalid JSON"
+
+    @pytest.mark.asyncio
+    async def test_batch_is_inserted_in_chunks(
+        self, clean_db, async_client, monkeypatch
+    ):
+        """Test batches larger than one insert chunk"""
+        monkeypatch.setattr(crud, "BATCH_INSERT_CHUNK_SIZE", 3)
+        response = await async_client.post(
+            "/shorten/batch",
+            json=[{"url": f"https://www.example.com/{i}"} for i in range(10)],
+        )
+        results = response.json()["results"]
+        assert [r["status"] for r in results] == [201] * 10
+        assert len({r["shortcode"] for r in results}) == 10
+
+    @pytest.mark.asyncio
+    async def test_batch_rejects_oversized_items(self, clean_db, async_client):
+        """Test that items too long for the columns fail alone"""
+        response = await async_client.post(
+            "/shorten/batch",
+            json=[
+                {"url": "https://www.example.com/" + "a" * 2048},
+                {"url": "https://www.example.com/", "shortcode": "s" * 256},
+                {"url": "https://www.example.com/"},
+            ],
+        )
+        results = response.json()["results"]
+        assert [r["status"] for r in results] == [422, 422, 201]
+
+    @pytest.mark.asyncio
+    async def test_oversized_single_requests_get_412(self, clean_db, async_client):
+        """Test that /shorten and /update keep answering 412 for oversized input"""
+        long_url = "https://www.example.com/" + "a" * 2048
+        response = await async_client.post("/shorten", json={"url": long_url})
+        assert response.status_code == 412
+        response = await async_client.post(
+            "/shorten", json={"url": "https://www.example.com/", "shortcode": "s" * 256}
+        )
+        assert response.status_code == 412
+
+        response = await async_client.post(
+            "/shorten", json={"url": "https://www.example.com/"}
+        )
+        update_id = response.json()["update_id"]
+        response = await async_client.post(
+            f"/update/{update_id}", json={"url": long_url}
+        )
+        assert response.status_code == 412
+
+    @pytest.mark.asyncio
+    async def test_batch_database_error_fails_one_chunk(
+        self, clean_db, async_client, monkeypatch
+    ):
+        """Test that a chunk rejected by the database does not fail the batch"""
+        monkeypatch.setattr(crud, "BATCH_INSERT_CHUNK_SIZE", 2)
+        insert = crud._insert_ignoring_conflicts
+
+        async def reject_bad(db, rows):
+            if any(row["original_url"].endswith("/bad") for row in rows):
+                raise DataError("INSERT", {}, Exception("value too long"))
+            return await insert(db, rows)
+
+        monkeypatch.setattr(crud, "_insert_ignoring_conflicts", reject_bad)
+        response = await async_client.post(
+            "/shorten/batch",
+            json=[
+                {"url": "https://www.example.com/1"},
+                {"url": "https://www.example.com/bad"},
+                {"url": "https://www.example.com/3"},
+                {"url": "https://www.example.com/4"},
+            ],
+        )
+        results = response.json()["results"]
+        assert [r["status"] for r in results] == [412, 412, 201, 201]
+
+    @pytest.mark.asyncio
+    async def test_batch_invalid_body(self, clean_db, async_client):
+        """Test error when the body is not a JSON array"""
+        response = await async_client.post(
+            "/shorten/batch",
+            content=b"[not json",
+            headers={"content-type": "application/json"},
+        )
+        assert response.status_code == 400
+
 
 class TestURLUpdate:
     """Test URL update functionality"""
@@ -122,6 +307,12 @@ class TestURLUpdate:
         assert response.status_code == 201
         assert response.json()["shortcode"] == "up"
 
+        # The ID is a UUID, so any spelling of it matches
+        response = await async_client.post(
+            f"/update/{update_id.upper()}", json={"url": "https://www.updated.com/2"}
+        )
+        assert response.status_code == 201
+
     @pytest.mark.asyncio
     async def test_update_url_invalid_update_id(self, clean_db, async_client):
         """Test error when update ID doesn't exist"""
@@ -158,6 +349,44 @@ class TestURLRedirect:
         response = await async_client.get("/nonexistent")
         assert response.status_code == 404
 
+    @pytest.mark.asyncio
+    async def test_redirect_after_update(self, clean_db, async_client):
+        """Test redirect follows an updated URL even when the old one was cached"""
+        create_response = await async_client.post(
+            "/shorten", json={"url": "https://www.example.com/", "shortcode": "moved"}
+        )
+        update_id = create_response.json()["update_id"]
+        await async_client.get("/moved", follow_redirects=False)
+
+        await async_client.post(
+            f"/update/{update_id}", json={"url": "https://www.updated.com/"}
+        )
+
+        response = await async_client.get("/moved", follow_redirects=False)
+        assert response.status_code == 302
+        assert response.headers["location"] == "https://www.updated.com/"
+
+    @pytest.mark.asyncio
+    async def test_lookup_racing_an_update_is_not_cached(
+        self, clean_db, async_client, monkeypatch
+    ):
+        """Test a URL read just before an update commits is not cached"""
+        await async_client.post(
+            "/shorten", json={"url": "https://www.example.com/", "shortcode": "racing"}
+        )
+        redirect_url_mapping = crud.redirect_url_mapping
+
+        async def updated_meanwhile(db, shortcode):
+            original_url = await redirect_url_mapping(db, shortcode)
+            # The update commits and invalidates after the lookup read the row
+            url_cache.invalidate(shortcode)
+            return original_url
+
+        monkeypatch.setattr(crud, "redirect_url_mapping", updated_meanwhile)
+        response = await async_client.get("/racing", follow_redirects=False)
+        assert response.headers["location"] == "https://www.example.com/"
+        assert url_cache.get("racing") is None
+
 
 class TestURLStats:
     """Test URL statistics functionality"""
@@ -201,3 +430,255 @@ class TestURLStats:
         """Test stats for non-existent shortcode"""
         response = await async_client.get("/nonexistent/stats")
         assert response.status_code == 404
+
+    @pytest.mark.asyncio
+    async def test_stats_batch(self, clean_db, async_client, monkeypatch):
+        """Test getting stats for many shortcodes in one request"""
+        monkeypatch.setattr(crud, "BATCH_STATS_CHUNK_SIZE", 2)
+        for shortcode in ["one", "two", "three"]:
+            await async_client.post(
+                "/shorten",
+                json={"url": "https://www.example.com/", "shortcode": shortcode},
+            )
+        await async_client.get("/two", follow_redirects=False)
+
+        response = await async_client.post(
+            "/stats/batch",
+            json={"shortcodes": ["one", "nonexistent", "two", "three", "one"]},
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert list(data["stats"]) == ["one", "two", "three"]
+        assert data["missing"] == ["nonexistent"]
+        # Buffered redirects are included, as in GET /{shortcode}/stats
+        assert data["stats"]["two"]["redirectCount"] == 1
+        assert data["stats"]["two"] == (await async_client.get("/two/stats")).json()
+
+    @pytest.mark.asyncio
+    async def test_stats_batch_too_large(self, clean_db, async_client, monkeypatch):
+        """Test error when a stats batch has too many shortcodes"""
+        monkeypatch.setattr(main, "STATS_BATCH_MAX_ITEMS", 2)
+        response = await async_client.post(
+            "/stats/batch", json={"shortcodes": ["a", "b", "c"]}
+        )
+        assert response.status_code == 413
+
+
+class TestURLTimeseries:
+    """Test redirect time series"""
+
+    @pytest.mark.asyncio
+    async def test_timeseries_counts_redirects(
+        self, clean_db, async_client, monkeypatch
+    ):
+        """Test redirects appear in the current hour, day and month"""
+        monkeypatch.setattr(
+            redirect_counter, "session_factory", TestingAsyncSessionLocal
+        )
+        await async_client.post(
+            "/shorten", json={"url": "https://www.example.com", "shortcode": "ts0001"}
+        )
+        for _ in range(3):
+            await async_client.get("/ts0001", follow_redirects=False)
+        await redirect_counter.flush()
+        await async_client.get("/ts0001", follow_redirects=False)
+
+        response = await async_client.get("/ts0001/stats/timeseries")
+        assert response.status_code == 200
+        data = response.json()
+        assert data["granularity"] == "hour"
+        assert len(data["buckets"]) == 7 * 24
+        assert data["buckets"][-1]["count"] == 4
+        assert sum(bucket["count"] for bucket in data["buckets"]) == 4
+
+        response = await async_client.get(
+            "/ts0001/stats/timeseries", params={"granularity": "month"}
+        )
+        assert response.json()["buckets"][-1]["count"] == 4
+
+    @pytest.mark.asyncio
+    async def test_timeseries_range(self, clean_db, async_client):
+        """Test explicit ranges and their limits"""
+        await async_client.post(
+            "/shorten", json={"url": "https://www.example.com", "shortcode": "ts0002"}
+        )
+        response = await async_client.get(
+            "/ts0002/stats/timeseries",
+            params={
+                "granularity": "day",
+                "start": "2025-01-01T00:00:00Z",
+                "end": "2025-01-31T12:00:00Z",
+            },
+        )
+        assert response.status_code == 200
+        buckets = response.json()["buckets"]
+        assert len(buckets) == 31
+        assert buckets[0]["start"].startswith("2025-01-01T00:00:00")
+
+        response = await async_client.get(
+            "/ts0002/stats/timeseries",
+            params={"start": "2025-02-01T00:00:00Z", "end": "2025-01-01T00:00:00Z"},
+        )
+        assert response.status_code == 400
+
+        response = await async_client.get(
+            "/ts0002/stats/timeseries",
+            params={"start": "2020-01-01T00:00:00Z", "end": "2025-01-01T00:00:00Z"},
+        )
+        assert response.status_code == 400
+
+    @pytest.mark.asyncio
+    async def test_timeseries_not_found(self, clean_db, async_client):
+        """Test error for unknown shortcodes"""
+        response = await async_client.get("/nonexistent/stats/timeseries")
+        assert response.status_code == 404
+
+
+class TestAdmin:
+    """Test admin endpoints"""
+
+    @pytest.mark.asyncio
+    async def test_admin_disabled_without_token(self, async_client, monkeypatch):
+        """Test admin endpoints are hidden when no admin token is configured"""
+        monkeypatch.setattr(admin, "ADMIN_TOKEN", None)
+        response = await async_client.get("/admin/pool")
+        assert response.status_code == 404
+
+    @pytest.mark.asyncio
+    async def test_admin_requires_token(self, async_client, monkeypatch):
+        """Test error when the admin token is wrong"""
+        monkeypatch.setattr(admin, "ADMIN_TOKEN", "secret")
+        response = await async_client.get(
+            "/admin/pool", headers={"X-Admin-Token": "wrong"}
+        )
+        assert response.status_code == 401
+
+    @pytest.mark.asyncio
+    async def test_pool_stats(self, async_client, monkeypatch):
+        """Test live pool stats"""
+        monkeypatch.setattr(admin, "ADMIN_TOKEN", "secret")
+        response = await async_client.get(
+            "/admin/pool", headers={"X-Admin-Token": "secret"}
+        )
+        assert response.status_code == 200
+        data = response.json()
+        for key in ("checked_out", "overflow", "wait_time_avg", "timeouts"):
+            assert key in data
+        assert data["shards"] == {}
+        assert data["replicas"] == []
+
+    @pytest.mark.asyncio
+    async def test_cache_stats(self, clean_db, async_client, monkeypatch):
+        """Test redirect cache stats"""
+        monkeypatch.setattr(admin, "ADMIN_TOKEN", "secret")
+        response = await async_client.get(
+            "/admin/cache", headers={"X-Admin-Token": "secret"}
+        )
+        assert response.status_code == 200
+        assert response.json()["backend"] == "memory"
+        assert response.json()["size"] == 0
+
+
+class TestReadReplicas:
+    """Test routing of redirect and stats reads to read replicas"""
+
+    @pytest_asyncio.fixture
+    async def replica(self, monkeypatch):
+        router = database.ReplicaRouter(["sqlite+aiosqlite:///./test_crud.db"])
+        async with router.engines[0].begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+            await conn.run_sync(Base.metadata.create_all)
+        await router.check_lag()
+        monkeypatch.setattr(database, "replica_router", router)
+        yield router
+        await router.stop()
+
+    @pytest.mark.asyncio
+    async def test_reads_from_replica(self, clean_db, replica):
+        """Test redirects and stats are served by the replica"""
+        async with replica.sessionmakers[0]() as session:
+            await crud.create_url_mapping(
+                session, "https://replica.example.com", "repl01"
+            )
+
+        transport = httpx.ASGITransport(app=app, client=("10.0.0.2", 1234))
+        async with AsyncClient(transport=transport, base_url="http://test") as client:
+            response = await client.get("/repl01/stats")
+            assert response.status_code == 200
+
+            response = await client.get("/repl01", follow_redirects=False)
+            assert response.status_code == 302
+            assert response.headers["location"] == "https://replica.example.com"
+        assert redirect_counter.pending("repl01").count == 1
+
+    @pytest.mark.asyncio
+    async def test_falls_back_to_primary(self, clean_db, replica, async_client):
+        """Test shortcodes missing on the replica are read from the primary"""
+        response = await async_client.post(
+            "/shorten", json={"url": "https://example.com", "shortcode": "prim01"}
+        )
+        assert response.status_code == 201
+
+        transport = httpx.ASGITransport(app=app, client=("10.0.0.2", 1234))
+        async with AsyncClient(transport=transport, base_url="http://test") as client:
+            response = await client.get("/prim01", follow_redirects=False)
+            assert response.status_code == 302
+            assert response.headers["location"] == "https://example.com/"
+
+    @pytest.mark.asyncio
+    async def test_stale_replica_read_is_cached_briefly(
+        self, clean_db, replica, async_client, monkeypatch
+    ):
+        """Test an update missing on a lagging replica is not cached for the full TTL"""
+        now = [0.0]
+        monkeypatch.setattr(url_cache, "_clock", lambda: now[0])
+        async with replica.sessionmakers[0]() as session:
+            await crud.create_url_mapping(session, "https://old.example.com", "lag001")
+        response = await async_client.post(
+            "/shorten", json={"url": "https://old.example.com", "shortcode": "lag001"}
+        )
+        await async_client.post(
+            f"/update/{response.json()['update_id']}",
+            json={"url": "https://new.example.com"},
+        )
+
+        # A client without the write cookie reads the replica, which lags
+        transport = httpx.ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as client:
+            response = await client.get("/lag001", follow_redirects=False)
+        assert response.headers["location"] == "https://old.example.com"
+        assert url_cache.get("lag001") == "https://old.example.com"
+
+        now[0] += database.REPLICA_MAX_LAG_SECONDS
+        assert url_cache.get("lag001") is None
+
+    @pytest.mark.asyncio
+    async def test_pool_stats_include_replicas(
+        self, replica, async_client, monkeypatch
+    ):
+        """Test every replica's pool is reported next to the primary's"""
+        monkeypatch.setattr(admin, "ADMIN_TOKEN", "secret")
+        response = await async_client.get(
+            "/admin/pool", headers={"X-Admin-Token": "secret"}
+        )
+        assert response.status_code == 200
+        (replica_stats,) = response.json()["replicas"]
+        assert replica_stats["pool_class"] == "InstrumentedAsyncPool"
+
+    @pytest.mark.asyncio
+    async def test_reads_own_writes_from_primary(self, clean_db, replica, async_client):
+        """Test a client reads from the primary right after it writes"""
+        async with replica.sessionmakers[0]() as session:
+            await crud.create_url_mapping(
+                session, "https://stale.example.com", "own001"
+            )
+
+        response = await async_client.post(
+            "/shorten", json={"url": "https://fresh.example.com", "shortcode": "own001"}
+        )
+        assert response.status_code == 201
+
+        response = await async_client.get("/own001", follow_redirects=False)
+        assert response.status_code == 302
+        assert response.headers["location"] == "https://fresh.example.com/"
+        assert "read_primary_until" in async_client.cookies
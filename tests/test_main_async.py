@@ -6,6 +6,8 @@ from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from app.main import app
 from app.database import get_async_db, Base
+from app.cache import url_cache
+from app.counters import redirect_counter
 import asyncio
 
 # Create a temporary SQLite database for testing (async)
@@ -36,6 +38,8 @@ async def clean_db():
     async with async_engine.begin() as conn:
         await conn.run_sync(Base.metadata.drop_all)
         await conn.run_sync(Base.metadata.create_all)
+    url_cache.clear()
+    redirect_counter.clear()
 
 
 @pytest_asyncio.fixture
@@ -0,0 +1,113 @@
+import httpx
+import pytest
+import pytest_asyncio
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from app import crud
+from app.cache import url_cache
+from app.counters import redirect_counter
+from app.database import get_async_db, Base
+from app.main import app
+from app.metrics import (
+    Histogram,
+    clear_metrics,
+    instrument_engine,
+    query_latency,
+    render_metrics,
+    request_latency,
+    requests_in_flight,
+)
+
+async_engine = create_async_engine(
+    "sqlite+aiosqlite:///./test.db", connect_args={"check_same_thread": False}
+)
+instrument_engine(async_engine)
+TestingAsyncSessionLocal = sessionmaker(
+    bind=async_engine, class_=AsyncSession, autocommit=False, autoflush=False
+)
+
+
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as session:
+        yield session
+
+
+@pytest_asyncio.fixture
+async def client():
+    """Client for the app on an empty test database, with metrics reset"""
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    url_cache.clear()
+    redirect_counter.clear()
+    clear_metrics()
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+        yield ac
+    redirect_counter.clear()
+
+
+def series_count(histogram, labels):
+    counts, _ = histogram._series.get(labels, ([0], [0.0]))
+    return sum(counts)
+
+
+class TestHistogram:
+    def test_render(self):
+        """Should render cumulative buckets, the sum and the count."""
+        histogram = Histogram("latency_seconds", "Latency.", ("route",), (0.1, 1.0))
+        histogram.observe(("/a",), 0.05)
+        histogram.observe(("/a",), 0.5)
+        histogram.observe(("/a",), 5.0)
+        histogram.observe(('say "hi"',), 0.1)
+        lines = histogram.render()
+        assert "# TYPE latency_seconds histogram" in lines
+        assert 'latency_seconds_bucket{route="/a",le="0.1"} 1' in lines
+        assert 'latency_seconds_bucket{route="/a",le="1.0"} 2' in lines
+        assert 'latency_seconds_bucket{route="/a",le="+Inf"} 3' in lines
+        assert 'latency_seconds_sum{route="/a"} 5.55' in lines
+        assert 'latency_seconds_count{route="/a"} 3' in lines
+        assert 'latency_seconds_bucket{route="say \\"hi\\"",le="0.1"} 1' in lines
+
+
+class TestMetricsEndpoint:
+    @pytest.mark.asyncio
+    async def test_records_requests_per_route(self, client):
+        """Should label requests by route template and status code."""
+        response = await client.post("/shorten", json={"url": "https://example.com/"})
+        shortcode = response.json()["shortcode"]
+        await client.get(f"/{shortcode}")
+        await client.get("/missing")
+        await client.get("/no/such/route")
+
+        assert series_count(request_latency, ("POST", "/shorten", "201")) == 1
+        assert series_count(request_latency, ("GET", "/{shortcode}", "302")) == 1
+        assert series_count(request_latency, ("GET", "/{shortcode}", "404")) == 1
+        assert series_count(request_latency, ("GET", "unmatched", "404")) == 1
+        assert requests_in_flight.value(("GET",)) == 0
+
+        response = await client.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+        assert (
+            'http_request_duration_seconds_count{method="POST",route="/shorten",'
+            'status="201"} 1'
+        ) in response.text
+        assert 'http_requests_in_flight{method="GET"} 1.0' in response.text
+        assert "# TYPE db_query_duration_seconds histogram" in response.text
+
+    @pytest.mark.asyncio
+    async def test_labels_queries_by_crud_function(self, client):
+        """Should time queries under the crud function that ran them."""
+        async with TestingAsyncSessionLocal() as db:
+            await crud.create_url_mapping(db, "https://example.com/", "abc123")
+            await crud.get_url_mapping(db, "abc123")
+            await crud.get_url_mapping(db, "other1")
+
+        assert series_count(query_latency, ("get_url_mapping",)) == 2
+        assert series_count(query_latency, ("create_url_mapping",)) >= 1
+        assert 'db_query_duration_seconds_count{function="get_url_mapping"} 2' in (
+            render_metrics()
+        )
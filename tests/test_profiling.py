@@ -0,0 +1,114 @@
+import asyncio
+
+import httpx
+import pytest
+
+pytest.importorskip("pyinstrument")
+
+from app import admin, profiling
+from app.main import app
+from app.profiling import ProfileStore, ProfilingMiddleware
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ProfileStore(str(tmp_path / "profiles"), max_files=3)
+
+
+def client_for(asgi_app):
+    transport = httpx.ASGITransport(app=asgi_app)
+    return httpx.AsyncClient(transport=transport, base_url="http://test")
+
+
+class TestProfilingMiddleware:
+    @pytest.mark.asyncio
+    async def test_profiles_sampled_requests(self, store):
+        """Should profile sampled requests, even concurrent ones."""
+        profiled = ProfilingMiddleware(app, store, sample_rate=1.0)
+        async with client_for(profiled) as client:
+            responses = await asyncio.gather(*(client.get("/") for _ in range(3)))
+        assert all(response.status_code == 200 for response in responses)
+
+        profiles = store.list()
+        assert len(profiles) == 3
+        assert profiles[0]["method"] == "GET"
+        assert profiles[0]["route"] == "/"
+        assert profiles[0]["status"] == 200
+        assert profiles[0]["duration_ms"] >= 0
+
+        _, session = store.load(profiles[0]["name"])
+        assert session.duration >= 0
+
+    @pytest.mark.asyncio
+    async def test_header_needs_authorized_token(self, store):
+        """Should only profile requests whose header passes the check."""
+        profiled = ProfilingMiddleware(
+            app, store, sample_rate=0, authorize=lambda token: token == "secret"
+        )
+        async with client_for(profiled) as client:
+            await client.get("/")
+            await client.get("/", headers={"X-Profile": "wrong"})
+            assert store.list() == []
+            await client.get("/", headers={"X-Profile": "secret"})
+        assert len(store.list()) == 1
+
+    @pytest.mark.asyncio
+    async def test_keeps_newest_profiles(self, store):
+        """Should delete the oldest profiles beyond max_files."""
+        profiled = ProfilingMiddleware(app, store, sample_rate=1.0)
+        async with client_for(profiled) as client:
+            for _ in range(5):
+                await client.get("/")
+        names = [profile["name"] for profile in store.list()]
+        assert len(names) == 3
+        assert names == sorted(names, reverse=True)
+        assert store.load("../../etc/passwd") is None
+
+
+class TestProfileAdmin:
+    @pytest.mark.asyncio
+    async def test_list_and_render(self, store, monkeypatch):
+        """Should list stored profiles and render them as HTML or text."""
+        monkeypatch.setattr(admin, "ADMIN_TOKEN", "secret")
+        monkeypatch.setattr(admin, "profile_store", store)
+        headers = {"X-Admin-Token": "secret"}
+
+        async with client_for(app) as client:
+            monkeypatch.setattr(profiling, "PROFILE_ENABLED", False)
+            response = await client.get("/admin/profiles", headers=headers)
+            assert response.status_code == 404
+
+            monkeypatch.setattr(profiling, "PROFILE_ENABLED", True)
+            async with client_for(ProfilingMiddleware(app, store, 1.0)) as profiled:
+                await profiled.get("/")
+
+            response = await client.get("/admin/profiles", headers=headers)
+            assert response.status_code == 200
+            (profile,) = response.json()["profiles"]
+
+            response = await client.get(
+                f"/admin/profiles/{profile['name']}", headers=headers
+            )
+            assert response.status_code == 200
+            assert response.headers["content-type"].startswith("text/html")
+
+            response = await client.get(
+                f"/admin/profiles/{profile['name']}?format=text", headers=headers
+            )
+            assert response.status_code == 200
+            assert response.headers["content-type"].startswith("text/plain")
+
+            response = await client.get(
+                "/admin/profiles/profile-20250101T000000000000-1-0", headers=headers
+            )
+            assert response.status_code == 404
+
+    def test_enabled_without_pyinstrument_fails(self, monkeypatch):
+        """Should refuse to start rather than silently not profile."""
+        monkeypatch.setattr(profiling, "PROFILE_ENABLED", True)
+        monkeypatch.setattr(profiling, "Profiler", None)
+        with pytest.raises(RuntimeError, match="profiling extra"):
+            profiling.profiling_available()
+
+        monkeypatch.setattr(profiling, "PROFILE_ENABLED", False)
+        assert profiling.profiling_available() is False
@@ -0,0 +1,143 @@
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+import pytest_asyncio
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from app import serialization
+from app.cache import url_cache
+from app.counters import redirect_counter
+from app.database import get_async_db, Base
+from app.main import app
+from app.schemas import URLStatsResponse
+from app.serialization import FastJSONResponse
+
+async_engine = create_async_engine(
+    "sqlite+aiosqlite:///./test.db", connect_args={"check_same_thread": False}
+)
+TestingAsyncSessionLocal = sessionmaker(
+    bind=async_engine, class_=AsyncSession, autocommit=False, autoflush=False
+)
+
+
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as session:
+        yield session
+
+
+@pytest.fixture(params=["orjson", "json"])
+def encoder(request, monkeypatch):
+    """Run with orjson and with the json module fallback"""
+    if request.param == "orjson":
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr(serialization, "orjson", None)
+    return request.param
+
+
+@pytest_asyncio.fixture
+async def client(encoder):
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    url_cache.clear()
+    redirect_counter.clear()
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+        yield ac
+    redirect_counter.clear()
+
+
+class TestFastJSONResponse:
+    @pytest.mark.parametrize(
+        "created,last_redirect",
+        [
+            (datetime(2024, 1, 2, 3, 4, 5), None),
+            (
+                datetime(2024, 1, 2, 3, 4, 5, 6, tzinfo=timezone.utc),
+                datetime(2024, 2, 3, 4, 5, 6, tzinfo=timezone(timedelta(hours=5))),
+            ),
+        ],
+    )
+    def test_matches_response_model_encoding(self, encoder, created, last_redirect):
+        """Should render the same bytes as the response_model path."""
+        expected = JSONResponse(
+            jsonable_encoder(
+                URLStatsResponse(
+                    created=created, lastRedirect=last_redirect, redirectCount=7
+                )
+            )
+        )
+        fast = FastJSONResponse(
+            {"created": created, "lastRedirect": last_redirect, "redirectCount": 7}
+        )
+        assert fast.body == expected.body
+        assert fast.headers == expected.headers
+
+    def test_unicode(self, encoder):
+        """Should leave non-ASCII characters unescaped, as JSONResponse does."""
+        content = {"shortcode": "ünï ", "update_id": "\x01"}
+        assert FastJSONResponse(content).body == JSONResponse(content).body
+
+    def test_enabled_without_orjson_fails(self, monkeypatch):
+        """Should refuse to start rather than quietly encode with json."""
+        monkeypatch.setattr(serialization, "FAST_JSON_RESPONSES", True)
+        monkeypatch.setattr(serialization, "orjson", None)
+        with pytest.raises(RuntimeError, match="fast-json extra"):
+            serialization.check_fast_json()
+
+        monkeypatch.setattr(serialization, "FAST_JSON_RESPONSES", False)
+        serialization.check_fast_json()
+
+
+class TestFastEndpoints:
+    async def fetch_all(self, client, shortcode, update_id):
+        update = await client.post(
+            f"/update/{update_id}", json={"url": "https://www.updated.com/"}
+        )
+        stats = await client.get(f"/{shortcode}/stats")
+        batch = await client.post(
+            "/stats/batch", json={"shortcodes": [shortcode, "missing"]}
+        )
+        return update, stats, batch
+
+    @pytest.mark.asyncio
+    async def test_same_bytes_as_default(self, client, monkeypatch):
+        """Should answer with the same status, headers and body in both modes."""
+        response = await client.post(
+            "/shorten", json={"url": "https://www.example.com/", "shortcode": "same"}
+        )
+        update_id = response.json()["update_id"]
+        await client.get("/same")
+
+        default = await self.fetch_all(client, "same", update_id)
+        monkeypatch.setattr(serialization, "FAST_JSON_RESPONSES", True)
+        fast = await self.fetch_all(client, "same", update_id)
+
+        for before, after in zip(default, fast):
+            assert after.status_code == before.status_code
+            assert after.headers == before.headers
+            assert after.content == before.content
+
+        response = await client.post(
+            "/shorten", json={"url": "https://www.example.com/", "shortcode": "fast"}
+        )
+        assert response.status_code == 201
+        assert response.headers["content-type"] == "application/json"
+        assert list(response.json()) == ["shortcode", "update_id"]
+        assert response.json()["shortcode"] == "fast"
+
+    @pytest.mark.asyncio
+    async def test_errors_unchanged(self, client, monkeypatch):
+        """Should still answer errors through the usual handlers."""
+        monkeypatch.setattr(serialization, "FAST_JSON_RESPONSES", True)
+        assert (await client.get("/missing/stats")).status_code == 404
+        response = await client.post(
+            "/update/nonexistent", json={"url": "https://www.example.com/"}
+        )
+        assert response.status_code == 401
@@ -0,0 +1,105 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from app import bloom, cache
+from app.serve import (
+    check_shared_filter,
+    default_workers,
+    event_loop,
+    http_protocol,
+    pool_settings,
+)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_ready(port: int, timeout: float = 20) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/ready") as response:
+                if response.status == 200:
+                    return
+        except (urllib.error.URLError, ConnectionError):
+            pass
+        time.sleep(0.1)
+    raise AssertionError("Server did not become ready")
+
+
+class TestServeSettings:
+    def test_pool_budget_is_split_between_workers(self):
+        """Should give every worker an equal share and no overflow."""
+        assert pool_settings(64, 8) == {"DB_POOL_SIZE": "8", "DB_MAX_OVERFLOW": "0"}
+        # Rounded down, so the workers never exceed the budget together
+        assert pool_settings(10, 4)["DB_POOL_SIZE"] == "2"
+        with pytest.raises(ValueError):
+            pool_settings(3, 4)
+
+    def test_falls_back_without_uvloop_and_httptools(self, monkeypatch):
+        """Should use asyncio and h11 when the fast implementations are missing."""
+        monkeypatch.setitem(sys.modules, "uvloop", None)
+        monkeypatch.setitem(sys.modules, "httptools", None)
+        assert event_loop() == "asyncio"
+        assert http_protocol() == "h11"
+
+    def test_filter_needs_shared_backend_with_several_workers(self, monkeypatch):
+        """Should refuse workers that would each keep their own filter."""
+        monkeypatch.setattr(bloom, "SHORTCODE_FILTER_ENABLED", True)
+        monkeypatch.setattr(cache, "URL_CACHE_BACKEND", "memory")
+        check_shared_filter(1)
+        with pytest.raises(ValueError, match="URL_CACHE_BACKEND=shared"):
+            check_shared_filter(2)
+
+        monkeypatch.setattr(cache, "URL_CACHE_BACKEND", "shared")
+        check_shared_filter(2)
+
+    def test_default_workers(self):
+        assert default_workers() >= 1
+
+
+class TestServe:
+    @pytest.fixture
+    def server(self, tmp_path):
+        port = free_port()
+        env = dict(
+            os.environ,
+            DATABASE_URL=f"sqlite+aiosqlite:///{tmp_path}/serve.db",
+            DB_CREATE_SCHEMA="true",
+        )
+        process = subprocess.Popen(
+            [sys.executable, "-m", "app.serve", "--workers", "2", "--port", str(port)]
+            + ["--max-requests", "5", "--db-pool-budget", "4"],
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        yield process, port
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+    def test_serves_and_stops_gracefully(self, server):
+        """Should keep serving while workers are recycled, then exit on SIGTERM."""
+        process, port = server
+        wait_ready(port)
+        # More requests than two workers may serve before being replaced
+        for _ in range(20):
+            wait_ready(port)
+
+        process.send_signal(signal.SIGHUP)
+        wait_ready(port)
+
+        process.send_signal(signal.SIGTERM)
+        assert process.wait(timeout=20) == 0
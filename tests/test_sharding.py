@@ -0,0 +1,316 @@
+import io
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from app import crud
+from app.database import Base
+from app.models import RedirectCount, URLMapping
+from app.rebalance import _move, rebalance
+from app.sharding import HashRing, make_update_id, sharded_sessionmaker
+from app.shortcodes import shortcode_allocator
+from app.transfer import COLUMNS, Progress
+from app.utils import url_hash
+
+# Two local SQLite databases act as shards "0" and "1"
+engines = {
+    "0": create_async_engine(
+        "sqlite+aiosqlite:///./test.db", connect_args={"check_same_thread": False}
+    ),
+    "1": create_async_engine(
+        "sqlite+aiosqlite:///./test_crud.db", connect_args={"check_same_thread": False}
+    ),
+}
+ShardedSessionLocal = sharded_sessionmaker(engines)
+ring = HashRing(list(engines))
+
+
+@pytest_asyncio.fixture
+async def shards():
+    """Creates empty tables on both shards."""
+    for engine in engines.values():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+            await conn.run_sync(Base.metadata.create_all)
+    shortcode_allocator.reset()
+    yield
+    shortcode_allocator.reset()
+
+
+async def shortcodes_on(shard_id):
+    async with engines[shard_id].connect() as conn:
+        result = await conn.execute(select(URLMapping.__table__.c.shortcode))
+        return set(result.scalars().all())
+
+
+class TestHashRing:
+    def test_spreads_keys_over_shards(self):
+        """Should give every shard a fair share of the keys."""
+        three = HashRing(["0", "1", "2"])
+        counts = Counter(three.shard_for_shortcode(f"code{i}") for i in range(30000))
+        assert set(counts) == {"0", "1", "2"}
+        assert all(5000 < count < 15000 for count in counts.values())
+
+    def test_adding_a_shard_only_moves_keys_to_it(self):
+        """Should keep keys in place unless the new shard takes them over."""
+        before = HashRing(["0", "1"])
+        after = HashRing(["0", "1", "2"])
+        moved = 0
+        for i in range(10000):
+            old, new = before.shard_for_shortcode(f"k{i}"), after.shard_for_shortcode(
+                f"k{i}"
+            )
+            if old != new:
+                assert new == "2"
+                moved += 1
+        assert 1500 < moved < 5000
+
+    def test_update_id_routes_to_shortcode_shard(self):
+        """Should route an update ID to the shard of its shortcode."""
+        for i in range(100):
+            update_id = make_update_id(f"code{i}")
+            assert uuid.UUID(update_id).version == 4
+            assert ring.shard_for_update_id(update_id) == ring.shard_for_shortcode(
+                f"code{i}"
+            )
+        assert ring.shard_for_update_id("not-a-uuid") is None
+
+
+class TestShardedCrud:
+    @pytest.mark.asyncio
+    async def test_create_and_look_up(self, shards):
+        """Should store each mapping on its shard and find it by shortcode or update ID."""
+        async with ShardedSessionLocal() as db:
+            created = []
+            for url, shortcode in [
+                *((f"https://example.com/{i}", f"c{i}") for i in range(20)),
+                ("https://example.com/a", None),
+            ]:
+                mapping = await crud.create_url_mapping(db, url, shortcode)
+                created.append(
+                    (mapping.shortcode, mapping.update_id, mapping.original_url)
+                )
+            batch = await crud.create_url_mappings(
+                db, [(f"https://example.com/b{i}", None) for i in range(20)]
+            )
+
+        expected = {"0": set(), "1": set()}
+        for shortcode in [m[0] for m in created] + [b[0] for b in batch]:
+            expected[ring.shard_for_shortcode(shortcode)].add(shortcode)
+        assert expected["0"] and expected["1"]
+        assert await shortcodes_on("0") == expected["0"]
+        assert await shortcodes_on("1") == expected["1"]
+
+        async with ShardedSessionLocal() as db:
+            for shortcode, update_id, original_url in created:
+                found = await crud.get_url_mapping(db, shortcode)
+                assert found.original_url == original_url
+                found = await crud.get_url_mapping_by_update_id(db, update_id)
+                assert found.shortcode == shortcode
+                assert await crud.get_original_url(db, shortcode) == original_url
+                assert await crud.get_shortcode_by_update_id(db, update_id) == (
+                    shortcode
+                )
+
+            stats = await crud.get_url_stats_many(
+                db, [m[0] for m in created] + ["unknown"]
+            )
+            assert set(stats) == {m[0] for m in created}
+
+            updated = await crud.update_url_mapping(
+                db, created[0][1], "https://example.org/"
+            )
+            assert updated.original_url == "https://example.org/"
+
+            assert await crud.redirect_url_mapping(db, "c0") == "https://example.org/"
+            await crud.apply_redirect_counts(
+                db,
+                {
+                    f"c{i}": (2, datetime(2025, 1, 1, tzinfo=timezone.utc))
+                    for i in range(20)
+                },
+            )
+
+        async with ShardedSessionLocal() as db:
+            assert (await crud.get_url_mapping(db, "c0")).redirect_count == 3
+            assert (await crud.get_url_mapping(db, "c5")).redirect_count == 2
+
+    @pytest.mark.asyncio
+    async def test_legacy_update_id(self, shards):
+        """Should find update IDs issued before sharding on any shard."""
+        shortcode = next(
+            f"c{i}" for i in range(100) if ring.shard_for_shortcode(f"c{i}") == "1"
+        )
+        legacy_id = next(
+            update_id
+            for update_id in (str(uuid.uuid4()) for _ in range(100))
+            if ring.shard_for_update_id(update_id) == "0"
+        )
+        async with engines["1"].begin() as conn:
+            await conn.execute(
+                URLMapping.__table__.insert().values(
+                    shortcode=shortcode,
+                    original_url="https://example.com/",
+                    update_id=legacy_id,
+                )
+            )
+
+        async with ShardedSessionLocal() as db:
+            found = await crud.get_url_mapping_by_update_id(db, legacy_id)
+            assert found.shortcode == shortcode
+            assert await crud.get_shortcode_by_update_id(db, legacy_id) == shortcode
+            assert (
+                await crud.get_url_mapping_by_update_id(db, str(uuid.uuid4())) is None
+            )
+
+    @pytest.mark.asyncio
+    async def test_deduplicated_mapping_lives_on_url_shard(self, shards):
+        """Should place each deduplicated URL on the shard its hash names."""
+        async with ShardedSessionLocal() as db:
+            created = {}
+            for i in range(10):
+                url = f"https://example.com/{i}"
+                created[url] = await crud.create_deduplicated_url_mapping(db, url)
+                assert await crud.create_deduplicated_url_mapping(db, url) == (
+                    created[url]
+                )
+
+        for url, mapping in created.items():
+            digest = url_hash(url)
+            shard_id = ring.shard_for_token(int.from_bytes(digest[:4], "big"))
+            assert ring.shard_for_shortcode(mapping.shortcode) == shard_id
+            assert mapping.shortcode in await shortcodes_on(shard_id)
+
+
+class TestRebalance:
+    @pytest.mark.asyncio
+    async def test_moves_rows_to_their_shard(self, shards):
+        """Should move rows owned by another shard and keep the rest."""
+        SessionLocal = sessionmaker(
+            bind=engines["0"], class_=AsyncSession, autocommit=False, autoflush=False
+        )
+        async with SessionLocal() as db:
+            await crud.create_url_mappings(
+                db, [(f"https://example.com/{i}", f"code{i}") for i in range(50)]
+            )
+            hour = datetime(2025, 1, 1, tzinfo=timezone.utc)
+            await crud.apply_redirect_counts(
+                db, {}, {(f"code{i}", hour): 1 for i in range(50)}
+            )
+        owned_by_1 = {
+            f"code{i}" for i in range(50) if ring.shard_for_shortcode(f"code{i}") == "1"
+        }
+
+        quiet = Progress("checked", stream=io.StringIO())
+        planned = await rebalance(engines, batch_size=7, dry_run=True, progress=quiet)
+        assert planned == {("0", "1"): len(owned_by_1)}
+        assert len(await shortcodes_on("0")) == 50
+
+        quiet = Progress("moved", stream=io.StringIO())
+        moved = await rebalance(engines, batch_size=7, progress=quiet)
+        assert moved == planned
+        assert await shortcodes_on("1") == owned_by_1
+        assert len(await shortcodes_on("0")) == 50 - len(owned_by_1)
+        async with engines["1"].connect() as conn:
+            result = await conn.execute(select(RedirectCount.__table__.c.shortcode))
+            assert set(result.scalars().all()) == owned_by_1
+
+        quiet = Progress("moved", stream=io.StringIO())
+        assert await rebalance(engines, progress=quiet) == {}
+
+    @pytest.mark.asyncio
+    async def test_service_keeps_working_while_rows_move(self, shards):
+        """Should find and count rows on their previous shard until they move."""
+        shortcode = next(
+            f"c{i}" for i in range(100) if ring.shard_for_shortcode(f"c{i}") == "1"
+        )
+        update_id = make_update_id(shortcode)
+        async with engines["0"].begin() as conn:
+            await conn.execute(
+                URLMapping.__table__.insert().values(
+                    shortcode=shortcode,
+                    original_url="https://example.com/",
+                    update_id=update_id,
+                )
+            )
+        # Shard "1" was just added; nothing has moved to it yet
+        RebalancingSessionLocal = sharded_sessionmaker(engines, rebalance_from=1)
+
+        async with RebalancingSessionLocal() as db:
+            assert await crud.get_original_url(db, shortcode) == "https://example.com/"
+            assert await crud.shortcode_exists(db, shortcode)
+            assert set(await crud.get_url_stats_many(db, [shortcode])) == {shortcode}
+            assert await crud.redirect_url_mapping(db, shortcode) is not None
+            hour = datetime(2025, 1, 1, tzinfo=timezone.utc)
+            await crud.apply_redirect_counts(
+                db, {shortcode: (2, hour)}, {(shortcode, hour): 2}
+            )
+            await crud.update_url_mapping(db, update_id, "https://example.org/")
+        assert await shortcodes_on("1") == set()
+
+        quiet = Progress("moved", stream=io.StringIO())
+        assert await rebalance(engines, progress=quiet) == {("0", "1"): 1}
+
+        async with RebalancingSessionLocal() as db:
+            stats = await crud.get_url_stats(db, shortcode)
+            assert stats.redirect_count == 3
+            assert await crud.get_original_url(db, shortcode) == "https://example.org/"
+            timeseries = await crud.get_redirect_timeseries(
+                db, shortcode, "hour", hour, datetime(2025, 1, 2, tzinfo=timezone.utc)
+            )
+            assert sum(timeseries.values()) == 2
+
+    @pytest.mark.asyncio
+    async def test_move_copies_rows_as_they_are_when_moved(self, shards):
+        """Should copy writes made after the rows were listed."""
+        shortcode = next(
+            f"c{i}" for i in range(100) if ring.shard_for_shortcode(f"c{i}") == "1"
+        )
+        SessionLocal = sessionmaker(
+            bind=engines["0"], class_=AsyncSession, autocommit=False, autoflush=False
+        )
+        async with SessionLocal() as db:
+            await crud.create_url_mapping(db, "https://example.com/", shortcode)
+            listed = [
+                dict(row)
+                for row in (
+                    await db.execute(
+                        select(*(URLMapping.__table__.c[column] for column in COLUMNS))
+                    )
+                ).mappings()
+            ]
+            await crud.redirect_url_mapping(db, shortcode)
+
+        await _move(engines["0"], engines["1"], listed, ring, "1")
+
+        assert await shortcodes_on("0") == set()
+        async with engines["1"].connect() as conn:
+            result = await conn.execute(select(URLMapping.__table__.c.redirect_count))
+            assert result.scalar_one() == 1
+
+    @pytest.mark.asyncio
+    async def test_keeps_url_hash_on_the_url_shard(self, shards):
+        """Should keep a moved row's url_hash only where its URL belongs."""
+        SessionLocal = sessionmaker(
+            bind=engines["0"], class_=AsyncSession, autocommit=False, autoflush=False
+        )
+        urls = [f"https://example.com/{i}" for i in range(40)]
+        async with SessionLocal() as db:
+            for url in urls:
+                await crud.create_deduplicated_url_mapping(db, url)
+
+        quiet = Progress("moved", stream=io.StringIO())
+        await rebalance(engines, progress=quiet)
+
+        async with engines["1"].connect() as conn:
+            result = await conn.execute(select(URLMapping.__table__.c.url_hash))
+            hashes = result.scalars().all()
+        kept = [digest for digest in hashes if digest is not None]
+        assert kept and len(kept) < len(hashes)
+        assert all(ring.shard_for_url_hash(digest) == "1" for digest in kept)
@@ -0,0 +1,125 @@
+import pytest
+import pytest_asyncio
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.shortcodes import SHORTCODE_SPACE, ShortcodeAllocator, scramble
+from app.utils import encode_shortcode, is_auto_generated_shortcode_valid
+from app import crud
+
+# Use a local SQLite database for testing (async)
+SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./test_crud.db"
+async_engine = create_async_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+TestingAsyncSessionLocal = sessionmaker(
+    bind=async_engine, class_=AsyncSession, autocommit=False, autoflush=False
+)
+
+
+@pytest_asyncio.fixture
+async def db_session():
+    """Yields a fresh database session for each test."""
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+
+    async with TestingAsyncSessionLocal() as session:
+        try:
+            yield session
+        finally:
+            await session.close()
+
+
+class TestScramble:
+
+    def test_scramble_is_a_bijection(self):
+        numbers = list(range(20000)) + list(
+            range(SHORTCODE_SPACE - 1000, SHORTCODE_SPACE)
+        )
+        scrambled = [scramble(n) for n in numbers]
+
+        assert len(set(scrambled)) == len(numbers)
+        assert all(0 <= n < SHORTCODE_SPACE for n in scrambled)
+
+    def test_scramble_depends_on_secret(self):
+        assert [scramble(n, "one") for n in range(10)] != [
+            scramble(n, "two") for n in range(10)
+        ]
+
+    def test_scramble_rejects_out_of_range(self):
+        with pytest.raises(ValueError):
+            scramble(SHORTCODE_SPACE)
+
+
+class TestShortcodeAllocator:
+    @pytest.mark.asyncio
+    async def test_shortcodes_are_unique_across_blocks(self, db_session):
+        """Should hand out distinct valid shortcodes, reserving blocks as needed."""
+        allocator = ShortcodeAllocator(block_size=10)
+        shortcodes = [await allocator.next_shortcode(db_session) for _ in range(15)]
+        shortcodes += await allocator.next_shortcodes(db_session, 30)
+
+        assert len(set(shortcodes)) == 45
+        assert all(is_auto_generated_shortcode_valid(s) for s in shortcodes)
+
+    @pytest.mark.asyncio
+    async def test_workers_get_separate_blocks(self, db_session):
+        """Should never give two allocators the same shortcode."""
+        first = ShortcodeAllocator(block_size=10)
+        second = ShortcodeAllocator(block_size=10)
+
+        codes = set(await first.next_shortcodes(db_session, 25))
+        codes |= set(await second.next_shortcodes(db_session, 25))
+        assert len(codes) == 50
+
+    @pytest.mark.asyncio
+    async def test_blocks_of_different_sizes_never_overlap(self, db_session):
+        """Should start each block after the last one, whatever its size."""
+        small = ShortcodeAllocator(block_size=10)
+        large = ShortcodeAllocator(block_size=1000)
+
+        codes = await small.next_shortcodes(db_session, 15)
+        codes += await large.next_shortcodes(db_session, 5)
+        codes += await small.next_shortcodes(db_session, 10)
+        assert len(set(codes)) == 30
+
+        assert await crud.reserve_shortcode_block(db_session, 10) == (1030, 1040)
+
+    @pytest.mark.asyncio
+    async def test_startup_warns_when_sequence_increment_differs(
+        self, monkeypatch, caplog
+    ):
+        """Should point out a sequence reserving blocks of another size."""
+        from app import main
+
+        async def increment(db):
+            return main.SHORTCODE_BLOCK_SIZE * 2
+
+        monkeypatch.setattr(main.crud, "get_shortcode_block_increment", increment)
+        await main.check_shortcode_block_size()
+        assert "INCREMENT BY" in caplog.text
+
+    @pytest.mark.asyncio
+    async def test_no_sequence_increment_without_sequences(self, db_session):
+        assert await crud.get_shortcode_block_increment(db_session) is None
+
+    def test_rejects_secret_too_long_for_blake2b(self):
+        with pytest.raises(ValueError, match="SHORTCODE_SECRET"):
+            ShortcodeAllocator(secret="x" * 65)
+
+    @pytest.mark.asyncio
+    async def test_create_skips_shortcode_taken_by_custom_code(
+        self, db_session, monkeypatch
+    ):
+        """Should move on to the next shortcode when a custom code took it."""
+        allocator = ShortcodeAllocator(block_size=10)
+        monkeypatch.setattr(crud, "shortcode_allocator", allocator)
+
+        # The first block covers IDs 0-9; squat on the first one
+        taken = encode_shortcode(scramble(0))
+        await crud.create_url_mapping(db_session, "https://www.example.com/", taken)
+
+        mapping = await crud.create_url_mapping(db_session, "https://www.other.com/")
+        assert mapping.shortcode == encode_shortcode(scramble(1))
@@ -0,0 +1,161 @@
+import asyncio
+
+import httpx
+import pytest
+import pytest_asyncio
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from app import crud
+from app.cache import url_cache
+from app.counters import redirect_counter
+from app.database import get_async_db, Base
+from app.main import app
+from app.singleflight import SingleFlight, redirect_lookups
+
+async_engine = create_async_engine(
+    "sqlite+aiosqlite:///./test.db", connect_args={"check_same_thread": False}
+)
+TestingAsyncSessionLocal = sessionmaker(
+    bind=async_engine, class_=AsyncSession, autocommit=False, autoflush=False
+)
+
+
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as session:
+        yield session
+
+
+class SlowLookup:
+    """Lookup that returns or raises once released, counting its calls"""
+
+    def __init__(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+async def started(flight: SingleFlight, count: int = 1):
+    while flight.in_flight() < count:
+        await asyncio.sleep(0)
+
+
+class TestSingleFlight:
+    @pytest.mark.asyncio
+    async def test_concurrent_callers_share_one_lookup(self):
+        """Should run one lookup per key and give every caller its result."""
+        flight = SingleFlight()
+        lookup = SlowLookup(result="https://example.com/")
+        other = SlowLookup(result="https://example.org/")
+        callers = [asyncio.create_task(flight.do("abc", lookup)) for _ in range(10)]
+        callers.append(asyncio.create_task(flight.do("def", other)))
+        await started(flight, 2)
+        await asyncio.sleep(0)
+
+        lookup.release.set()
+        other.release.set()
+        results = await asyncio.gather(*callers)
+        assert results == ["https://example.com/"] * 10 + ["https://example.org/"]
+        assert lookup.calls == 1 and other.calls == 1
+        assert flight.stats() == {"in_flight": 0, "lookups": 2, "coalesced": 9}
+
+    @pytest.mark.asyncio
+    async def test_failure_reaches_waiters_and_is_not_kept(self):
+        """Should raise a failed lookup's error to all waiters, then retry."""
+        flight = SingleFlight()
+        failing = SlowLookup(error=RuntimeError("database is down"))
+        callers = [asyncio.create_task(flight.do("abc", failing)) for _ in range(3)]
+        await started(flight)
+        await asyncio.sleep(0)
+        failing.release.set()
+        results = await asyncio.gather(*callers, return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+        assert failing.calls == 1
+
+        working = SlowLookup(result="https://example.com/")
+        working.release.set()
+        assert await flight.do("abc", working) == "https://example.com/"
+
+    @pytest.mark.asyncio
+    async def test_cancelled_leader_hands_over(self):
+        """Should let a waiter run the lookup when the caller running it is cancelled."""
+        flight = SingleFlight()
+        abandoned = SlowLookup(result="never")
+        leader = asyncio.create_task(flight.do("abc", abandoned))
+        await started(flight)
+        replacement = SlowLookup(result="https://example.com/")
+        replacement.release.set()
+        waiter = asyncio.create_task(flight.do("abc", replacement))
+        await asyncio.sleep(0)
+
+        leader.cancel()
+        assert await waiter == "https://example.com/"
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        assert replacement.calls == 1
+
+    @pytest.mark.asyncio
+    async def test_forget(self):
+        """Should start a new lookup for callers arriving after forget()."""
+        flight = SingleFlight()
+        stale = SlowLookup(result="old")
+        first = asyncio.create_task(flight.do("abc", stale))
+        await started(flight)
+
+        flight.forget("abc")
+        fresh = SlowLookup(result="new")
+        fresh.release.set()
+        assert await flight.do("abc", fresh) == "new"
+        stale.release.set()
+        assert await first == "old"
+        assert flight.in_flight() == 0
+
+
+class TestRedirectCoalescing:
+    @pytest_asyncio.fixture
+    async def client(self):
+        async with async_engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+            await conn.run_sync(Base.metadata.create_all)
+        url_cache.clear()
+        redirect_counter.clear()
+        redirect_lookups.clear()
+        app.dependency_overrides[get_async_db] = override_get_async_db
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+            yield ac
+        redirect_counter.clear()
+
+    @pytest.mark.asyncio
+    async def test_cold_shortcode_is_looked_up_once(self, client, monkeypatch):
+        """Should run one query for concurrent misses and still count each redirect."""
+        await client.post(
+            "/shorten", json={"url": "https://www.example.com/", "shortcode": "hot"}
+        )
+        url_cache.clear()
+
+        calls = 0
+        redirect_url_mapping = crud.redirect_url_mapping
+
+        async def counting(db, shortcode):
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.05)
+            return await redirect_url_mapping(db, shortcode)
+
+        monkeypatch.setattr(crud, "redirect_url_mapping", counting)
+        responses = await asyncio.gather(*(client.get("/hot") for _ in range(20)))
+        assert all(response.status_code == 302 for response in responses)
+        assert calls == 1
+        assert redirect_lookups.stats()["coalesced"] == 19
+
+        stats = (await client.get("/hot/stats")).json()
+        assert stats["redirectCount"] == 20
@@ -0,0 +1,93 @@
+import asyncio
+import os
+import subprocess
+import sys
+
+import httpx
+import pytest
+from httpx import AsyncClient
+
+from app import main
+from app.main import app
+
+# Only needed for migrations or by the launcher, never to serve requests
+HEAVY_MODULES = ["psycopg2", "alembic", "uvicorn"]
+
+
+class TestStartup:
+
+    def test_import_is_light_and_offline(self):
+        """Importing the app must not connect to the database or load heavy modules."""
+        script = (
+            "import sys\n"
+            "import app.main\n"
+            f"print(*[name for name in {HEAVY_MODULES!r} if name in sys.modules])\n"
+        )
+        env = dict(os.environ, DATABASE_URL="postgresql://nobody:x@127.0.0.1:1/none")
+        result = subprocess.run(
+            [sys.executable, "-c", script],
+            capture_output=True,
+            text=True,
+            env=env,
+            check=True,
+        )
+        assert result.stdout.split() == []
+
+    @pytest.mark.asyncio
+    async def test_ready_after_warm_up(self, monkeypatch):
+        """Test readiness stays false until the pool warm-up has finished"""
+        warmed_up = asyncio.Event()
+
+        async def warm_up_pool(engine):
+            await warmed_up.wait()
+
+        monkeypatch.setattr(main, "warm_up_pool", warm_up_pool)
+        monkeypatch.setattr(main, "DB_CREATE_SCHEMA", False)
+
+        transport = httpx.ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as client:
+            async with app.router.lifespan_context(app):
+                response = await client.get("/ready")
+                assert response.status_code == 503
+                assert response.json() == {"ready": False}
+
+                warmed_up.set()
+                await asyncio.sleep(0.01)
+
+                response = await client.get("/ready")
+                assert response.status_code == 200
+                assert response.json() == {"ready": True}
+
+    @pytest.mark.asyncio
+    async def test_shutdown_stops_every_worker(self, monkeypatch):
+        """Test that one worker failing to stop does not skip the others"""
+        stopped = []
+
+        async def broken_stop():
+            raise RuntimeError("database unavailable")
+
+        async def start():
+            pass
+
+        async def stop():
+            stopped.append(True)
+
+        async def warm_up_pool(engine):
+            pass
+
+        monkeypatch.setattr(main, "warm_up_pool", warm_up_pool)
+        monkeypatch.setattr(main, "DB_CREATE_SCHEMA", False)
+        workers = [
+            main.redirect_counter,
+            main.replica_router,
+            main.event_log,
+            main.shortcode_filter,
+        ]
+        for worker in workers:
+            monkeypatch.setattr(worker, "start", start)
+            monkeypatch.setattr(worker, "stop", stop)
+        monkeypatch.setattr(main.redirect_counter, "stop", broken_stop)
+
+        async with app.router.lifespan_context(app):
+            pass
+        assert len(stopped) == 3
@@ -0,0 +1,136 @@
+import io
+import json
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+import pytest_asyncio
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.transfer import Progress, export_mappings, import_mappings, parse_timestamp
+from app import crud
+
+# Use local SQLite databases for testing (async)
+source_engine = create_async_engine(
+    "sqlite+aiosqlite:///./test_crud.db", connect_args={"check_same_thread": False}
+)
+target_engine = create_async_engine(
+    "sqlite+aiosqlite:///./test.db", connect_args={"check_same_thread": False}
+)
+SourceSessionLocal = sessionmaker(
+    bind=source_engine, class_=AsyncSession, autocommit=False, autoflush=False
+)
+TargetSessionLocal = sessionmaker(
+    bind=target_engine, class_=AsyncSession, autocommit=False, autoflush=False
+)
+
+
+@pytest_asyncio.fixture
+async def databases():
+    """Creates an empty source and target database and fills the source."""
+    for engine in (source_engine, target_engine):
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+            await conn.run_sync(Base.metadata.create_all)
+
+    async with SourceSessionLocal() as session:
+        for i in range(25):
+            await crud.create_url_mapping(
+                session, f"https://www.example.com/{i}", f"code{i}"
+            )
+        await crud.redirect_url_mapping(session, "code0")
+        await crud.create_deduplicated_url_mapping(
+            session, "https://www.example.com/dedup"
+        )
+
+
+def quiet_progress(action):
+    return Progress(action, stream=io.StringIO())
+
+
+class TestTransfer:
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("fmt", ["ndjson", "csv"])
+    async def test_round_trip(self, databases, fmt):
+        """Should copy every mapping and its stats through an export file."""
+        output = io.BytesIO()
+        exported = await export_mappings(
+            source_engine, output, fmt, chunk_size=10, progress=quiet_progress("out")
+        )
+        assert exported == 26
+
+        imported = await import_mappings(
+            target_engine,
+            io.BytesIO(output.getvalue()),
+            fmt,
+            chunk_size=10,
+            progress=quiet_progress("in"),
+        )
+        assert imported == 26
+
+        async with SourceSessionLocal() as source, TargetSessionLocal() as target:
+            for shortcode in ("code0", "code24"):
+                original = await crud.get_url_mapping(source, shortcode)
+                copy = await crud.get_url_mapping(target, shortcode)
+                assert copy.original_url == original.original_url
+                assert copy.update_id == original.update_id
+                assert copy.redirect_count == original.redirect_count
+                assert copy.last_redirect == original.last_redirect
+            # The deduplicated mapping is still found for its URL
+            assert await crud.create_deduplicated_url_mapping(
+                target, "https://www.example.com/dedup"
+            ) == await crud.create_deduplicated_url_mapping(
+                source, "https://www.example.com/dedup"
+            )
+
+    @pytest.mark.asyncio
+    async def test_import_skips_existing(self, databases):
+        """Should skip mappings whose shortcode already exists."""
+        output = io.BytesIO()
+        await export_mappings(source_engine, output, progress=quiet_progress("out"))
+
+        progress = quiet_progress("in")
+        imported = await import_mappings(
+            source_engine, io.BytesIO(output.getvalue()), progress=progress
+        )
+        assert imported == 0
+        assert progress.skipped == 26
+        assert "skipped 26 existing" in progress.stream.getvalue()
+
+    @pytest.mark.asyncio
+    async def test_import_skips_reserved(self, databases):
+        """Should skip rows with a reserved shortcode and import the rest."""
+        lines = [
+            {"shortcode": shortcode, "original_url": "https://example.com/"}
+            for shortcode in ("first", "admin", "last")
+        ]
+        source = io.BytesIO(
+            "".join(
+                json.dumps({**line, "update_id": str(uuid.uuid4())}) + "\n"
+                for line in lines
+            ).encode()
+        )
+
+        progress = quiet_progress("in")
+        assert await import_mappings(target_engine, source, progress=progress) == 2
+        assert progress.reserved == 1
+        assert "skipped 1 reserved" in progress.stream.getvalue()
+        async with TargetSessionLocal() as target:
+            assert await crud.get_url_mapping(target, "last") is not None
+
+
+class TestParseTimestamp:
+
+    def test_formats(self):
+        expected = datetime(2025, 8, 6, 10, 30, 0, 120000, tzinfo=timezone.utc)
+        assert parse_timestamp("2025-08-06T10:30:00.12+00:00") == expected
+        assert parse_timestamp("2025-08-06 10:30:00.12+00") == expected
+        assert parse_timestamp("2025-08-06T10:30:00.120000Z") == expected
+        assert parse_timestamp("2025-08-06 10:30:00") == datetime(2025, 8, 6, 10, 30)
+        assert parse_timestamp("") is None
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            parse_timestamp("yesterday")
@@ -1,9 +1,13 @@
 import pytest
 from app.utils import (
     generate_shortcode,
+    encode_shortcode,
     is_valid_url,
     is_valid_shortcode,
     is_auto_generated_shortcode_valid,
+    normalize_update_id,
+    normalize_url,
+    url_hash,
 )
 
 
@@ -24,6 +28,14 @@ class TestShortcodeGeneration:
         )
         assert all(c in valid_chars for c in shortcode)
 
+    def test_encode_shortcode(self):
+        assert encode_shortcode(0) == "aaaaaa"
+        assert encode_shortcode(63**6 - 1) == "______"
+        assert encode_shortcode(1, length=2) == "ab"
+
+        with pytest.raises(ValueError):
+            encode_shortcode(63**6)
+
 
 class TestURLValidation:
 
@@ -68,7 +80,7 @@ class TestShortcodeValidation:
             ), f"Shortcode should be valid: {shortcode}"
 
     def test_invalid_shortcodes(self):
-        invalid_shortcodes = ["", None]
+        invalid_shortcodes = ["", None, "ready", "metrics", "stats", "docs"]
         for shortcode in invalid_shortcodes:
             assert not is_valid_shortcode(
                 shortcode
@@ -88,3 +100,36 @@ class TestShortcodeValidation:
             assert not is_auto_generated_shortcode_valid(
                 shortcode
             ), f"Auto shortcode should be invalid: {shortcode}"
+
+
+class TestUpdateIdNormalization:
+
+    def test_normalize_update_id(self):
+        canonical = "0123abcd-0123-abcd-0123-abcd0123abcd"
+        assert normalize_update_id(canonical) == canonical
+        assert normalize_update_id(canonical.upper()) == canonical
+        assert normalize_update_id(canonical.replace("-", "")) == canonical
+
+        for update_id in ["nonexistent", "", "0123abcd-0123", None]:
+            assert normalize_update_id(update_id) is None
+
+
+class TestURLNormalization:
+
+    def test_normalize_url(self):
+        assert normalize_url("HTTPS://Example.COM:443") == "https://example.com/"
+        assert (
+            normalize_url("http://user@Example.com:80/a") == "http://user@example.com/a"
+        )
+        assert normalize_url("http://[::1]:8080") == "http://[::1]:8080/"
+        # Path, query and fragment can change where a URL leads
+        assert (
+            normalize_url("https://example.com/Path?A=B#Top")
+            == "https://example.com/Path?A=B#Top"
+        )
+
+    def test_url_hash(self):
+        digest = url_hash("https://example.com/")
+        assert len(digest) == 16
+        assert url_hash("HTTPS://EXAMPLE.com") == digest
+        assert url_hash("https://example.com/?") != url_hash("https://example.com/a")